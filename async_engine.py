@@ -0,0 +1,316 @@
+"""async_engine.py
+
+asyncio version of the pick-by-light controller in fml.py. The rack socket is
+driven by a `DatagramProtocol`, so waiting for a button press never blocks the
+event loop and other work (logging, monitoring, a second input source) can run
+in the same process. Both controllers run the same task logic from pick_steps.py,
+so the task semantics are those of `fml.runPickPath` and `fml.run_all_pick_tasks`,
+and send display updates the same way, through sinks.py with a DisplayShadow;
+fml.py remains the blocking entry point.
+    $ python async_engine.py
+"""
+import asyncio
+import logging
+import os
+import time
+from models import PickingTask
+import pick_steps
+import utils
+from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS, PICK_BY_LIGHT_RACK_ADDRESS, PICK_BY_LIGHT_PORT, \
+    BUTTON_DEBOUNCE_WINDOW
+from packets import PacketParser, BUTTON_HIGH, HEARTBEAT
+from debounce import Debouncer
+from shadow import DisplayShadow
+from scheduler import SendScheduler
+from sinks import UdpRackSink, VisualizerSink, UpdateBatch, build_update, send_update
+
+# Setup logging
+logger = logging.getLogger(os.path.basename(__file__))
+logger = utils.configure_logger(logger)
+
+
+class RackProtocol(asyncio.DatagramProtocol):
+    """Receives rack packets and hands every button press to a callback.
+
+    Args:
+        on_press (callable): called with the display id of each press
+        parser (PacketParser): parser used to classify incoming packets
+        debouncer (Debouncer): drops repeated presses, None to keep them all
+        metrics (Metrics): optional registry packets are counted in, like in fml.press
+    """
+
+    def __init__(self, on_press, parser=None, debouncer=None, metrics=None):
+        self.on_press = on_press
+        self.parser = parser or PacketParser()
+        self.debouncer = debouncer
+        self.metrics = metrics
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        event = self.parser.parse(data)
+        if event.kind is BUTTON_HIGH:
+            if self.debouncer is None or self.debouncer.accept(event.tag, event.timestamp):
+                self._count('presses')
+                self.on_press(event.tag)
+            else:
+                self._count('presses_debounced')
+        elif event.kind is HEARTBEAT:
+            self._count('heartbeats')
+        else:
+            self._count('other_packets')
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.increment(name)
+
+    def error_received(self, exc):
+        logger.warning('Rack socket error: %s', exc)
+
+
+class AsyncPickController(object):
+    """Runs pick tasks against the rack as coroutines.
+
+    Display updates go to the rack sink, and the visualizer if there is one,
+    through the controller's own DisplayShadow, so unchanged displays are
+    skipped like in fml.
+
+    Args:
+        transport (asyncio.DatagramTransport): transport used to send frames
+        rack_address (tuple): address the display frames are sent to
+        visualizer (LightRackVisualizer): optional visualizer to mirror the rack on
+        press_timeout (float): default number of seconds to wait for a press,
+            or None to wait forever
+        displays (list): displays this controller owns; when given, reset()
+            only clears these instead of addressing every display on the rack
+        log (logging.Logger): logger for task progress, defaults to this module's
+        rack_sink (UdpRackSink): sink to send frames to the rack with, e.g. one
+            shared by several controllers; defaults to one over `transport`
+        metrics (Metrics): optional registry the task, press and display
+            metrics of fml are recorded to
+    """
+
+    def __init__(self, transport=None, rack_address=PICK_BY_LIGHT_RACK_ADDRESS, visualizer=None, press_timeout=None,
+                 displays=None, log=None, rack_sink=None, metrics=None):
+        self.transport = transport
+        self.metrics = metrics
+        self.rack_sink = rack_sink or UdpRackSink(transport, rack_address, metrics=metrics)
+        self.sinks = [self.rack_sink]
+        if visualizer is not None:
+            self.sinks.append(VisualizerSink(visualizer))
+        self.shadow = DisplayShadow()
+        self.press_timeout = press_timeout
+        self.displays = list(displays) if displays is not None else None
+        self.log = log or logger
+        self.presses = asyncio.Queue()  # (display, time.monotonic() it was received)
+        # time.monotonic() at which the last press returned by press() was received
+        self.last_press_at = None
+
+    def feed_press(self, display):
+        """Queues a button press; usable as the `RackProtocol` callback."""
+        self.presses.put_nowait((display, time.monotonic()))
+
+    def change_display(self, display=None, all_displays=False, number=None, layout=None, force=False, priority=True):
+        """Changes a display, like `fml.ChangeDisplay`. Sending never blocks.
+
+        Returns:
+            response (int): number of bytes sent, 0 if the update was skipped
+        """
+        if all_displays:
+            display = ALL_DISPLAYS
+
+        return send_update(self.sinks, self.shadow, build_update(display, number, layout), priority, force,
+                           self.metrics)
+
+    def reset(self):
+        """Clears the displays, like `fml.reset`.
+
+        A controller owning only some displays clears those that are lit or
+        whose state is unknown, and leaves the rest of the rack alone.
+        """
+        if self.displays is None:
+            self.change_display(all_displays=True, layout=EMPTY_LIGHT_LAYOUT, force=True, priority=False)
+        else:
+            with self.display_batch() as batch:
+                for display in self.displays:
+                    batch.set(display, layout=EMPTY_LIGHT_LAYOUT)
+
+    async def press(self, timeout=None):
+        """Waits for the next button press.
+
+        Args:
+            timeout (float): seconds to wait, defaults to `press_timeout`
+
+        Returns:
+            display (str): id of display corresponding to button pressed
+
+        Raises:
+            asyncio.TimeoutError: if no button was pressed in time
+        """
+        if timeout is None:
+            timeout = self.press_timeout
+        display, self.last_press_at = await asyncio.wait_for(self.presses.get(), timeout)
+        return display
+
+    def display_batch(self):
+        """Returns a batch of display changes, sent back to back when it is flushed."""
+        return UpdateBatch(self.sinks, self.shadow, metrics=self.metrics)
+
+    def init_displays(self, pickpath):
+        pick_steps.init_displays(pickpath, self.display_batch, self.log, self.metrics)
+
+    async def run_steps(self, steps):
+        """Runs pick_steps steps, waiting for presses and pauses without blocking the loop.
+
+        Frames sent while the steps handle a press are timed from it, see
+        UdpRackSink. The steps run without awaiting, so this holds even when
+        several controllers share the rack sink.
+        """
+        reply = None
+        try:
+            while True:
+                self.rack_sink.pressed_at = self.last_press_at if reply is not None else None
+                request = steps.send(reply)
+                reply = None
+                if request is pick_steps.PRESS:
+                    reply = await self.press()
+                else:
+                    await asyncio.sleep(request)
+        except StopIteration:
+            pass
+        finally:
+            self.rack_sink.pressed_at = None
+            steps.close()
+
+    async def run_all_pick_tasks(self, pick_tasks):
+        """Runs every pick task in order, resetting the displays between tasks.
+
+        Displays are reset if the coroutine is cancelled or a press times out.
+        """
+        try:
+            await self.run_steps(pick_steps.run_all_pick_tasks(
+                pick_tasks, self.change_display, self.display_batch, self.reset, self.log, metrics=self.metrics,
+                pressed_at=self._pressed_at))
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            self.reset()
+            raise
+
+    async def run_pick_path(self, pickpath):  # type: (PickingTask) -> None
+        """Runs a full pick path, see `fml.runPickPath`."""
+        await self.run_steps(pick_steps.run_pick_path(pickpath, self.change_display, self.display_batch, self.log,
+                                                      self.metrics, self._pressed_at))
+
+    def _pressed_at(self):
+        return self.last_press_at
+
+
+def create_scheduler(transport, rate=200.0, burst=10, repeats=0, metrics=None):
+    """Returns a started SendScheduler sending frames over `transport`.
+
+    The scheduler's thread may not write to the transport, so it hands every
+    frame to the running event loop instead.
+
+    Args:
+        transport (asyncio.DatagramTransport): transport used to send frames
+        rate (float): frames per second on average, None for no limit
+        burst (int): frames that may be sent back to back
+        repeats (int): times every frame is sent again, for lossy networks
+        metrics (Metrics): optional registry the scheduler's metrics are reported to
+
+    Returns:
+        scheduler (SendScheduler): the started scheduler
+    """
+    loop = asyncio.get_running_loop()
+
+    def send(frame, address):
+        loop.call_soon_threadsafe(transport.sendto, frame, address)
+
+    return SendScheduler(send, rate=rate, burst=burst, repeats=repeats, metrics=metrics).start()
+
+
+async def create_controller(local_address=('', PICK_BY_LIGHT_PORT), rack_address=PICK_BY_LIGHT_RACK_ADDRESS,
+                            debounce_window=BUTTON_DEBOUNCE_WINDOW, send_rate=None, **kwargs):
+    """Opens the rack socket on the running loop and returns a controller using it.
+
+    Args:
+        local_address (tuple): address to receive button presses on
+        rack_address (tuple): address the display frames are sent to
+        debounce_window (float): seconds during which repeated presses are dropped
+        send_rate (float): pace frames to the rack at this many frames per second, None to send directly
+        **kwargs: passed on to `AsyncPickController`, including its `metrics`, which the
+            socket and scheduler also report to
+
+    Returns:
+        controller (AsyncPickController): controller bound to the new socket
+    """
+    loop = asyncio.get_running_loop()
+    metrics = kwargs.get('metrics')
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: RackProtocol(None, debouncer=Debouncer(window=debounce_window), metrics=metrics),
+        local_addr=local_address,
+        allow_broadcast=True,
+    )
+    # Nothing is received before the next await, so no press is missed
+    scheduler = create_scheduler(transport, send_rate, metrics=metrics) if send_rate is not None else None
+    controller = AsyncPickController(transport=transport,
+                                     rack_sink=UdpRackSink(transport, rack_address, scheduler, metrics=metrics),
+                                     **kwargs)
+    protocol.on_press = controller.feed_press
+    return controller
+
+
+async def run_pick_tasks(pick_tasks, **kwargs):
+    """Runs the pick tasks on a fresh rack socket and closes it afterwards."""
+    controller = await create_controller(**kwargs)
+    try:
+        controller.reset()
+        await controller.run_all_pick_tasks(pick_tasks)
+    finally:
+        controller.reset()
+        controller.rack_sink.close()
+        controller.transport.close()
+
+
+def main(method=None, task_type=None, task_file=None, log_filename=None, metrics=None):
+    pickpaths = utils.get_pick_paths_from_user_choice(method=method, task_type=task_type, task_file=task_file)
+
+    if log_filename is None:
+        log_filename = input("What file do you want to write to? ")
+    utils.configure_file_logger(logger, log_filename, jsonl_filename=utils.jsonl_filename_for(log_filename))
+
+    asyncio.run(run_pick_tasks(pickpaths, metrics=metrics))
+
+
+if __name__ == "__main__":
+    import argparse
+    from task_catalog import add_task_file_arguments
+
+    parser = argparse.ArgumentParser(description='Run pick-by-light tasks on the rack with asyncio.')
+    parser.add_argument('--log', help='file to write the log to, asked for if not given')
+    parser.add_argument('--metrics-file', help='JSON file to write latency and counter metrics to periodically')
+    parser.add_argument('--metrics-interval', type=float, default=5.0, help='seconds between metrics file writes')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics on http://127.0.0.1:PORT/metrics')
+    add_task_file_arguments(parser)
+    args = parser.parse_args()
+
+    from metrics import Metrics, MetricsFileWriter, serve_metrics
+
+    metrics = Metrics()
+    metrics_writer = metrics_server = None
+    if args.metrics_file:
+        metrics_writer = MetricsFileWriter(metrics, args.metrics_file, interval=args.metrics_interval).start()
+    if args.metrics_port:
+        metrics_server = serve_metrics(metrics, ('127.0.0.1', args.metrics_port))
+
+    try:
+        main(args.method, args.task_type, args.task_file, args.log, metrics=metrics)
+    except KeyboardInterrupt:
+        print("Handling keyboard interrupt. Resetting displays")
+    finally:
+        print("\nExperiment Complete.")
+        if metrics_writer is not None:
+            metrics_writer.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
@@ -0,0 +1,61 @@
+"""bench_frames.py
+
+Microbenchmark for building a display update frame, before and after the
+precomputed frame table in frames.py. Run from the repository root:
+    $ python benchmarks/bench_frames.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from frames import FRAMES, rightdisplay, leftdisplay, XPL_MESSAGE_PREFIX, XPL_MESSAGE_INFIX, XPL_MESSAGE_SUFFIX
+
+UPDATES = [('A%d%d' % (row, col), number) for row in range(1, 5) for col in range(1, 4) for number in (0, 7, 42, 99)]
+
+
+def number_convert_before(number):
+    # fml.NumberConvert as it was before the frame table
+    onesdigit = number % 10
+    number //= 10
+    tensdigit = number % 10
+
+    if tensdigit == 0:
+        return rightdisplay[str(onesdigit)]
+    else:
+        return leftdisplay[str(tensdigit)] + rightdisplay[str(onesdigit)]
+
+
+def frame_before(display, number):
+    # fml.ChangeDisplay message construction as it was before the frame table
+    message = XPL_MESSAGE_PREFIX + display + XPL_MESSAGE_INFIX + str(number_convert_before(number)) + XPL_MESSAGE_SUFFIX
+    return message.encode('utf-8')
+
+
+def run_before():
+    for display, number in UPDATES:
+        frame_before(display, number)
+
+
+def run_after():
+    number_frame = FRAMES.number
+    for display, number in UPDATES:
+        number_frame(display, number)
+
+
+def main(repeat=5, number=2000):
+    for display, value in UPDATES:
+        assert frame_before(display, value) == FRAMES.number(display, value)
+
+    results = {}
+    for name, func in (('before', run_before), ('after', run_after)):
+        best = min(timeit.repeat(func, repeat=repeat, number=number))
+        results[name] = best / (number * len(UPDATES)) * 1e9
+        print('%-8s %8.1f ns per update' % (name, results[name]))
+
+    print('speedup  %8.1fx' % (results['before'] / results['after']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""bench_packets.py
+
+Benchmark for classifying rack packets, comparing the parsing that used to
+live in fml.press with packets.PacketParser on a mix of packets shaped like
+the rack's traffic (mostly heartbeats, some presses and releases). Run from
+the repository root:
+    $ python benchmarks/bench_packets.py
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from constants import SOURCE_BINS, RECEIVE_BINS
+from packets import PacketParser, BUTTON_HIGH, build_heartbeat, build_button_packet
+
+TAGS = SOURCE_BINS + RECEIVE_BINS
+
+# (name, heartbeat share, press share); the rest are button releases
+MIXES = [
+    ('idle', 0.98, 0.01),
+    ('picking', 0.80, 0.10),
+    ('presses-only', 0.0, 1.0),
+]
+
+
+def make_packets(heartbeat_share, press_share, count=1000, seed=0):
+    rng = random.Random(seed)
+    packets = []
+    for _ in range(count):
+        tag = rng.choice(TAGS)
+        roll = rng.random()
+        if roll < heartbeat_share:
+            packets.append(build_heartbeat(tag))
+        elif roll < heartbeat_share + press_share:
+            packets.append(build_button_packet(tag, 'HIGH'))
+        else:
+            packets.append(build_button_packet(tag, 'LOW'))
+    return packets
+
+
+def classify_before(data):
+    # fml.press as it was before packets.PacketParser
+    if data and "hbeat".encode("utf-8") not in data:
+        if ("HIGH".encode('utf-8') in data):
+            display = re.findall('[ABC]\\d{2}'.encode("utf-8"), data)[0].decode()
+
+            return display
+
+
+def main(repeat=5, number=20):
+    parser = PacketParser()
+
+    def classify_after(data):
+        event = parser.parse(data)
+        if event.kind is BUTTON_HIGH:
+            return event.tag
+
+    for name, heartbeat_share, press_share in MIXES:
+        packets = make_packets(heartbeat_share, press_share)
+        assert [classify_before(p) for p in packets] == [classify_after(p) for p in packets]
+
+        results = {}
+        for label, classify in (('before', classify_before), ('after', classify_after)):
+            best = min(timeit.repeat(lambda: [classify(p) for p in packets], repeat=repeat, number=number))
+            results[label] = best / (number * len(packets)) * 1e9
+
+        print('%-14s before %7.1f ns  after %7.1f ns per packet' % (name, results['before'], results['after']))
+
+
+if __name__ == '__main__':
+    main()
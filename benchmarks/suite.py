@@ -0,0 +1,432 @@
+"""suite.py
+
+Benchmark suite for the hot paths, with stored baselines. Every benchmark runs
+offline; those involving the network talk to a RackSimulator or a socket on
+loopback. Run from the repository root:
+    $ python benchmarks/suite.py                   # run all, compare to the baselines
+    $ python benchmarks/suite.py press_loopback    # run the benchmarks whose name starts with this
+    $ python benchmarks/suite.py --save            # store the results as the new baselines
+
+A benchmark regresses when its time per operation is more than `--threshold`
+(default 25%) above its baseline; the exit status is then 1.
+
+Baselines depend on the machine. Next to them, --save stores the time of a
+fixed calibration loop, and every run times that loop again and scales the
+baselines by how much faster or slower this machine is. That absorbs most of
+the difference between machines, but not all of it, so before gating on the
+suite somewhere new, regenerate the baselines there with --save.
+"""
+import collections
+import gc
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, os.pardir))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, os.pardir, 'logs'))
+
+from constants import SOURCE_BINS, RECEIVE_BINS
+
+BASELINES_FILENAME = os.path.join(BENCHMARKS_DIR, 'baselines.json')
+SAMPLE_LOG_FILENAME = os.path.join(BENCHMARKS_DIR, os.pardir, 'logs', 'theo-pick-by-light_button-testing.log')
+
+# A benchmark's setup returns a Case: `run()` performs `ops` operations,
+# `teardown()`, if given, undoes the setup, and `threshold`, if given,
+# replaces --threshold for benchmarks that are noisier than the rest
+Case = collections.namedtuple('Case', ['run', 'ops', 'teardown', 'threshold'])
+Case.__new__.__defaults__ = (None, None)
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """Registers a benchmark setup function under `name`."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def make_task_document(num_tasks, orders_per_task=3, bins_per_order=4, seed=0):
+    """Returns a task file's contents with `num_tasks` random tasks."""
+    rng = random.Random(seed)
+    return {
+        'version': '1.2',
+        'tasks': [{
+            'taskId': task_id,
+            'orders': [{
+                'orderId': order_id,
+                'receivingBinTag': RECEIVE_BINS[order_id % len(RECEIVE_BINS)],
+                'sourceBins': [{'binTag': tag, 'numItems': rng.randint(1, 5)}
+                               for tag in rng.sample(SOURCE_BINS, bins_per_order)],
+            } for order_id in range(1, orders_per_task + 1)],
+        } for task_id in range(1, num_tasks + 1)],
+    }
+
+
+@benchmark('number_convert')
+def bench_number_convert():
+    import fml
+    numbers = list(range(100)) * 10
+
+    def run():
+        number_convert = fml.NumberConvert
+        for number in numbers:
+            number_convert(number)
+    return Case(run, len(numbers))
+
+
+@benchmark('change_display')
+def bench_change_display():
+    import fml
+    from sinks import NullSink
+    updates = [(tag, number) for tag in SOURCE_BINS + RECEIVE_BINS for number in (0, 7, 42, 99)]
+    sinks = fml.sinks[:]
+    fml.sinks[:] = [NullSink()]
+
+    def run():
+        change_display = fml.ChangeDisplay
+        for display, number in updates:
+            change_display(display=display, number=number, force=True)
+
+    def teardown():
+        fml.sinks[:] = sinks
+    return Case(run, len(updates), teardown)
+
+
+@benchmark('packet_classification')
+def bench_packet_classification():
+    from bench_packets import make_packets
+    from packets import PacketParser
+    packets = make_packets(0.8, 0.1)
+    parser = PacketParser()
+
+    def run():
+        parse = parser.parse
+        for packet in packets:
+            parse(packet)
+    return Case(run, len(packets))
+
+
+@benchmark('press_loopback')
+def bench_press_loopback():
+    """Sends a mix of rack packets over loopback and reads them back with fml.press()."""
+    import fml
+    from bench_packets import make_packets
+    packets = make_packets(0.8, 0.1, count=256)
+
+    window = fml.debouncer.window
+    fml.debouncer.window = 0
+    fml.open_socket(local_address=('127.0.0.1', 0))
+    address = fml.sockhub.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def run():
+        sendto = sender.sendto
+        for packet in packets:
+            sendto(packet, address)
+        press = fml.press
+        for _ in packets:
+            press()
+
+    def teardown():
+        sender.close()
+        fml.close_sinks()
+        fml.sockhub.close()
+        fml.sockhub = None
+        fml.debouncer.window = window
+    return Case(run, len(packets), teardown)
+
+
+def _bench_parse_experiment(num_tasks, rounds=1):
+    import utils
+    document = make_task_document(num_tasks)
+
+    def run():
+        for _ in range(rounds):
+            utils.parseExperimentDictionary(document)
+    return Case(run, num_tasks * rounds)
+
+
+@benchmark('parse_experiment_small')
+def bench_parse_experiment_small():
+    # One parse of 10 tasks is too short to time on its own
+    return _bench_parse_experiment(10, rounds=200)
+
+
+@benchmark('parse_experiment_large')
+def bench_parse_experiment_large():
+    return _bench_parse_experiment(1000)
+
+
+@benchmark('parse_experiment_very_large')
+def bench_parse_experiment_very_large():
+    return _bench_parse_experiment(20000)
+
+
+@benchmark('task_cache_load_large')
+def bench_task_cache_load_large():
+    """Loads 1000 tasks from a warm compiled task cache."""
+    import task_cache
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'tasks.json')
+    with open(filename, 'w') as f:
+        json.dump(make_task_document(1000), f)
+    cache_dir = os.path.join(directory, 'cache')
+    task_cache.compile_task_file(filename, cache_dir)
+
+    def run():
+        task_cache.load_picking_tasks(filename, cache_dir)
+    return Case(run, 1000, lambda: shutil.rmtree(directory))
+
+
+class HeadlessCanvas(object):
+    """Stands in for a Tk canvas when there is no display, keeping only item options."""
+
+    def __init__(self):
+        self.items = {}
+
+    def _create(self, *args, **options):
+        item = len(self.items) + 1
+        self.items[item] = options
+        return item
+
+    create_rectangle = create_text = _create
+
+    def itemconfigure(self, item, **options):
+        self.items[item].update(options)
+
+
+@benchmark('visualizer_render')
+def bench_visualizer_render():
+    """Redraws every bin of a LightRackVisualizer, on a hidden Tk window if there is a display."""
+    import visualize
+    root = None
+    try:
+        root = visualize.tk.Tk()
+        root.withdraw()
+        canvas = visualize.tk.Canvas(master=root)
+    except visualize.tk.TclError:
+        canvas = HeadlessCanvas()
+    visualizer = visualize.LightRackVisualizer(canvas=canvas)
+    for i, bin_tag in enumerate(visualize.BINS):
+        if i % 2:
+            visualizer.active_bins[bin_tag] = i
+
+    def run():
+        for _ in range(100):
+            visualizer._render()
+    return Case(run, 100, root.destroy if root is not None else None)
+
+
+@benchmark('pdf_render_task')
+def bench_pdf_render_task():
+    import paper_generator
+    directory = tempfile.mkdtemp()
+    tasks = make_task_document(20)['tasks']
+    jobs = [('pick-by-paper_none', 'testing', i + 1, False, task, os.path.join(directory, '%d.pdf' % i))
+            for i, task in enumerate(tasks)]
+
+    def run():
+        for job in jobs:
+            paper_generator.render_task_pdf(job)
+    return Case(run, len(jobs), lambda: shutil.rmtree(directory))
+
+
+@benchmark('log_parsing')
+def bench_log_parsing():
+    """Streams a log of the sample log repeated 50 times through log_parser, per line."""
+    import log_parser
+    with open(SAMPLE_LOG_FILENAME) as f:
+        sample = f.read()
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'subject.log')
+    with open(filename, 'w') as f:
+        for _ in range(50):
+            f.write(sample)
+    num_lines = sample.count('\n') * 50
+
+    def run():
+        log_parser.analyze_file(filename)
+    return Case(run, num_lines, lambda: shutil.rmtree(directory))
+
+
+@benchmark('simulated_rack')
+def bench_simulated_rack():
+    """Runs pick tasks in fml against a RackSimulator on loopback, per button press."""
+    import rack_simulator
+    pick_tasks = rack_simulator.generate_pick_tasks(50)
+    presses = []
+
+    def run():
+        results = rack_simulator.run_load_test(pick_tasks)
+        presses.append(results['presses'])
+    # Every run presses the same buttons, the picker is seeded
+    run()
+    # Three threads and the loopback stack make this one noisy
+    return Case(run, presses[0], threshold=1.0)
+
+
+def calibration_case():
+    """A fixed mix of the dict, list, string and integer work the benchmarks do.
+
+    Its code never changes, so its time only depends on the machine and the
+    interpreter, and scales the baselines to the machine the suite runs on.
+    """
+    tags = ['%s%d%d' % (rack, row, col) for rack in 'AB' for row in range(1, 5) for col in range(1, 4)]
+
+    def run():
+        counts = {}
+        for i in range(2000):
+            tag = tags[i % len(tags)]
+            counts[tag] = counts.get(tag, 0) + i % 7
+            '%s = %d' % (tag, counts[tag])
+        sorted(counts.items(), key=lambda item: item[1])
+    return Case(run, 2000)
+
+
+def measure_calibration(repeat=20):
+    """Returns the best seconds per operation of `repeat` runs of the calibration loop."""
+    return time_case(calibration_case(), repeat, warmup=0.1)[0]
+
+
+def run_benchmark(name, repeat, warmup=0.5, min_time=1.0):
+    """Returns the best seconds per operation of a benchmark over at least `repeat` runs, and its threshold.
+
+    The benchmark is first run for at least `warmup` seconds, so caches are
+    warm and the CPU has left its idle clock speed before timing starts. Runs
+    are then timed until there were `repeat` of them and `min_time` seconds
+    passed, so short benchmarks are not all timed while the machine is busy.
+    """
+    return time_case(BENCHMARKS[name](), repeat, warmup, min_time)
+
+
+def time_case(case, repeat, warmup=0.5, min_time=0):
+    """Returns the best seconds per operation of a Case over at least `repeat` runs, and its threshold."""
+    try:
+        warmup_end = time.perf_counter() + warmup
+        case.run()
+        while time.perf_counter() < warmup_end:
+            case.run()
+
+        # Like timeit, keep garbage collection out of the timings
+        timings = []
+        timing_end = time.perf_counter() + min_time
+        while len(timings) < repeat or time.perf_counter() < timing_end:
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                case.run()
+                timings.append((time.perf_counter() - start) / case.ops)
+            finally:
+                gc.enable()
+    finally:
+        if case.teardown is not None:
+            case.teardown()
+    return min(timings), case.threshold
+
+
+def load_baselines(filename=BASELINES_FILENAME):
+    """Returns the stored baselines and the calibration time they were saved with, None if unknown."""
+    try:
+        with open(filename) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}, None
+    if 'baselines' not in stored:
+        # Saved before calibration was stored
+        return stored, None
+    return stored['baselines'], stored.get('calibration')
+
+
+def save_baselines(baselines, calibration, filename=BASELINES_FILENAME):
+    with open(filename, 'w') as f:
+        json.dump({'calibration': calibration, 'baselines': baselines}, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return '%8.2f %-2s' % (seconds * scale, unit)
+    return '%8.1f ns' % (seconds * 1e9)
+
+
+def main(names=None, repeat=7, threshold=0.25, save=False):
+    baselines, saved_calibration = load_baselines()
+    selected = [name for name in BENCHMARKS if not names or any(name.startswith(prefix) for prefix in names)]
+
+    # Other work on the machine can slow it down for seconds at a time, so the
+    # calibration loop is timed between the benchmarks and its best time kept
+    calibration = measure_calibration()
+    results = collections.OrderedDict()
+    thresholds = {}
+    for name in selected:
+        results[name], thresholds[name] = run_benchmark(name, repeat)
+        calibration = min(calibration, measure_calibration())
+
+    scale = 1.0
+    if saved_calibration:
+        scale = calibration / saved_calibration
+        print('Calibration: %s per op, %s when the baselines were saved, baselines scaled by %.2f' %
+              (format_time(calibration).strip(), format_time(saved_calibration).strip(), scale))
+    elif baselines and not save:
+        print('The baselines have no calibration, run with --save to store one; comparing them unscaled')
+
+    regressions = []
+    print('%-28s %11s %11s %8s' % ('benchmark', 'per op', 'baseline', 'change'))
+    for name, seconds in results.items():
+        baseline = baselines.get(name)
+        if baseline:
+            baseline *= scale
+            change = seconds / baseline - 1
+            status = ''
+            case_threshold = thresholds[name]
+            if change > (threshold if case_threshold is None else case_threshold):
+                status = 'REGRESSION'
+                regressions.append(name)
+            print('%-28s %11s %11s %+7.1f%% %s' % (name, format_time(seconds), format_time(baseline),
+                                                     change * 100, status))
+        else:
+            print('%-28s %11s %11s' % (name, format_time(seconds), '-'))
+
+    if save:
+        if saved_calibration:
+            # Keep the baselines not run this time comparable with the new calibration
+            baselines = {name: baseline * scale for name, baseline in baselines.items()}
+        baselines.update(results)
+        save_baselines(baselines, calibration)
+        print('Saved %d baselines to %s' % (len(results), BASELINES_FILENAME))
+    elif regressions:
+        print('%d benchmarks regressed past their threshold: %s' % (len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and compare to the stored baselines.')
+    parser.add_argument('names', nargs='*', help='only run benchmarks whose name starts with one of these')
+    parser.add_argument('--repeat', type=int, default=7, help='least timed runs per benchmark, the best is kept')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown over the baseline counted as a regression (default: 0.25)')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        sys.exit(0)
+
+    # Keep the benchmarked modules' debug logging out of the timings
+    logging.disable(logging.WARNING)
+    sys.exit(main(args.names, repeat=args.repeat, threshold=args.threshold, save=args.save))
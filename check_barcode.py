@@ -3,7 +3,7 @@
 This modules works as part of the paper system at the Georgia Tech
 Contextual Computing Group's dense pick setup located in TSRB Lab 243. Run with 
 a json file, usually called pick_tasks.json
-    $ python check_barcode.py pick_tasks.json
+    $ python check_barcode.py --task-file pick_tasks.json
 
 Todo:
     * Write log file according to Theo's example
@@ -11,8 +11,6 @@ Todo:
     * Fix docstrings (esp ChangeDisplay)
     * Change recvfrom to recv in receivePackets func
 """
-import json
-import copy
 import logging
 import os
 import utils
@@ -27,8 +25,17 @@ logger = utils.configure_logger(logger)
 carts = ["C11", "C12", "C13"]
 
 
+BARCODE_PREFIX_LENGTH = 4
+
+# BarcodeStation.scan outcomes
+SCANNED_SOURCE_BIN = 'source'
+SCANNED_RECEIVE_BIN = 'receive'
+UNEXPECTED_BARCODE = 'unexpected'
+STATION_DONE = 'done'
+
+
 def get_barcode_from_input():
-    barcode = input("Barcode: ")[4:]
+    barcode = input("Barcode: ")[BARCODE_PREFIX_LENGTH:]
     return barcode
 
 
@@ -36,51 +43,129 @@ def play_error_sound():
     print("\a")  # only checked on macOS
 
 
-def compareBarcode(pickpaths):
-    """Function that runs a full task with a set of carts and a list of pickpaths.
+class BarcodeStation(object):
+    """State machine of one paper-picking station, fed one scan at a time.
+
+    For each task, every source bin has to be scanned, in any order, and then
+    the receive bin. The barcodes expected by each task are precomputed, so a
+    scan is checked with one set lookup.
 
     Args:
-        cartSet (list): list of carts in a task, ordered
+        name (str): name of the station
+        pick_tasks (iterable): PickingTasks to run, in order
+        log (Logger): logger for the task and scan messages
+        on_error (callable): called after every unexpected scan
     """
-    for pickorder in pickpaths:  # type: PickingTask
-        logger.info("TASK START: %s" % pickorder)
 
-        expected_source_bins = set([bin.tag for bin in pickorder.source_bins])
-        logger.debug('\tExpecting source bins to be scanned: %s' % list(expected_source_bins))
+    def __init__(self, name, pick_tasks, log=logger, on_error=play_error_sound):
+        self.name = name
+        self.log = log
+        self.on_error = on_error
+        self.pick_tasks = iter(pick_tasks)
+
+        self.task = None  # type: PickingTask
+        self.started = False
+        self.expected_source_bins = set()
+        self.completed_tasks = 0
+        self.scans = 0
+        self.unexpected_scans = 0
+
+    @property
+    def done(self):
+        return self.started and self.task is None
+
+    def start(self):
+        """Starts the first task. Returns False if there are no tasks."""
+        self.started = True
+        return self._next_task()
+
+    def _next_task(self):
+        self.task = next(self.pick_tasks, None)
+        if self.task is None:
+            return False
+
+        pickorder = self.task
+        self.log.info("TASK START: %s", pickorder,
+                      extra={'event': 'task_start', 'task_id': pickorder.task_id, 'order_id': pickorder.order_id})
+        self.expected_source_bins = set(pickorder.source_bins_in_dict)
+        self.log.debug('\tExpecting source bins to be scanned: %s', list(self.expected_source_bins))
+        return True
+
+    def scan(self, barcode):
+        """Handles one scanned barcode, without its scanner prefix.
+
+        Returns:
+            outcome (str): SCANNED_SOURCE_BIN, SCANNED_RECEIVE_BIN, UNEXPECTED_BARCODE
+                or STATION_DONE if every task was already completed
+        """
+        pickorder = self.task
+        if pickorder is None:
+            return STATION_DONE
+        self.scans += 1
 
         # Wait for all source bins to be scanned
-        while expected_source_bins:
-            barcode = get_barcode_from_input()
-            if barcode not in expected_source_bins:
-                logger.warning('\t\tUnexpected barcode: %s' % barcode)
-                play_error_sound()
-            else:
-                logger.info('\t\tCorrect source bin barcode scanned: %s' % barcode)
-                expected_source_bins.remove(barcode)
-
-        # Wait for receive bin to be scanned
-        receive_bin_scanned = False
-        while not receive_bin_scanned:
-            barcode = get_barcode_from_input()
-            if barcode != pickorder.receive_bin.tag:
-                logger.info('\t\tUnexpected barcode: %s' % barcode)
-                play_error_sound()
-            else:
-                logger.info('\t\tCorrect receive bin barcode scanned: %s' % barcode)
-                receive_bin_scanned = True
-
-        logger.info("TASK END: %s" % pickorder)
-
-
-def main():
-    pickpaths = utils.get_pick_paths_from_user_choice()
+        if self.expected_source_bins:
+            if barcode not in self.expected_source_bins:
+                self.log.warning('\t\tUnexpected barcode: %s', barcode,
+                                 extra={'event': 'unexpected_scan', 'tag': barcode})
+                return self._unexpected()
+            self.log.info('\t\tCorrect source bin barcode scanned: %s', barcode,
+                          extra={'event': 'scan', 'tag': barcode})
+            self.expected_source_bins.remove(barcode)
+            return SCANNED_SOURCE_BIN
+
+        # Then wait for the receive bin to be scanned
+        if barcode != pickorder.receive_bin.tag:
+            self.log.info('\t\tUnexpected barcode: %s', barcode, extra={'event': 'unexpected_scan', 'tag': barcode})
+            return self._unexpected()
+        self.log.info('\t\tCorrect receive bin barcode scanned: %s', barcode,
+                      extra={'event': 'scan', 'tag': barcode})
+
+        self.log.info("TASK END: %s", pickorder,
+                      extra={'event': 'task_end', 'task_id': pickorder.task_id, 'order_id': pickorder.order_id})
+        self.completed_tasks += 1
+        self._next_task()
+        return SCANNED_RECEIVE_BIN
+
+    def _unexpected(self):
+        self.unexpected_scans += 1
+        if self.on_error is not None:
+            self.on_error()
+        return UNEXPECTED_BARCODE
+
+
+def compareBarcode(pickpaths, get_barcode=get_barcode_from_input, on_error=play_error_sound):
+    """Function that runs a full task with a set of carts and a list of pickpaths.
+
+    Args:
+        pickpaths (list): PickingTasks to run, in order
+        get_barcode (callable): returns the next scanned barcode, by default read from the console
+        on_error (callable): called after every unexpected scan
+    """
+    station = BarcodeStation('console', pickpaths, on_error=on_error)
+    station.start()
+    while not station.done:
+        station.scan(get_barcode())
+
+
+def main(method=None, task_type=None, task_file=None, log_filename=None):
+    pickpaths = utils.get_pick_paths_from_user_choice(method=method, task_type=task_type, task_file=task_file)
+    if log_filename is not None:
+        utils.configure_file_logger(logger, log_filename, jsonl_filename=utils.jsonl_filename_for(log_filename))
     compareBarcode(pickpaths)
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    from task_catalog import add_task_file_arguments
+
+    parser = argparse.ArgumentParser(description='Check scanned barcodes against the pick tasks.')
+    parser.add_argument('--log', help='file to write the log to, next to a .jsonl file of the same records')
+    add_task_file_arguments(parser)
+    args = parser.parse_args()
+
     try:
-        main()
+        main(args.method, args.task_type, args.task_file, args.log)
     except Exception as exception:
         print("Experiment Failed.")
         print(exception)
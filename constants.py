@@ -1,5 +1,25 @@
 RACKS = ["A", "B"]
 
+# Version of the task file format the loaders read
+TASK_FILE_VERSION = '1.2'
+
 EMPTY_LIGHT_LAYOUT = 0
 
+RECEIVE_BIN_INITIAL_LIGHT_LAYOUT = 47375
+
+BOTH_DECIMAL_POINTS_LIGHT_LAYOUT = 32896
+
 ALL_DISPLAYS = '*'
+
+BLANK_DISPLAY = None
+
+PICK_BY_LIGHT_RACK_ADDRESS = ('192.168.2.255', 3865)
+
+PICK_BY_LIGHT_PORT = 3865
+
+SOURCE_BINS = ["%s%d%d" % (rack, row, col) for rack in RACKS for row in range(1, 5) for col in range(1, 4)]
+
+RECEIVE_BINS = ["C11", "C12", "C13"]
+
+# Seconds during which repeated reports of the same button are ignored
+BUTTON_DEBOUNCE_WINDOW = 0.3
@@ -0,0 +1,65 @@
+"""debounce.py
+
+Drops repeated button presses before they reach the pick task state machine.
+The rack often reports a single press of a bin several times within a few
+hundred milliseconds; without this stage every repeat is logged and may show
+up as an unexpected press.
+"""
+import collections
+import time
+
+
+class Debouncer(object):
+    """Per-display debounce window over a monotonic clock.
+
+    A press is suppressed if the same display was reported less than its
+    window ago. The window restarts on every report, so a burst of repeats
+    is coalesced into the first press however long it lasts.
+
+    Args:
+        window (float): default window in seconds; 0 disables debouncing
+        windows (dict): per-display windows overriding `window`
+        clock (callable): monotonic clock used when no timestamp is given
+    """
+
+    def __init__(self, window=0.3, windows=None, clock=time.monotonic):
+        self.window = window
+        self.windows = dict(windows or {})
+        self.clock = clock
+        self.last_seen = {}
+        self.accepted = 0
+        self.suppressed = collections.Counter()
+
+    def accept(self, tag, timestamp=None):
+        """Records a press and decides whether it should be handled.
+
+        Args:
+            tag (str): id of display whose button was pressed
+            timestamp (float): monotonic time of the press, defaults to now
+
+        Returns:
+            accepted (bool): False if the press repeats a recent one
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+
+        last_seen = self.last_seen.get(tag)
+        self.last_seen[tag] = timestamp
+
+        if last_seen is not None and timestamp - last_seen < self.windows.get(tag, self.window):
+            self.suppressed[tag] += 1
+            return False
+
+        self.accepted += 1
+        return True
+
+    def reset(self):
+        """Forgets previous presses and counts."""
+        self.last_seen.clear()
+        self.accepted = 0
+        self.suppressed.clear()
+
+    def __str__(self):
+        return "%d presses accepted, %d suppressed (%s)" % \
+               (self.accepted, sum(self.suppressed.values()),
+                ' '.join('%s=%d' % item for item in sorted(self.suppressed.items())))
@@ -11,16 +11,22 @@ Todo:
     * Fix docstrings (esp ChangeDisplay)
     * Change recvfrom to recv in receivePackets func
 """
-import re
 import os
 import time
-import copy
 from socket import *
 import logging
 from models import PickingTask
+import pick_steps
 import utils
-from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS
-from visualize import BLANK_DISPLAY
+from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT, \
+    BOTH_DECIMAL_POINTS_LIGHT_LAYOUT, PICK_BY_LIGHT_RACK_ADDRESS, PICK_BY_LIGHT_PORT, BUTTON_DEBOUNCE_WINDOW
+from frames import NUMBER_LAYOUTS, build_frame, convert_number
+from packets import PacketParser, BUTTON_HIGH, HEARTBEAT
+from debounce import Debouncer
+from shadow import DisplayShadow
+from scheduler import SendScheduler
+from sinks import UdpRackSink, UpdateBatch, build_update, send_update
+from metrics import Metrics
 
 # Setup logging
 logger = logging.getLogger(os.path.basename(__file__))
@@ -33,59 +39,168 @@ pp = {"A11": 88, "A12": 88, "A13": 88, "A21": 88, "A22": 88, "A23": 88, "A31": 8
       "A42": 88, "A43": 88, "B11": 88, "B12": 88, "B13": 88, "B21": 88, "B22": 88, "B23": 88, "B31": 88, "B32": 88,
       "B33": 88, "B41": 88, "B42": 88, "B43": 88}
 
-rightdisplay = {'0': 63, '1': 6, '2': 91, '3': 79, '4': 102, '5': 109, '6': 125, '7': 7, '8': 127, '9': 111}
-leftdisplay = {'0': 16128, '1': 1536, '2': 23296, '3': 20224, '4': 26112, '5': 27904, '6': 32000, '7': 1792, '8': 32512,
-               '9': 28416}
+# Rack socket, opened by open_socket()
+sockhub = None
 
-PICK_BY_LIGHT_RACK_ADDRESS = ('192.168.2.255', 3865)
+# UdpRackSink sending to the rack, created by open_socket()
+rack_sink = None
 
-RECEIVE_BIN_INITIAL_LIGHT_LAYOUT = 47375
+# Every DisplaySink display updates are fanned out to, see add_sink()
+sinks = []
 
-BOTH_DECIMAL_POINTS_LIGHT_LAYOUT = 32896
+packet_parser = PacketParser()
 
-sockhub = socket(AF_INET, SOCK_DGRAM)
-sockhub.bind(('', 3865))
-sockhub.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+debouncer = Debouncer(window=BUTTON_DEBOUNCE_WINDOW)
 
+# What every display is showing, as far as this process knows
+shadow = DisplayShadow()
+
+# Counters and latency histograms, see metrics.py
+metrics = Metrics()
+
+# time.monotonic() at which the last accepted button press was received
+last_press_at = None
 
-def ChangeDisplay(display=None, all_displays=False, number=None, layout=None):
-    """Function that changes a particular display to show a number.
+
+def open_socket(local_address=('', PICK_BY_LIGHT_PORT), rack=PICK_BY_LIGHT_RACK_ADDRESS):
+    """Function that opens the socket used to talk to the rack and adds the rack's sink.
 
     Args:
+        local_address (tuple): address to receive button presses on
+        rack (tuple): address display frames are sent to, e.g. a RackSimulator
+
+    Returns:
         sockhub (obj): socket connection
+    """
+    global sockhub, rack_sink
+    sockhub = socket(AF_INET, SOCK_DGRAM)
+    sockhub.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+    sockhub.bind(local_address)
+    rack_sink = add_sink(UdpRackSink(sockhub, rack, metrics=metrics))
+    return sockhub
+
+
+def add_sink(sink):
+    """Function that adds a DisplaySink to send every display update to.
+
+    Returns:
+        sink (DisplaySink): the added sink
+    """
+    sinks.append(sink)
+    return sink
+
+
+def close_sinks():
+    """Function that closes every sink, flushing queued frames, and removes them.
+    """
+    global rack_sink
+    for sink in sinks:
+        sink.close()
+    del sinks[:]
+    rack_sink = None
+
+
+def configure_scheduler(rate=200.0, burst=10, verify=None, retries=2, repeats=0):
+    """Function that paces all frames to the rack through a SendScheduler.
+
+    The scheduler's send counts and latencies are reported to `metrics`, and
+    press_to_send is then taken when it actually sends a frame.
+
+    Args:
+        rate (float): frames per second on average, None for no limit
+        burst (int): frames that may be sent back to back
+        verify (callable): optional `verify(display, layout) -> bool` used to
+            re-send frames the rack did not take
+        retries (int): times a frame failing verification is re-sent
+        repeats (int): times every frame is sent again without verification,
+            since the real rack does not report what its displays show
+
+    Returns:
+        scheduler (SendScheduler): the started scheduler
+    """
+    if rack_sink.scheduler is not None:
+        rack_sink.scheduler.stop()
+    rack_sink.scheduler = SendScheduler(sockhub.sendto, rate=rate, burst=burst, verify=verify, retries=retries,
+                                        repeats=repeats, metrics=metrics).start()
+    return rack_sink.scheduler
+
+
+def ChangeDisplay(display=None, all_displays=False, number=None, layout=None, force=False, priority=True):
+    """Function that changes a particular display to show a number.
+
+    The update goes to every configured sink. Nothing is sent if the display
+    already shows the requested value.
+
+    Args:
         display (str): id of display
+        all_displays (bool): address every display on the rack instead of `display`
         number (int): number to show on display
         layout (int): a layout to display without running number conversion
-    """
+        force (bool): send the frame even if the display already shows the value
+        priority (bool): let the frame jump ahead of queued bulk updates when
+            a scheduler is configured
 
-    assert (number is not None or layout is not None) and not (number is not None and layout is not None)
+    Returns:
+        response (int): number of bytes sent, 0 if the update was skipped
+    """
 
     if all_displays:
         display = ALL_DISPLAYS
 
-    global visualizer
-    if layout is not None:
-        viz_value = layout
-    else:
-        viz_value = number
-    visualizer.change_display(display, viz_value)
+    return send_update(sinks, shadow, build_update(display, number, layout), priority, force, metrics)
 
-    if layout is not None:
-        rack_value = layout
-    else:
-        rack_value = NumberConvert(number)
 
-    message1 = 'xpl-cmnd\n{\nhop=1\nsource=bnz-sender.orderpick\ntarget=smgpoe-lamp.'
-    message2 = '\n}\ncontrol.basic\n{\ndevice=display\ntype=variable\ncurrent='
-    message3 = '\n}\n'
-    message = message1 + display + message2 + str(rack_value) + message3
-    message = message.encode('utf-8')
-    response = sockhub.sendto(message, PICK_BY_LIGHT_RACK_ADDRESS)
+def ChangeDisplays(numbers=None, layouts=None, verify=False):
+    """Function that changes many displays at once.
+
+    All frames are built up front and then sent back to back, so a whole pick
+    path goes out in one tight burst instead of one ChangeDisplay call per bin.
+    A display given more than once only gets its last value sent, and
+    displays already showing their value are skipped.
+
+    Args:
+        numbers (dict): keys are displays and values are numbers to show
+        layouts (dict): keys are displays and values are raw layouts to show
+        verify (bool): check every batched frame against the frame the
+            per-display path (ChangeDisplay) would have sent
+
+    Returns:
+        sent (int): total number of bytes sent
+    """
+    batch = DisplayBatch(verify=verify)
+    for display, number in (numbers or {}).items():
+        batch.set(display, number=number)
+    for display, layout in (layouts or {}).items():
+        batch.set(display, layout=layout)
+    return batch.flush()
+
+
+class DisplayBatch(UpdateBatch):
+    """Collects display updates and sends them to fml's sinks together when flushed.
+
+    Usable as a context manager, in which case the batch is flushed on exit:
+
+        with DisplayBatch() as batch:
+            batch.set('A11', number=3)
+            batch.set('C11', layout=RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
 
-    # HACK: Get rid of this delay! It's confusing!
-    # time.sleep(0.05)
+    Args:
+        verify (bool): check every batched frame against the frame the
+            per-display path (ChangeDisplay) would have sent
+        force (bool): send displays already showing their value
+        priority (bool): let the frames jump ahead of queued bulk updates
+    """
+
+    def __init__(self, verify=False, force=False, priority=False):
+        UpdateBatch.__init__(self, sinks, shadow, force=force, priority=priority, metrics=metrics)
+        self.verify = verify
 
-    return response
+    def build(self, display, number, layout):
+        update = build_update(display, number, layout)
+        if self.verify:
+            assert update.frame == build_frame(display, layout if layout is not None else convert_number(number)), \
+                'Batched frame for %s differs from per-display frame' % display
+        return update
 
 
 def NumberConvert(number):
@@ -93,22 +208,35 @@ def NumberConvert(number):
 
     Args:
         number (int): number before conversion
-        setup (boolean): ???
+
+    Returns:
+        layout (int): layout value for the display
     """
-    onesdigit = number % 10
-    number //= 10
-    tensdigit = number % 10
+    return NUMBER_LAYOUTS[number % 100]
+
 
-    if tensdigit == 0:
-        return rightdisplay[str(onesdigit)]
+def reset(force=False):
+    """Function that resets all displays.
+
+    Only displays known to be lit are cleared, unless the state of the rack
+    is unknown (nothing was broadcast to every display yet) or `force` is set,
+    in which case every display is cleared.
+
+    Args:
+        force (bool): clear every display on the rack
+    """
+    if force or not shadow.synced:
+        ChangeDisplay(all_displays=True, layout=EMPTY_LIGHT_LAYOUT, force=True, priority=False)
     else:
-        return leftdisplay[str(tensdigit)] + rightdisplay[str(onesdigit)]
+        ChangeDisplays(layouts={display: EMPTY_LIGHT_LAYOUT for display in shadow.lit_displays()})
 
 
-def reset():
-    """Function that resets all displays.
+def resync():
+    """Function that re-sends every display's current value, e.g. after the rack lost frames.
     """
-    ChangeDisplay(all_displays=True, layout=EMPTY_LIGHT_LAYOUT)
+    with DisplayBatch(force=True) as batch:
+        for display, layout in shadow.items():
+            batch.set(display, layout=layout)
 
 
 def press():
@@ -117,13 +245,21 @@ def press():
     Returns:
         display (str): id of display corresponding to button pressed
     """
+    global last_press_at
     data, address = sockhub.recvfrom(4096)
-    # Ignore heartbeats
-    if data and "hbeat".encode("utf-8") not in data:
-        if ("HIGH".encode('utf-8') in data):
-            display = re.findall('[ABC]\d{2}'.encode("utf-8"), data)[0].decode()
-
-            return display
+    received_at = time.monotonic()
+    event = packet_parser.parse(data)
+    # Ignore heartbeats, anything else that isn't a button press, and repeats of a recent press
+    if event.kind is BUTTON_HIGH:
+        if debouncer.accept(event.tag, event.timestamp):
+            metrics.increment('presses')
+            last_press_at = received_at
+            return event.tag
+        metrics.increment('presses_debounced')
+    elif event.kind is HEARTBEAT:
+        metrics.increment('heartbeats')
+    else:
+        metrics.increment('other_packets')
 
 
 def initDisplays(pickpath):
@@ -132,117 +268,120 @@ def initDisplays(pickpath):
     Args:
         pickpath (dict): keys are displays and values are quantities
     """
-    for display, quantity in pickpath.items():
-        logger.debug('Setting display %s = %d' % (display, quantity))
-        ChangeDisplay(display=display, number=quantity)
+    pick_steps.init_displays(pickpath, DisplayBatch, logger, metrics)
 
 
-def run_all_pick_tasks(pick_tasks):
-    """Function that runs a full task with a set of carts and a list of pickpaths.
+def run_steps(steps):
+    """Function that runs pick_steps steps, blocking on the rack socket for each press.
+
+    Frames sent while the steps handle a press are timed from it, see UdpRackSink.
 
     Args:
-        cartSet (list): list of carts in a task, ordered
+        steps (generator): steps from pick_steps.run_all_pick_tasks or run_pick_path
     """
+    reply = None
+    try:
+        while True:
+            if rack_sink is not None:
+                rack_sink.pressed_at = last_press_at if reply is not None else None
+            request = steps.send(reply)
+            reply = None
+            if request is pick_steps.PRESS:
+                # Ignore bad packets
+                while reply is None:
+                    reply = press()
+            else:
+                time.sleep(request)
+    except StopIteration:
+        pass
+    finally:
+        if rack_sink is not None:
+            rack_sink.pressed_at = None
 
-    for i, pick_task in enumerate(pick_tasks):  # type: PickingTask
-
-        # Show start symbol to subject on first task
-        if i == 0:
-            ChangeDisplay(display=pick_task.receive_bin.tag, layout=RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
-
-            # Get user's confirmation to start first task (must press first receive bin to start)
-            first_task_started = False
-            while not first_task_started:
-                if press() == pick_task.receive_bin.tag:
-                    first_task_started = True
-
-        logger.info("TASK START: %s" % pick_task)
-
-        runPickPath(pick_task)
 
-        logger.info("TASK END: %s" % pick_task)
+def run_all_pick_tasks(pick_tasks, task_pause=0.1):
+    """Function that runs a full task with a set of carts and a list of pickpaths.
 
-        reset()
+    Args:
+        pick_tasks (list): picking tasks to run, in order
+        task_pause (float): seconds to wait after resetting the displays between tasks
+    """
+    run_steps(pick_steps.run_all_pick_tasks(pick_tasks, ChangeDisplay, DisplayBatch, reset, logger, task_pause,
+                                            metrics, pressed_at=lambda: last_press_at))
 
-        time.sleep(0.1)
+    logger.debug("Debounce: %s", debouncer)
+    logger.debug("Metrics: %s", metrics)
+    if rack_sink is not None and rack_sink.scheduler is not None:
+        logger.debug("Scheduler: %s", rack_sink.scheduler)
 
 
 def runPickPath(pickpath):  # type: (PickingTask) -> None
     """Function that runs a full pick path.
 
     Args:
-        pickpath (dict): keys are displays and values are quantities
+        pickpath (PickingTask): task whose source bins are picked into its receive bin
     """
-    initDisplays(pickpath.for_init_displays)
-
-    # Control loop will run while the pickpath is in progress
-    pickpath_completed = False
-
-    remaining_source_bin_tags_and_counts = copy.deepcopy(pickpath.source_bins_in_dict)  # type: dict
-    receive_bin_tag = pickpath.receive_bin.tag
-
-    correctly_pressed_source_bins = list()
-
-    while not pickpath_completed:
-        # Wait for a button to be pressed...
-        pressed_bin_tag = press()
-
-        # Ignore bad packets
-        if pressed_bin_tag is None:
-            continue
-
-        logger.debug("Subject pressed %s." % pressed_bin_tag)
-
-        # Else if the subject pressed a source bin
-        if pressed_bin_tag in remaining_source_bin_tags_and_counts:
-            # Set the pressed source bin value to 0
-            ChangeDisplay(display=pressed_bin_tag, number=0)
+    run_steps(pick_steps.run_pick_path(pickpath, ChangeDisplay, DisplayBatch, logger, metrics,
+                                       pressed_at=lambda: last_press_at))
 
-            # Subject has pressed the source bin and doesn't have to do so again.
-            # Remove this bin from the expected/remaining ones.
-            correctly_pressed_source_bins.append(pressed_bin_tag)
-            pressed_source_bin_count = remaining_source_bin_tags_and_counts.pop(pressed_bin_tag)  # type: int
 
-            # Recompute total to display on receive bin
-            new_receive_bin_total = sum(remaining_source_bin_tags_and_counts.values())
+def main(method=None, task_type=None, task_file=None, log_filename=None):
+    reset(force=True)
+    pickpaths = utils.get_pick_paths_from_user_choice(stream=True, method=method, task_type=task_type,
+                                                      task_file=task_file)
 
-            logger.debug("%s with %d items was pressed. Decrementing total to %d" %
-                         (pressed_bin_tag, pressed_source_bin_count, new_receive_bin_total))
-
-            # Update the total on the receive bin
-            ChangeDisplay(display=receive_bin_tag, number=new_receive_bin_total)
-
-        # If the subject pressed all of the required source bins' buttons the task is now over
-        elif not remaining_source_bin_tags_and_counts and pressed_bin_tag == receive_bin_tag:
-            # Set the receive bin tags to empty (pick path is done)
-            for tag in correctly_pressed_source_bins + [receive_bin_tag]:
-                logger.debug("Clearing display %s" % tag)
-                ChangeDisplay(display=tag, layout=EMPTY_LIGHT_LAYOUT)
-
-            pickpath_completed = True
-
-        else:
-            logger.warning("Unexpected button pressed: %s" % pressed_bin_tag)
-
-
-def main():
-    reset()
-    pickpaths = utils.get_pick_paths_from_user_choice()
-
-    log_filename = input("What file do you want to write to? ")
-    utils.configure_file_logger(logger, log_filename)
+    if log_filename is None:
+        log_filename = input("What file do you want to write to? ")
+    utils.configure_file_logger(logger, log_filename, jsonl_filename=utils.jsonl_filename_for(log_filename))
 
     run_all_pick_tasks(pickpaths)
 
 
 if __name__ == "__main__":
+    import argparse
+    import functools
+    from task_catalog import add_task_file_arguments
+
+    parser = argparse.ArgumentParser(description='Run pick-by-light tasks on the rack.')
+    parser.add_argument('--send-rate', type=float,
+                        help='pace frames to the rack at this many frames per second through a send scheduler')
+    parser.add_argument('--burst', type=int, default=10, help='frames the scheduler may send back to back')
+    parser.add_argument('--repeat-frames', type=int, default=0, metavar='N',
+                        help='send every frame N more times, 50 ms apart, unless a newer one replaced it, '
+                             'for lossy networks')
+    parser.add_argument('--headless', action='store_true', help='run without the Tk rack visualizer')
+    parser.add_argument('--log', help='file to write the log to, asked for if not given')
+    parser.add_argument('--metrics-file', help='JSON file to write latency and counter metrics to periodically')
+    parser.add_argument('--metrics-interval', type=float, default=5.0, help='seconds between metrics file writes')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics on http://127.0.0.1:PORT/metrics')
+    add_task_file_arguments(parser)
+    args = parser.parse_args()
+    run = functools.partial(main, method=args.method, task_type=args.task_type, task_file=args.task_file,
+                            log_filename=args.log)
+
+    metrics_writer = metrics_server = None
+    if args.metrics_file:
+        from metrics import MetricsFileWriter
+        metrics_writer = MetricsFileWriter(metrics, args.metrics_file, interval=args.metrics_interval).start()
+    if args.metrics_port:
+        from metrics import serve_metrics
+        metrics_server = serve_metrics(metrics, ('127.0.0.1', args.metrics_port))
+
     try:
-        from visualize import LightRackVisualizer
+        open_socket()
+        if args.send_rate is not None or args.repeat_frames:
+            configure_scheduler(rate=args.send_rate, burst=args.burst, repeats=args.repeat_frames)
+
+        if args.headless:
+            run()
+        else:
+            from visualize import LightRackVisualizer
+            from sinks import VisualizerSink
 
-        global visualizer
-        visualizer = LightRackVisualizer()
+            visualizer = LightRackVisualizer()
+            add_sink(VisualizerSink(visualizer))
 
-        visualizer.run(main)
+            visualizer.run(run)
 
     except KeyboardInterrupt as ki:
         print("Handling keyboard interrupt. Resetting displays")
@@ -251,5 +390,11 @@ if __name__ == "__main__":
         print(exception)
     finally:
         print("\nExperiment Complete.")
-        reset()
-        sockhub.close()
+        if sockhub is not None:
+            reset(force=True)
+            close_sinks()
+            sockhub.close()
+        if metrics_writer is not None:
+            metrics_writer.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
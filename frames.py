@@ -0,0 +1,110 @@
+"""frames.py
+
+Ready-to-send xPL frames for the pick-by-light rack.
+
+Every (display, value) pair the rack can be asked to show is known ahead of
+time: the source bins, the receive bins, every two digit number and a handful
+of special layouts. `FRAMES` holds all of them as encoded `bytes`, built once
+at import and shared by every caller, so sending an update is one lookup and
+one `sendto`.
+"""
+from constants import SOURCE_BINS, RECEIVE_BINS, ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT, \
+    RECEIVE_BIN_INITIAL_LIGHT_LAYOUT, BOTH_DECIMAL_POINTS_LIGHT_LAYOUT
+
+rightdisplay = {'0': 63, '1': 6, '2': 91, '3': 79, '4': 102, '5': 109, '6': 125, '7': 7, '8': 127, '9': 111}
+leftdisplay = {'0': 16128, '1': 1536, '2': 23296, '3': 20224, '4': 26112, '5': 27904, '6': 32000, '7': 1792, '8': 32512,
+               '9': 28416}
+
+XPL_MESSAGE_PREFIX = 'xpl-cmnd\n{\nhop=1\nsource=bnz-sender.orderpick\ntarget=smgpoe-lamp.'
+XPL_MESSAGE_INFIX = '\n}\ncontrol.basic\n{\ndevice=display\ntype=variable\ncurrent='
+XPL_MESSAGE_SUFFIX = '\n}\n'
+
+DISPLAYS = tuple(SOURCE_BINS) + tuple(RECEIVE_BINS) + (ALL_DISPLAYS, )
+
+SPECIAL_LAYOUTS = (EMPTY_LIGHT_LAYOUT, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT, BOTH_DECIMAL_POINTS_LIGHT_LAYOUT)
+
+
+def convert_number(number):
+    """Converts a number to the layout value that shows it on a display.
+
+    This is the arithmetic reference for `NUMBER_LAYOUTS`; only the last two
+    digits of `number` are shown.
+
+    Args:
+        number (int): number before conversion
+
+    Returns:
+        layout (int): layout value for the display
+    """
+    onesdigit = number % 10
+    number //= 10
+    tensdigit = number % 10
+
+    if tensdigit == 0:
+        return rightdisplay[str(onesdigit)]
+    else:
+        return leftdisplay[str(tensdigit)] + rightdisplay[str(onesdigit)]
+
+
+def build_frame(display, layout):
+    """Builds the xPL frame which sets a display to a raw layout value.
+
+    Args:
+        display (str): id of display
+        layout (int): layout value understood by the rack
+
+    Returns:
+        frame (bytes): encoded frame, ready to be sent to the rack
+    """
+    message = XPL_MESSAGE_PREFIX + display + XPL_MESSAGE_INFIX + str(layout) + XPL_MESSAGE_SUFFIX
+    return message.encode('utf-8')
+
+
+NUMBER_LAYOUTS = tuple(convert_number(number) for number in range(100))
+
+
+class FrameTable(object):
+    """Immutable table of encoded frames, indexed by display and value.
+
+    Numbers are looked up by `number % 100`, which is exactly what the
+    display can show. Values outside the table (unknown displays or layouts)
+    are built on demand and not cached, so the table never changes after
+    construction and is safe to share.
+    """
+
+    __slots__ = ('_number_frames', '_layout_frames')
+
+    def __init__(self, displays=DISPLAYS, special_layouts=SPECIAL_LAYOUTS):
+        number_frames = {}
+        layout_frames = {}
+        for display in displays:
+            frames = tuple(build_frame(display, layout) for layout in NUMBER_LAYOUTS)
+            number_frames[display] = frames
+
+            by_layout = dict(zip(NUMBER_LAYOUTS, frames))
+            for layout in special_layouts:
+                by_layout[layout] = build_frame(display, layout)
+            layout_frames[display] = by_layout
+
+        self._number_frames = number_frames
+        self._layout_frames = layout_frames
+
+    def number(self, display, number):
+        """Returns the frame that shows `number` on `display`."""
+        try:
+            return self._number_frames[display][number % 100]
+        except KeyError:
+            return build_frame(display, NUMBER_LAYOUTS[number % 100])
+
+    def layout(self, display, layout):
+        """Returns the frame that shows the raw `layout` on `display`."""
+        try:
+            return self._layout_frames[display][layout]
+        except KeyError:
+            return build_frame(display, layout)
+
+    def __len__(self):
+        return sum(len(frames) for frames in self._layout_frames.values())
+
+
+FRAMES = FrameTable()
@@ -0,0 +1,224 @@
+"""log_batch.py
+
+Analyses every experiment log in a folder at once and compares subjects and
+study methods. Logs are parsed in parallel, one process per log, and the
+parsed event columns of each log are cached in an .npz file. The cache is
+keyed by size and modification time, falling back to a hash of the contents
+when those change, so after adding one log only that log is parsed again.
+
+Logs are expected to be named <subject>-<study method>-<task type>.log, like
+theo-pick-by-light_button-testing.log. Run from the repository root:
+    $ python logs/log_batch.py logs
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from log_parser import LogEventParser, LogMetrics, EventChunk, RunningStats, concatenate_chunks
+
+CACHE_DIRNAME = '.cache'
+INDEX_FILENAME = 'index.json'
+CACHE_VERSION = 1
+
+LOG_NAME_PATTERN = re.compile(r'^(?P<subject>[^-]+)-(?P<method>.+)-(?P<task_type>training|testing)\.log$')
+
+LogFile = collections.namedtuple('LogFile', ['path', 'subject', 'method', 'task_type'])
+
+
+def discover_logs(folder):
+    """Returns the experiment logs in `folder`, sorted by name. Other logs are skipped."""
+    logs = []
+    for file_name in sorted(os.listdir(folder)):
+        match = LOG_NAME_PATTERN.match(file_name)
+        if match:
+            logs.append(LogFile(os.path.join(folder, file_name), **match.groupdict()))
+    return logs
+
+
+def file_hash(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EventCache(object):
+    """Parsed event columns of logs, stored as .npz files next to an index.
+
+    Args:
+        directory (str): folder holding the cache files and the index
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_filename = os.path.join(directory, INDEX_FILENAME)
+        self.index = {}
+        try:
+            with open(self.index_filename) as f:
+                stored = json.load(f)
+            if stored.get('version') == CACHE_VERSION:
+                self.index = stored['files']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temporary_filename = '%s.%d.tmp' % (self.index_filename, os.getpid())
+        with open(temporary_filename, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'files': self.index}, f, indent=1, sort_keys=True)
+        os.replace(temporary_filename, self.index_filename)
+
+    def cache_path(self, digest):
+        return os.path.join(self.directory, '%s.npz' % digest)
+
+    def lookup(self, filename):
+        """Returns the cache path of a log's events, or None if it must be parsed.
+
+        Size and modification time are checked first. If they changed, the
+        contents are hashed and the entry is kept if the hash still matches.
+        """
+        stat = os.stat(filename)
+        entry = self.index.get(os.path.basename(filename))
+        if entry is None or not os.path.exists(self.cache_path(entry['hash'])):
+            return None
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return self.cache_path(entry['hash'])
+
+        digest = file_hash(filename)
+        if digest != entry['hash']:
+            return None
+        entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+        return self.cache_path(digest)
+
+    def record(self, filename, digest, size, mtime):
+        self.index[os.path.basename(filename)] = {'hash': digest, 'size': size, 'mtime': mtime}
+
+
+def parse_log(job):
+    """Parses one log and writes its events to the cache. Runs in a worker process.
+
+    Args:
+        job (tuple): log filename and cache directory
+
+    Returns:
+        result (tuple): log filename, content hash, size and mtime at parse time
+    """
+    filename, directory = job
+    stat = os.stat(filename)
+    digest = file_hash(filename)
+
+    parser = LogEventParser()
+    events = concatenate_chunks(parser.iter_file_chunks(filename))
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '%s.npz' % digest)
+    temporary_filename = '%s.%d.tmp.npz' % (path[:-4], os.getpid())
+    np.savez_compressed(temporary_filename, tags=np.array(parser.tags, dtype=str), **events._asdict())
+    os.replace(temporary_filename, path)
+
+    return filename, digest, stat.st_size, stat.st_mtime
+
+
+def load_events(path):
+    """Returns (EventChunk, tags) read from a cache file."""
+    with np.load(path) as data:
+        return EventChunk(*[data[field] for field in EventChunk._fields]), data['tags'].tolist()
+
+
+def analyze_logs(logs, cache_dir, workers=None):
+    """Returns the LogMetrics of every log, parsing only logs missing from the cache.
+
+    Returns:
+        metrics (dict): LogFile -> LogMetrics
+        parsed (int): number of logs that had to be parsed
+    """
+    cache = EventCache(cache_dir)
+    paths = {}
+    to_parse = []
+    for log in logs:
+        path = cache.lookup(log.path)
+        if path is None:
+            to_parse.append((log.path, cache_dir))
+        else:
+            paths[log.path] = path
+
+    if to_parse:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for filename, digest, size, mtime in executor.map(parse_log, to_parse):
+                cache.record(filename, digest, size, mtime)
+                paths[filename] = cache.cache_path(digest)
+    cache.save()
+
+    metrics = {}
+    for log in logs:
+        events, tags = load_events(paths[log.path])
+        log_metrics = LogMetrics(tags)
+        log_metrics.feed(events)
+        metrics[log] = log_metrics.finish()
+    return metrics, len(to_parse)
+
+
+def comparison_rows(metrics, key):
+    """Merges the metrics of logs sharing `key(log)` into one row per key.
+
+    Returns:
+        rows (list): (key, number of logs, order duration, pick duration, order errors)
+            with the last three as RunningStats, sorted by key
+    """
+    groups = collections.OrderedDict()
+    for log in sorted(metrics, key=key):
+        row = groups.setdefault(key(log), [0, RunningStats(), RunningStats(), RunningStats()])
+        log_metrics = metrics[log]
+        row[0] += 1
+        row[1].merge(log_metrics.order_duration)
+        row[2].merge(log_metrics.pick_duration)
+        row[3].merge(log_metrics.order_errors)
+    return [(group,) + tuple(row) for group, row in groups.items()]
+
+
+def format_table(title, rows):
+    lines = [title,
+             '%-45s %4s %7s %12s %12s %12s' % ('', 'logs', 'orders', 'order s', 'pick s', 'errors/order')]
+    for group, num_logs, order_duration, pick_duration, order_errors in rows:
+        name = ' '.join(group) if isinstance(group, tuple) else group
+        lines.append('%-45s %4d %7d %6.2f+-%-5.2f %6.2f+-%-5.2f %6.2f+-%-5.2f' % (
+            name, num_logs, order_duration.count, order_duration.mean, order_duration.std,
+            pick_duration.mean, pick_duration.std, order_errors.mean, order_errors.std))
+    return '\n'.join(lines)
+
+
+def main(folder, workers=None):
+    start = time.time()
+    logs = discover_logs(folder)
+    metrics, parsed = analyze_logs(logs, os.path.join(folder, CACHE_DIRNAME), workers=workers)
+
+    print(format_table('By log', comparison_rows(metrics, lambda log: os.path.basename(log.path))))
+    print()
+    print(format_table('By study method and task type',
+                       comparison_rows(metrics, lambda log: (log.method, log.task_type))))
+    print()
+    print(format_table('By subject and task type', comparison_rows(metrics, lambda log: (log.subject, log.task_type))))
+    print()
+    print(format_table('By subject, study method and task type',
+                       comparison_rows(metrics, lambda log: (log.subject, log.method, log.task_type))))
+    print()
+    print('%d logs, %d parsed, %d from cache, in %.2f s' % (len(logs), parsed, len(logs) - parsed, time.time() - start))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare subjects and study methods across experiment logs.')
+    parser.add_argument('folder', nargs='?', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='folder with the logs (default: this folder)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    main(args.folder, workers=args.jobs)
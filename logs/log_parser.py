@@ -1,33 +1,405 @@
-import sys
+"""log_parser.py
 
-def main(filename):
-	times = []
-	tasktimes = []
-	fo = open(filename, 'r')
-	
-	for line in fo.readlines():
-		
-		if "INFO" in line:
-			timestr = line[11:23]
-			
-			hours = int(timestr[0:2])
-			minutes = int(timestr[3:5])
-			seconds = int(timestr[6:8])
-			milliseconds = int(timestr[9:])
+Streaming analysis of experiment logs written with utils.loggerFormatter, by
+fml.py (button presses) and check_barcode.py (barcode scans). The log is read
+line by line and turned into typed events, collected into NumPy columns a
+chunk at a time. Metrics are computed from the chunks as they arrive, so
+memory stays constant however long the log is:
 
-			time = 60*minutes + seconds + 0.001*milliseconds
-			times.append(time)
+    * per order: every TASK START, up to its TASK END or the last event
+      before the next TASK START, with its duration, picks and errors
+    * per task: consecutive orders with the same task ID
+    * per pick: time from the order start or the previous pick to a pick
 
-	print(times)
+Run with one or more logs:
+    $ python logs/log_parser.py logs/theo-pick-by-light_button-testing.log
+"""
+import calendar
+import collections
+import math
+import re
+import time
+import numpy as np
 
-	i = 0
-	while i < len(times) - 1:
-		tasktimes.append(times[i+1] - times[i])
-		i += 1
+# Event kinds
+TASK_START = 0
+TASK_END = 1
+PRESS = 2
+UNEXPECTED_PRESS = 3
+SCAN = 4
+UNEXPECTED_SCAN = 5
+WARNING = 6
 
-	print(tasktimes)
+KIND_NAMES = ['task_start', 'task_end', 'press', 'unexpected_press', 'scan', 'unexpected_scan', 'warning']
+ERROR_KINDS = (UNEXPECTED_PRESS, UNEXPECTED_SCAN, WARNING)
+
+NO_VALUE = -1
+
+EventChunk = collections.namedtuple('EventChunk', ['time', 'kind', 'task_id', 'order_id', 'tag'])
+
+OrderMetrics = collections.namedtuple('OrderMetrics', [
+    'task_id', 'order_id', 'receive_bin', 'start', 'end', 'duration', 'picks', 'errors'])
+TaskMetrics = collections.namedtuple('TaskMetrics', ['task_id', 'start', 'end', 'duration', 'orders', 'picks', 'errors'])
+
+TASK_ID_PATTERN = re.compile(r'Task ID=(\d+)')
+ORDER_ID_PATTERN = re.compile(r'Order ID=(\d+)')
+# "-> C11" in older logs, "Receive bin C11" since
+RECEIVE_BIN_PATTERN = re.compile(r'(?:-> |Receive bin )(\w+)')
+
+
+class LogEventParser(object):
+    """Turns log lines into event columns.
+
+    Tags are stored as indices into `tags`, which grows as new tags are seen.
+    Lines that are not log records, such as the task file prompt, are skipped.
+
+    Args:
+        chunk_size (int): number of events per chunk
+    """
+
+    def __init__(self, chunk_size=1 << 16):
+        self.chunk_size = chunk_size
+        self.tags = []
+        self.lines = 0
+        self.skipped_lines = 0
+        self._tag_index = {}
+        self._day_start = {}
+        self._new_chunk()
+
+    def _new_chunk(self):
+        size = self.chunk_size
+        self._time = np.empty(size, dtype=np.float64)
+        self._kind = np.empty(size, dtype=np.int8)
+        self._task_id = np.empty(size, dtype=np.int32)
+        self._order_id = np.empty(size, dtype=np.int32)
+        self._tag = np.empty(size, dtype=np.int16)
+        self._count = 0
+
+    def _take_chunk(self):
+        n = self._count
+        chunk = EventChunk(self._time[:n], self._kind[:n], self._task_id[:n], self._order_id[:n], self._tag[:n])
+        self._new_chunk()
+        return chunk
+
+    def tag_index(self, tag):
+        index = self._tag_index.get(tag)
+        if index is None:
+            index = self._tag_index[tag] = len(self.tags)
+            self.tags.append(tag)
+        return index
+
+    def parse_time(self, asctime):
+        """Returns seconds since the epoch for "2018-03-29 11:29:18,505", read as UTC.
+
+        The date and hour are kept, so durations across midnight or the hour are right.
+        """
+        day = asctime[:10]
+        day_start = self._day_start.get(day)
+        if day_start is None:
+            day_start = self._day_start[day] = calendar.timegm(time.strptime(day, '%Y-%m-%d'))
+        return (day_start + int(asctime[11:13]) * 3600 + int(asctime[14:16]) * 60 + int(asctime[17:19]) +
+                int(asctime[20:23]) * 0.001)
+
+    def parse_line(self, line):
+        """Returns (time, kind, task_id, order_id, tag), or None for lines that are not events."""
+        fields = line.split(' : ', 3)
+        if len(fields) != 4 or len(fields[0]) < 23 or fields[0][4] != '-':
+            return None
+        message = fields[3].strip()
+
+        task_id = order_id = tag = NO_VALUE
+        if message.startswith('Subject pressed '):
+            kind = PRESS
+            tag = self.tag_index(message[16:].rstrip('.'))
+        elif message.startswith('TASK START: ') or message.startswith('TASK END: '):
+            kind = TASK_START if message[5] == 'S' else TASK_END
+            match = TASK_ID_PATTERN.search(message)
+            task_id = int(match.group(1)) if match else NO_VALUE
+            match = ORDER_ID_PATTERN.search(message)
+            order_id = int(match.group(1)) if match else NO_VALUE
+            match = RECEIVE_BIN_PATTERN.search(message)
+            tag = self.tag_index(match.group(1)) if match else NO_VALUE
+            # Older logs, "Task (Order ID=17, Task ID=1): 3 bins -> C11", had the two IDs swapped
+            if message.find('Task (') == message.find(': ') + 2:
+                task_id, order_id = order_id, task_id
+        elif message == 'Unexpected state!':
+            kind = UNEXPECTED_PRESS
+        elif message.startswith('Unexpected button pressed: '):
+            kind = UNEXPECTED_PRESS
+            tag = self.tag_index(message[27:])
+        elif message.startswith('Unexpected barcode: '):
+            kind = UNEXPECTED_SCAN
+            tag = self.tag_index(message[20:])
+        elif message.startswith('Correct ') and ' barcode scanned: ' in message:
+            kind = SCAN
+            tag = self.tag_index(message.rsplit(': ', 1)[1])
+        elif message.startswith('Display somehow '):
+            kind = WARNING
+            tag = self.tag_index(message.split(' ', 3)[2])
+        else:
+            return None
+
+        try:
+            timestamp = self.parse_time(fields[0])
+        except ValueError:
+            return None
+        return timestamp, kind, task_id, order_id, tag
+
+    def iter_chunks(self, fileobj):
+        """Yields EventChunks for the lines of an open log file."""
+        parse_line = self.parse_line
+        for line in fileobj:
+            self.lines += 1
+            event = parse_line(line)
+            if event is None:
+                self.skipped_lines += 1
+                continue
+
+            i = self._count
+            self._time[i], self._kind[i], self._task_id[i], self._order_id[i], self._tag[i] = event
+            self._count = i + 1
+            if self._count == self.chunk_size:
+                yield self._take_chunk()
+
+        if self._count:
+            yield self._take_chunk()
+
+    def iter_file_chunks(self, filename):
+        with open(filename, errors='replace') as f:
+            for chunk in self.iter_chunks(f):
+                yield chunk
+
+
+def concatenate_chunks(chunks):
+    """Joins EventChunks into one, e.g. to keep a whole log's events."""
+    chunks = list(chunks)
+    if not chunks:
+        return EventChunk(np.empty(0, np.float64), np.empty(0, np.int8), np.empty(0, np.int32),
+                          np.empty(0, np.int32), np.empty(0, np.int16))
+    return EventChunk(*[np.concatenate(columns) for columns in zip(*chunks)])
+
+
+class RunningStats(object):
+    """Count, mean, standard deviation, minimum and maximum of a stream of values."""
+
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other):
+        """Adds the values of another RunningStats, as if they had been added here."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.minimum, 'max': self.maximum}
+
+
+class LogMetrics(object):
+    """Per-order, per-task and per-pick metrics, computed from EventChunks as they arrive.
+
+    Only running statistics and the open order and task are kept. To keep the
+    records of every order or task, pass `on_order` or `on_task`, which are
+    called with an OrderMetrics or TaskMetrics as each one completes.
+
+    A press directly followed by an unexpected press warning is counted as an
+    error, not a pick.
+
+    Args:
+        tags (list): tag table of the LogEventParser the chunks come from
+        on_order (callable): called with every completed OrderMetrics
+        on_task (callable): called with every completed TaskMetrics
+    """
+
+    def __init__(self, tags, on_order=None, on_task=None):
+        self.tags = tags
+        self.on_order = on_order
+        self.on_task = on_task
+
+        self.event_counts = np.zeros(len(KIND_NAMES), dtype=np.int64)
+        self.order_duration = RunningStats()
+        self.order_errors = RunningStats()
+        self.task_duration = RunningStats()
+        self.task_errors = RunningStats()
+        self.pick_duration = RunningStats()
+        self.errors_outside_orders = 0
+
+        self._order = None  # [task_id, order_id, receive bin, start, last event time, picks, errors]
+        self._task = None  # [task_id, start, end, orders, picks, errors]
+        self._pending_pick = None  # time of a press that may still turn out unexpected
+        self._last_pick = None
+
+    def feed(self, chunk):
+        self.event_counts += np.bincount(chunk.kind, minlength=len(KIND_NAMES))[:len(KIND_NAMES)]
+        for timestamp, kind, task_id, order_id, tag in zip(chunk.time.tolist(), chunk.kind.tolist(),
+                                                           chunk.task_id.tolist(), chunk.order_id.tolist(),
+                                                           chunk.tag.tolist()):
+            self._feed_event(timestamp, kind, task_id, order_id, tag)
+
+    def _feed_event(self, timestamp, kind, task_id, order_id, tag):
+        if self._pending_pick is not None and kind != UNEXPECTED_PRESS:
+            self._count_pick(self._pending_pick)
+        self._pending_pick = None
+
+        if kind == TASK_START:
+            self._end_order()
+            if self._task is not None and self._task[0] != task_id:
+                self._end_task()
+            if self._task is None:
+                self._task = [task_id, timestamp, timestamp, 0, 0, 0]
+            self._order = [task_id, order_id, self.tags[tag] if tag != NO_VALUE else None, timestamp, timestamp, 0, 0]
+            self._last_pick = timestamp
+            return
+
+        order = self._order
+        if order is None:
+            if kind in ERROR_KINDS:
+                self.errors_outside_orders += 1
+            return
+
+        order[4] = timestamp
+        if kind == TASK_END:
+            self._end_order()
+        elif kind == PRESS:
+            self._pending_pick = timestamp
+        elif kind == SCAN:
+            self._count_pick(timestamp)
+        elif kind in ERROR_KINDS:
+            order[6] += 1
+
+    def _count_pick(self, timestamp):
+        if self._order is None:
+            return
+        self._order[5] += 1
+        self.pick_duration.add(timestamp - self._last_pick)
+        self._last_pick = timestamp
+
+    def _end_order(self):
+        order = self._order
+        if order is None:
+            return
+        self._order = None
+        task_id, order_id, receive_bin, start, end, picks, errors = order
+
+        self.order_duration.add(end - start)
+        self.order_errors.add(errors)
+        task = self._task
+        task[2] = end
+        task[3] += 1
+        task[4] += picks
+        task[5] += errors
+
+        if self.on_order is not None:
+            self.on_order(OrderMetrics(task_id, order_id, receive_bin, start, end, end - start, picks, errors))
+
+    def _end_task(self):
+        task = self._task
+        if task is None:
+            return
+        self._task = None
+        task_id, start, end, orders, picks, errors = task
+
+        self.task_duration.add(end - start)
+        self.task_errors.add(errors)
+        if self.on_task is not None:
+            self.on_task(TaskMetrics(task_id, start, end, end - start, orders, picks, errors))
+
+    def finish(self):
+        """Closes the open order and task at the end of the log."""
+        if self._pending_pick is not None:
+            self._count_pick(self._pending_pick)
+            self._pending_pick = None
+        self._end_order()
+        self._end_task()
+        return self
+
+    def summary(self):
+        """Returns the event counts and the statistics of every metric."""
+        return {
+            'events': dict(zip(KIND_NAMES, self.event_counts.tolist())),
+            'order_duration_s': self.order_duration.as_dict(),
+            'order_errors': self.order_errors.as_dict(),
+            'task_duration_s': self.task_duration.as_dict(),
+            'task_errors': self.task_errors.as_dict(),
+            'pick_duration_s': self.pick_duration.as_dict(),
+            'errors_outside_orders': self.errors_outside_orders,
+        }
+
+
+def analyze_file(filename, chunk_size=1 << 16, on_order=None, on_task=None):
+    """Streams a log through a LogEventParser into LogMetrics.
+
+    Returns:
+        metrics (LogMetrics): the finished metrics
+    """
+    parser = LogEventParser(chunk_size=chunk_size)
+    metrics = LogMetrics(parser.tags, on_order=on_order, on_task=on_task)
+    for chunk in parser.iter_file_chunks(filename):
+        metrics.feed(chunk)
+    return metrics.finish()
+
+
+def format_summary(summary):
+    lines = ['events: ' + ', '.join('%s=%d' % item for item in summary['events'].items() if item[1])]
+    for name in ['task_duration_s', 'order_duration_s', 'pick_duration_s', 'task_errors', 'order_errors']:
+        stats = summary[name]
+        if stats['count']:
+            lines.append('%-17s n=%-5d mean=%8.3f std=%8.3f min=%8.3f max=%8.3f' %
+                         (name, stats['count'], stats['mean'], stats['std'], stats['min'], stats['max']))
+        else:
+            lines.append('%-17s n=0' % name)
+    return '\n'.join(lines)
+
+
+def main(filenames, show_orders=False, show_tasks=False):
+    def print_order(order):
+        print('order task=%d order=%d receive=%s duration=%.3f picks=%d errors=%d' %
+              (order.task_id, order.order_id, order.receive_bin, order.duration, order.picks, order.errors))
+
+    def print_task(task):
+        print('task  task=%d duration=%.3f orders=%d picks=%d errors=%d' %
+              (task.task_id, task.duration, task.orders, task.picks, task.errors))
+
+    for filename in filenames:
+        print('== %s' % filename)
+        metrics = analyze_file(filename, on_order=print_order if show_orders else None,
+                               on_task=print_task if show_tasks else None)
+        print(format_summary(metrics.summary()))
 
-	print(len(tasktimes))
 
 if __name__ == "__main__":
-	main(sys.argv[1])
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Task, order and pick metrics of experiment logs.')
+    parser.add_argument('logs', nargs='+', help='log files')
+    parser.add_argument('--orders', action='store_true', help='print every order as it completes')
+    parser.add_argument('--tasks', action='store_true', help='print every task as it completes')
+    args = parser.parse_args()
+
+    main(args.logs, show_orders=args.orders, show_tasks=args.tasks)
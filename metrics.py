@@ -0,0 +1,268 @@
+"""metrics.py
+
+Runtime instrumentation: latency histograms, counters, and ways to export
+them while an experiment runs.
+
+Histograms are HDR-style. Values are counted in log-linear buckets with a
+fixed relative precision, so recording is O(1) and memory is fixed however
+many values are recorded and however far apart they are. Metrics can be
+written to a JSON file periodically (MetricsFileWriter) or scraped from a
+local HTTP endpoint in the Prometheus text format (serve_metrics).
+"""
+import array
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Buckets hold 2**SUB_BUCKET_BITS / 2 distinct values per power of two, so a value is
+# reported at most 1 / 2**(SUB_BUCKET_BITS - 1) above itself: 0.79% for 8 bits
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram(object):
+    """Histogram of durations, recorded in microseconds with at most 0.79% relative error.
+
+    Args:
+        max_seconds (float): largest duration told apart; longer ones count as this
+    """
+
+    __slots__ = ('max_value', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, max_seconds=60.0):
+        self.max_value = int(max_seconds * 1e6)
+        self.counts = array.array('q', bytes(8 * (self._index(self.max_value) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _index(value):
+        if value < SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def _value(index):
+        """Returns the highest value counted in bucket `index`."""
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = index // SUB_BUCKET_HALF - 1
+        return ((index - shift * SUB_BUCKET_HALF) << shift) + (1 << shift) - 1
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Returns the duration in seconds below which `percent` percent of the values are."""
+        if not self.count:
+            return None
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        """Returns count, mean, min, max and percentiles, in milliseconds."""
+        if not self.count:
+            return {'count': 0}
+        summary = {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e3,
+            'min_ms': self.min / 1e3,
+            'max_ms': self.max / 1e3,
+        }
+        for percent in PERCENTILES:
+            summary['p%s_ms' % ('%g' % percent).replace('.', '_')] = self.percentile(percent) * 1e3
+        return summary
+
+
+class Metrics(object):
+    """Named counters and latency histograms, safe to update from any thread."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name, seconds):
+        """Adds a duration to the histogram `name`, creating it on first use."""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def timer(self, name):
+        """Returns a context manager recording how long its block took into `name`."""
+        return _Timer(self, name)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """Returns every counter and histogram summary as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                'time': time.time(),
+                'started_at': self.started_at,
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.summary() for name, histogram in self.histograms.items()},
+            }
+
+    def prometheus_text(self, prefix='pick_by_light_'):
+        """Returns the metrics in the Prometheus text exposition format.
+
+        Histograms are exported as summaries with quantiles in seconds.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append('# TYPE %s%s_total counter' % (prefix, name))
+                lines.append('%s%s_total %d' % (prefix, name, value))
+            for name, histogram in sorted(self.histograms.items()):
+                metric = '%s%s_seconds' % (prefix, name)
+                lines.append('# TYPE %s summary' % metric)
+                for percent in PERCENTILES:
+                    quantile = histogram.percentile(percent)
+                    if quantile is not None:
+                        lines.append('%s{quantile="%g"} %.6f' % (metric, percent / 100.0, quantile))
+                lines.append('%s_sum %.6f' % (metric, histogram.total / 1e6))
+                lines.append('%s_count %d' % (metric, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def __str__(self):
+        snapshot = self.snapshot()
+        parts = ['%s=%d' % item for item in sorted(snapshot['counters'].items())]
+        for name, summary in sorted(snapshot['histograms'].items()):
+            if summary['count']:
+                parts.append('%s(n=%d p50=%.3fms p99=%.3fms max=%.3fms)' %
+                             (name, summary['count'], summary['p50_ms'], summary['p99_ms'], summary['max_ms']))
+        return ', '.join(parts)
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.monotonic() - self.start)
+
+
+class MetricsFileWriter(object):
+    """Writes a Metrics snapshot to a JSON file every `interval` seconds, atomically.
+
+    Args:
+        metrics (Metrics): metrics to write
+        filename (str): file to write
+        interval (float): seconds between writes
+    """
+
+    def __init__(self, metrics, filename, interval=5.0):
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='MetricsFileWriter')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops writing, after a last write."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def write(self):
+        temporary_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(temporary_filename, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=1, sort_keys=True)
+        os.replace(temporary_filename, self.filename)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+        self.write()
+
+
+def serve_metrics(metrics, address=('127.0.0.1', 9108)):
+    """Serves the metrics over HTTP from a background thread.
+
+    GET /metrics returns the Prometheus text format, GET /metrics.json a snapshot.
+
+    Returns:
+        server (ThreadingHTTPServer): the running server, stop it with shutdown()
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = metrics.prometheus_text().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(metrics.snapshot()).encode('utf-8')
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(address, MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -1,37 +1,93 @@
-class SourceBin(object):
-    def __init__(self, tag, count):
-        self.tag = tag
-        self.count = count
+import collections
+from types import MappingProxyType
 
 
-class ReceiveBin(object):
-    def __init__(self, tag, expected_count):
-        self.tag = tag
-        self.expected_count = expected_count
+class SourceBin(collections.namedtuple('SourceBin', ['tag', 'count'])):
+    __slots__ = ()
+
+
+class ReceiveBin(collections.namedtuple('ReceiveBin', ['tag', 'expected_count'])):
+    __slots__ = ()
 
 
 class PickingTask(object):
+    """One rack's share of an order. Immutable once created.
+
+    The dict views below are built on first access, cached, and returned as
+    read-only mappings so every caller can share them. Use PickProgress to
+    track a task while it runs.
+    """
+
+    __slots__ = ('task_id', 'order_id', 'rack', 'source_bins', 'receive_bin',
+                 '_source_bins_in_dict', '_for_init_displays')
+
     def __init__(self, task_id, order_id, rack, source_bins, receive_bin):
-        self.task_id = task_id
-        self.order_id = order_id
-        self.rack = rack
-        self.source_bins = source_bins
-        self.receive_bin = receive_bin  # type: ReceiveBin
+        set_attribute = object.__setattr__
+        set_attribute(self, 'task_id', task_id)
+        set_attribute(self, 'order_id', order_id)
+        set_attribute(self, 'rack', rack)
+        set_attribute(self, 'source_bins', tuple(source_bins))
+        set_attribute(self, 'receive_bin', receive_bin)  # type: ReceiveBin
+        set_attribute(self, '_source_bins_in_dict', None)
+        set_attribute(self, '_for_init_displays', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PickingTask is immutable')
+
+    def __reduce__(self):
+        # Pickle and copy through __init__; the cached views are rebuilt on first access
+        return (PickingTask, (self.task_id, self.order_id, self.rack, self.source_bins, self.receive_bin))
 
     @property
     def source_bins_in_dict(self):
-        return {bin.tag: bin.count for bin in self.source_bins}
+        if self._source_bins_in_dict is None:
+            object.__setattr__(self, '_source_bins_in_dict',
+                               MappingProxyType({bin.tag: bin.count for bin in self.source_bins}))
+        return self._source_bins_in_dict
 
     @property
     def receive_bin_in_dict(self):
-        return {self.receive_bin.tag: self.receive_bin.expected_count}
+        return MappingProxyType({self.receive_bin.tag: self.receive_bin.expected_count})
 
     @property
     def for_init_displays(self):
-        display_dict = self.source_bins_in_dict
-        display_dict.update(self.receive_bin_in_dict)
-        return display_dict
+        if self._for_init_displays is None:
+            display_dict = dict(self.source_bins_in_dict)
+            display_dict[self.receive_bin.tag] = self.receive_bin.expected_count
+            object.__setattr__(self, '_for_init_displays', MappingProxyType(display_dict))
+        return self._for_init_displays
 
     def __str__(self):
         return "Task ID=%d, Order ID=%d, %d bins (%s), Receive bin %s" % \
                (self.task_id, self.order_id, len(self.source_bins), str(' '.join(bin.tag for bin in self.source_bins)), self.receive_bin.tag)
+
+
+class PickProgress(object):
+    """Mutable progress through a running PickingTask.
+
+    Args:
+        task (PickingTask): task being run
+    """
+
+    __slots__ = ('task', 'remaining', 'remaining_total', 'pressed')
+
+    def __init__(self, task):
+        self.task = task
+        self.remaining = dict(task.source_bins_in_dict)
+        self.remaining_total = sum(self.remaining.values())
+        self.pressed = []
+
+    def press_source_bin(self, tag):
+        """Marks a remaining source bin as picked.
+
+        Returns:
+            count (int): number of items in the picked source bin
+        """
+        count = self.remaining.pop(tag)
+        self.remaining_total -= count
+        self.pressed.append(tag)
+        return count
+
+    @property
+    def completed(self):
+        return not self.remaining
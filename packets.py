@@ -0,0 +1,133 @@
+"""packets.py
+
+Parser for the xPL packets the pick-by-light rack sends back: display
+heartbeats and button state changes. Every packet is classified once into a
+`ButtonEvent`, without building intermediate lists or decoding the payload.
+"""
+import collections
+import re
+import time
+from frames import DISPLAYS
+
+HEARTBEAT = 'heartbeat'
+BUTTON_HIGH = 'button-high'
+OTHER = 'other'
+
+ButtonEvent = collections.namedtuple('ButtonEvent', ['tag', 'kind', 'timestamp'])
+
+BUTTON_TAG_PATTERN = re.compile(br'[ABC]\d{2}')
+
+SOURCE_PREFIX = b'source=smgpoe-lamp.'
+
+HEARTBEAT_TEMPLATE = 'xpl-stat\n{\nhop=1\nsource=smgpoe-lamp.%s\ntarget=*\n}\nhbeat.app\n{\ninterval=%d\nport=3865\n}\n'
+BUTTON_TEMPLATE = 'xpl-trig\n{\nhop=1\nsource=smgpoe-lamp.%s\ntarget=*\n}\nsensor.basic\n' \
+                  '{\ndevice=button\ntype=input\ncurrent=%s\n}\n'
+
+
+def build_heartbeat(tag, interval=5):
+    """Builds the heartbeat packet a display sends every `interval` minutes."""
+    return (HEARTBEAT_TEMPLATE % (tag, interval)).encode('utf-8')
+
+
+def build_button_packet(tag, state='HIGH'):
+    """Builds the packet a display sends when its button changes state."""
+    return (BUTTON_TEMPLATE % (tag, state)).encode('utf-8')
+
+
+class PacketParser(object):
+    """Classifies rack packets into heartbeat, button-high and other events.
+
+    The display tag is read at a fixed offset after the `source=` header when
+    the packet has one, and looked up in a precomputed table of known tags so
+    no decoding happens on the hot path. Packets from unknown sources fall
+    back to a precompiled regex search, matching the original behaviour of
+    taking the first `[ABC]NN` in the packet.
+
+    The rack repeats the same few packets over and over (one heartbeat and
+    one press packet per display), so classifications are memoized by packet
+    contents. A packet seen before costs one dict lookup, which is why
+    classifying a new one may take a few substring scans. The memo keeps the
+    `cache_size` most recently seen packets.
+
+    Args:
+        tags (iterable): display ids the rack may report
+        clock (callable): returns the timestamp stored on each event
+        cache_size (int): number of distinct packets whose classification is kept
+    """
+
+    def __init__(self, tags=DISPLAYS, clock=time.monotonic, cache_size=1024):
+        self.tags = {tag.encode('utf-8'): tag for tag in tags}
+        self.clock = clock
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()  # packet -> (tag, kind), least recently seen first
+
+    def parse(self, data):
+        """Classifies one packet.
+
+        Args:
+            data (bytes): datagram received from the rack
+
+        Returns:
+            event (ButtonEvent): the packet's display tag (None if it has
+                none), kind and receive timestamp
+        """
+        timestamp = self.clock()
+
+        cache = self._cache
+        cached = cache.get(data)
+        if cached is None:
+            cached = self._classify(data)
+            cache[bytes(data)] = cached
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(data)
+
+        return ButtonEvent(cached[0], cached[1], timestamp)
+
+    def _classify(self, data):
+        if not data:
+            return None, OTHER
+
+        if b'hbeat' in data:
+            return self._find_tag(data, fallback=False), HEARTBEAT
+
+        if b'HIGH' in data:
+            tag = self._find_tag(data, fallback=True)
+            if tag is not None:
+                return tag, BUTTON_HIGH
+
+        return None, OTHER
+
+    def _find_tag(self, data, fallback):
+        start = data.find(SOURCE_PREFIX)
+        if start != -1:
+            start += len(SOURCE_PREFIX)
+            tag = self.tags.get(data[start:start + 3])
+            if tag is not None:
+                return tag
+
+        if fallback:
+            match = BUTTON_TAG_PATTERN.search(data)
+            if match is not None:
+                return self.tags.get(match.group()) or match.group().decode()
+
+        return None
+
+
+_default_parser = PacketParser()
+
+
+def parse_button_press(data):
+    """Extracts the display whose button was pressed from a rack packet.
+
+    Args:
+        data (bytes): datagram received from the rack
+
+    Returns:
+        display (str): id of display pressed, or None for heartbeats and
+            other packets
+    """
+    event = _default_parser.parse(data)
+    if event.kind is BUTTON_HIGH:
+        return event.tag
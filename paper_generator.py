@@ -1,11 +1,41 @@
+"""paper_generator.py
+
+Generates the paper pick lists, one PDF per task. Rendering is spread over a
+pool of processes, one job per task, so any number of study methods and task
+types can be generated in one run:
+    $ python paper_generator.py MASTER training
+    $ python paper_generator.py -m MASTER -m pick-by-paper_none -t training -t testing
+
+pdfs/manifest.json records what every PDF was rendered from: a hash of its
+task, the version and a hash of this file. PDFs whose inputs did not change
+are not rendered again, unless --force is given. With --combined, all tasks of
+a study method and task type are also written to one multi-page PDF.
+"""
+import functools
+import hashlib
+import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from fpdf import FPDF
 import constants
-import json
-import sys
+import task_cache
+
+
+VERSION = constants.TASK_FILE_VERSION
 
+TASK_TYPES = ['testing', 'training']
+STUDY_FOLDERS_PATH = os.path.join('.', 'RFID-Study-Task-Generation', 'output')
+PDFS_DIR = 'pdfs'
+MANIFEST_FILENAME = os.path.join(PDFS_DIR, 'manifest.json')
 
-VERSION = '1.2'
+VERSION_TEXT = 'Version %s' % VERSION
+
+
+@functools.lru_cache(maxsize=None)
+def header_title(study_method):
+    return study_method.replace('-', ' ').replace('_', ' - ').title()
 
 
 class PickListPDF(FPDF):
@@ -21,14 +51,13 @@ class PickListPDF(FPDF):
 
         # Move to the right, and print title
         self.cell(w=70)
-        title = study_method.replace('-', ' ').replace('_', ' - ').title()
-        self.cell(w=60, h=10, txt=title, align='C', border=1, ln=0, link='C')
+        self.cell(w=60, h=10, txt=header_title(self.study_method), align='C', border=1, ln=0, link='C')
 
         # Move down, to the right, and print version number
         self.set_font('Times', 'B', 12)  # Times New Roman, Bold, 12
         self.set_y(20)
         self.cell(w=75)
-        self.cell(w=50, h=10, txt='Version %s' % VERSION, align='C')
+        self.cell(w=50, h=10, txt=VERSION_TEXT, align='C')
 
         # Line break
         self.ln(5)
@@ -43,81 +72,263 @@ class PickListPDF(FPDF):
         self.cell(w=50, h=10, txt='Task ID %d - %s' % (self.task_id, 'Training' if self.is_training_task else 'Testing'))
 
 
-if __name__ == '__main__':
+class CombinedPickListPDF(PickListPDF):
+    """Pick lists of many tasks, one page per task."""
 
-    # Read command line arguments
-    study_method = sys.argv[1]
-    task_type = sys.argv[2]
+    def __init__(self, study_method, is_training_task, *args, **kwargs):
+        super(CombinedPickListPDF, self).__init__(study_method, None, is_training_task, None, *args, **kwargs)
+        self.page_tasks = []
 
-    # Create path where this JSON file exists and read the file
-    path = os.path.join('.', 'RFID-Study-Task-Generation', 'output', study_method, 'tasks-%s-%s.json' % (study_method, task_type))
-    with open(path, mode='r') as f:
-        data = json.load(f)
+    def add_task_page(self, task_order_number, task_id):
+        self.page_tasks.append((task_order_number, task_id))
+        self.add_page()
 
-    assert data['version'] == VERSION, "Version must match!"
+    def footer(self):
+        # The footer of a page is drawn when the next page is added, so look its task up
+        self.task_order_number, self.task_id = self.page_tasks[self.page - 1]
+        PickListPDF.footer(self)
 
-    for i, task in enumerate(data['tasks']):
 
-        # Setup PDF
-        pdf = PickListPDF(
-            study_method=study_method,
-            task_order_number=i + 1,
-            is_training_task='training' in path,
-            task_id=task['taskId'],
-        )
-        pdf.alias_nb_pages()
-        pdf.add_page()
-        pdf.set_font('Times', '', 11)
-
-        # Write information to PDF
-        for rack in constants.RACKS:
-            txt = rack
-            print(txt)
-
-            pdf.cell(w=0, h=10, txt=txt, border=0, ln=0)
-            pdf.ln(h=5)
+@functools.lru_cache(maxsize=None)
+def generator_hash():
+    """Returns a hash of this file, so changes to the layout re-render every PDF."""
+    with open(os.path.abspath(__file__.replace('.pyc', '.py')), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def task_hash(study_method, task_type, task_order_number, is_training_task, task):
+    content = json.dumps([study_method, task_type, task_order_number, is_training_task, task], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def read_manifest(filename=MANIFEST_FILENAME):
+    try:
+        with open(filename) as f:
+            return json.load(f)['files']
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+
+def write_manifest(files, filename=MANIFEST_FILENAME):
+    temporary_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(temporary_filename, 'w') as f:
+        json.dump({'files': files}, f, indent=1, sort_keys=True)
+    os.replace(temporary_filename, filename)
+
+
+def manifest_entry(content_hash):
+    return {'taskHash': content_hash, 'version': VERSION, 'generatorHash': generator_hash()}
+
+
+def task_file_path(study_method, task_type):
+    return os.path.join(STUDY_FOLDERS_PATH, study_method, 'tasks-%s-%s.json' % (study_method, task_type))
+
 
-            for order in task['orders']:
-                orderId = order['orderId']
+def output_path(study_method, task_type, task_order_number):
+    return os.path.join(PDFS_DIR, study_method,
+                        '%s-%s-Task-Order-Number-%d.pdf' % (study_method, task_type, task_order_number))
 
-                txt = ' ' * 20 + '-' * 25
-                print(txt)
 
-                pdf.cell(w=0, h=10, txt=txt, border=0, ln=0)
-                pdf.ln(h=5)
+def combined_output_path(study_method, task_type):
+    return os.path.join(PDFS_DIR, study_method, '%s-%s-All-Tasks.pdf' % (study_method, task_type))
 
-                txt = ' ' * 20 + str(orderId)
-                print(txt)
 
-                pdf.cell(w=0, h=10, txt=txt, border=0, ln=0)
-                pdf.ln(h=5)
+def pick_list_lines(task):
+    """Returns the lines of a task's pick list, by rack then order."""
+    lines = []
+    for rack in constants.RACKS:
+        lines.append(rack)
 
-                for source_bin in order['sourceBins']:
-                    if source_bin['binTag'][0] != rack:
-                        continue
+        for order in task['orders']:
+            lines.append(' ' * 20 + '-' * 25)
+            lines.append(' ' * 20 + str(order['orderId']))
 
-                    txt = ' ' * 30 \
-                        + "%s x %d" % (source_bin['binTag'][1:], source_bin['numItems'])
+            for source_bin in order['sourceBins']:
+                if source_bin['binTag'][0] != rack:
+                    continue
+                lines.append(' ' * 30 + "%s x %d" % (source_bin['binTag'][1:], source_bin['numItems']))
 
-                    print(txt)
+            # Blank line after every order
+            lines.append(None)
 
-                    pdf.cell(w=0, h=10, txt=txt, border=0, ln=0)
-                    pdf.ln(h=5)
+    return lines
 
-                pdf.ln(h=5)
 
-        # Create output directories if needed
-        pdfs_dir = 'pdfs'
-        if not os.path.isdir(pdfs_dir):
-            os.mkdir(pdfs_dir)
+def render_task_pdf(job):
+    """Renders one task's pick list to its PDF. Runs in a worker process.
 
-        output_dir = os.path.join(pdfs_dir, study_method)
+    Args:
+        job (tuple): study method, task type, task order number, whether it is
+            a training task, the task dict and the output filename
+
+    Returns:
+        lines (list): the lines written, None for the blank line after an order
+    """
+    study_method, task_type, task_order_number, is_training_task, task, output_filename = job
+
+    # Setup PDF
+    pdf = PickListPDF(
+        study_method=study_method,
+        task_order_number=task_order_number,
+        is_training_task=is_training_task,
+        task_id=task['taskId'],
+    )
+    pdf.alias_nb_pages()
+    pdf.add_page()
+
+    # Write information to PDF
+    lines = pick_list_lines(task)
+    write_pick_list(pdf, lines)
+
+    # Write to output file
+    pdf.output(output_filename, dest='F')
+    return lines
+
+
+def render_combined_pdf(job):
+    """Renders the pick lists of many tasks to one PDF. Runs in a worker process.
+
+    Args:
+        job (tuple): study method, whether they are training tasks, a list of
+            (task order number, task dict) and the output filename
+    """
+    study_method, is_training_task, tasks, output_filename = job
+
+    pdf = CombinedPickListPDF(study_method=study_method, is_training_task=is_training_task)
+    pdf.alias_nb_pages()
+    for task_order_number, task in tasks:
+        pdf.add_task_page(task_order_number, task['taskId'])
+        write_pick_list(pdf, pick_list_lines(task))
+
+    pdf.output(output_filename, dest='F')
+
+
+def write_pick_list(pdf, lines):
+    pdf.set_font('Times', '', 11)
+    for txt in lines:
+        if txt is None:
+            pdf.ln(h=5)
+            continue
+        pdf.cell(w=0, h=10, txt=txt, border=0, ln=0)
+        pdf.ln(h=5)
+
+
+def iter_jobs(study_method, task_type):
+    """Yields a render_task_pdf job for every task of a task file."""
+    path = task_file_path(study_method, task_type)
+    data = task_cache.load_task_document(path)
+
+    assert data['version'] == VERSION, "Version must match!"
+
+    for i, task in enumerate(data['tasks']):
+        yield (study_method, task_type, i + 1, 'training' in path, task,
+               output_path(study_method, task_type, i + 1))
+
+
+def generate(study_methods, task_types, workers=None, verbose=True, force=False, combined=False):
+    """Generates the pick list PDFs of every given study method and task type.
+
+    Only PDFs whose manifest entry is missing or out of date are rendered.
+
+    Args:
+        study_methods (list): study methods, i.e. folders of the task generation output
+        task_types (list): task types, e.g. training and testing
+        workers (int): number of processes, None for one per CPU
+        verbose (bool): print the pick lists, in task order
+        force (bool): render every PDF, even if it is up to date
+        combined (bool): also write one PDF with every task per study method and task type
+
+    Returns:
+        rendered (int): number of PDFs written
+        skipped (int): number of PDFs that were up to date
+    """
+    manifest = read_manifest()
+    jobs = []
+    combined_jobs = []
+    hashes = {}
+    skipped = 0
+
+    for study_method in study_methods:
+        for task_type in task_types:
+            task_jobs = list(iter_jobs(study_method, task_type))
+            for job in task_jobs:
+                output_filename = job[-1]
+                hashes[output_filename] = task_hash(*job[:-1])
+                if not force and manifest.get(output_filename) == manifest_entry(hashes[output_filename]) and \
+                        os.path.exists(output_filename):
+                    skipped += 1
+                else:
+                    jobs.append(job)
+
+            if combined and task_jobs:
+                output_filename = combined_output_path(study_method, task_type)
+                content = ''.join(hashes[job[-1]] for job in task_jobs)
+                hashes[output_filename] = hashlib.sha1(content.encode('ascii')).hexdigest()
+                if not force and manifest.get(output_filename) == manifest_entry(hashes[output_filename]) and \
+                        os.path.exists(output_filename):
+                    skipped += 1
+                else:
+                    combined_jobs.append((study_method, task_jobs[0][3], [(job[2], job[4]) for job in task_jobs],
+                                          output_filename))
+
+    # Create output directories if needed
+    for study_method in study_methods:
+        output_dir = os.path.join(PDFS_DIR, study_method)
         if not os.path.isdir(output_dir):
-            os.mkdir(output_dir)
+            os.makedirs(output_dir)
 
-        # Write to output file
-        output_filename = os.path.join(output_dir, '%s-%s-Task-Order-Number-%d.pdf' % (study_method, task_type, i + 1))
-        pdf.output(output_filename, dest='F')
+    if jobs or combined_jobs:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # The combined PDFs are the longest jobs, so start them first
+            combined_futures = [executor.submit(render_combined_pdf, job) for job in combined_jobs]
 
-        # Uncomment below to open the file (only works on macOS)
-        # os.system('open %s' % output_filename)
+            chunksize = max(1, len(jobs) // (4 * workers))
+            for job, lines in zip(jobs, executor.map(render_task_pdf, jobs, chunksize=chunksize)):
+                manifest[job[-1]] = manifest_entry(hashes[job[-1]])
+                if verbose:
+                    for txt in lines:
+                        if txt is not None:
+                            print(txt)
+
+            for job, future in zip(combined_jobs, combined_futures):
+                future.result()
+                manifest[job[-1]] = manifest_entry(hashes[job[-1]])
+
+        write_manifest(manifest)
+
+    return len(jobs) + len(combined_jobs), skipped
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate paper pick list PDFs.')
+    parser.add_argument('method_and_type', nargs='*', metavar='METHOD TYPE',
+                        help='study method and task type, as in: MASTER training')
+    parser.add_argument('-m', '--method', action='append', default=[], help='study method, may be repeated')
+    parser.add_argument('-t', '--type', dest='task_type', action='append', default=[],
+                        help='task type, may be repeated (default: %s)' % ' and '.join(TASK_TYPES))
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of processes (default: one per CPU)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print the pick lists')
+    parser.add_argument('-f', '--force', action='store_true', help='render every PDF, even if it is up to date')
+    parser.add_argument('-c', '--combined', action='store_true',
+                        help='also write one PDF with every task per study method and task type')
+    args = parser.parse_args()
+
+    study_methods = args.method
+    task_types = args.task_type
+    if args.method_and_type:
+        if len(args.method_and_type) != 2:
+            parser.error('give a study method and a task type, or use --method and --type')
+        study_methods = study_methods + [args.method_and_type[0]]
+        task_types = task_types + [args.method_and_type[1]]
+    if not study_methods:
+        parser.error('no study method given')
+    task_types = task_types or TASK_TYPES
+
+    start = time.time()
+    rendered, skipped = generate(study_methods, task_types, workers=args.jobs, verbose=not args.quiet,
+                                 force=args.force, combined=args.combined)
+    print('Generated %d PDFs (%d up to date) for %d study methods and %d task types in %.2f s' %
+          (rendered, skipped, len(study_methods), len(task_types), time.time() - start), file=sys.stderr)
@@ -0,0 +1,151 @@
+"""pick_steps.py
+
+The pick task logic shared by the blocking controller in fml.py and the asyncio
+controller in async_engine.py. The steps are generators that never wait
+themselves: they yield `PRESS` when they need the next button press and get the
+id of the pressed display sent back, and yield a number of seconds when the
+controller should pause. Each controller drives them with its own way of
+waiting and passes in how it changes the displays:
+
+    change_display(display=None, all_displays=False, number=None, layout=None)
+    display_batch()  # context manager with set(display, number=None, layout=None), sent on exit
+    reset()
+
+Given a Metrics registry, the steps time the displays' start and each task,
+count tasks and unexpected presses, and record press_to_state_change: the time
+from a press reaching the controller, as told by `pressed_at()`, to the task
+state taking it into account. When the frames answering it are sent is up to
+the controller's sinks, see sinks.UdpRackSink.
+"""
+import contextlib
+import time
+from models import PickingTask, PickProgress
+from constants import EMPTY_LIGHT_LAYOUT, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT
+
+# Yielded by the steps to wait for the next button press
+PRESS = 'press'
+
+
+def init_displays(pickpath, display_batch, log, metrics=None):
+    """Starts the order on the displays.
+
+    Args:
+        pickpath (dict): keys are displays and values are quantities
+        display_batch (callable): returns a batch the displays are set on
+        log (logging.Logger): logger for task progress
+        metrics (Metrics): optional registry the init_displays time is recorded to
+    """
+    with _timer(metrics, 'init_displays'):
+        with display_batch() as batch:
+            for display, quantity in pickpath.items():
+                log.debug('Setting display %s = %d', display, quantity)
+                batch.set(display, number=quantity)
+
+
+def run_all_pick_tasks(pick_tasks, change_display, display_batch, reset, log, task_pause=0.1, metrics=None,
+                       pressed_at=None):
+    """Runs every pick task in order, resetting the displays between tasks.
+
+    Args:
+        pick_tasks (list): picking tasks to run, in order
+        change_display (callable): changes a single display
+        display_batch (callable): returns a batch of display changes
+        reset (callable): clears the displays
+        log (logging.Logger): logger for task progress
+        task_pause (float): seconds to pause after resetting the displays between tasks
+        metrics (Metrics): optional registry task metrics are recorded to
+        pressed_at (callable): returns the time.monotonic() at which the last
+            press was received, or None to use the time the steps get it
+    """
+    for i, pick_task in enumerate(pick_tasks):  # type: PickingTask
+
+        # Show start symbol to subject on first task
+        if i == 0:
+            change_display(display=pick_task.receive_bin.tag, layout=RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
+
+            # Get user's confirmation to start first task (must press first receive bin to start)
+            while (yield PRESS) != pick_task.receive_bin.tag:
+                pass
+
+        log.info("TASK START: %s", pick_task,
+                 extra={'event': 'task_start', 'task_id': pick_task.task_id, 'order_id': pick_task.order_id})
+
+        with _timer(metrics, 'task_duration'):
+            yield from run_pick_path(pick_task, change_display, display_batch, log, metrics, pressed_at)
+        if metrics is not None:
+            metrics.increment('tasks')
+
+        log.info("TASK END: %s", pick_task,
+                 extra={'event': 'task_end', 'task_id': pick_task.task_id, 'order_id': pick_task.order_id})
+
+        reset()
+
+        if task_pause:
+            yield task_pause
+
+
+def run_pick_path(pickpath, change_display, display_batch, log, metrics=None, pressed_at=None):
+    """Runs a full pick path.
+
+    Args:
+        pickpath (PickingTask): task whose source bins are picked into its receive bin
+        change_display (callable): changes a single display
+        display_batch (callable): returns a batch of display changes
+        log (logging.Logger): logger for task progress
+        metrics (Metrics): optional registry press metrics are recorded to
+        pressed_at (callable): returns the time.monotonic() at which the last
+            press was received, or None to use the time the steps get it
+    """
+    init_displays(pickpath.for_init_displays, display_batch, log, metrics)
+
+    progress = PickProgress(pickpath)
+    receive_bin_tag = pickpath.receive_bin.tag
+
+    # Control loop will run while the pickpath is in progress
+    while True:
+        # Wait for a button to be pressed...
+        pressed_bin_tag = yield PRESS
+        received_at = pressed_at() if pressed_at is not None else None
+        if received_at is None:
+            received_at = time.monotonic()
+
+        log.debug("Subject pressed %s.", pressed_bin_tag, extra={'event': 'press', 'tag': pressed_bin_tag})
+
+        # Else if the subject pressed a source bin
+        if pressed_bin_tag in progress.remaining:
+            # Subject has pressed the source bin and doesn't have to do so again.
+            # Remove this bin from the expected/remaining ones.
+            pressed_source_bin_count = progress.press_source_bin(pressed_bin_tag)  # type: int
+            if metrics is not None:
+                metrics.record('press_to_state_change', time.monotonic() - received_at)
+
+            # Set the pressed source bin value to 0
+            change_display(display=pressed_bin_tag, number=0)
+
+            log.debug("%s with %d items was pressed. Decrementing total to %d",
+                      pressed_bin_tag, pressed_source_bin_count, progress.remaining_total)
+
+            # Update the total on the receive bin
+            change_display(display=receive_bin_tag, number=progress.remaining_total)
+
+        # If the subject pressed all of the required source bins' buttons the task is now over
+        elif progress.completed and pressed_bin_tag == receive_bin_tag:
+            # Set the receive bin tags to empty (pick path is done)
+            with display_batch() as batch:
+                for tag in progress.pressed + [receive_bin_tag]:
+                    log.debug("Clearing display %s", tag)
+                    batch.set(tag, layout=EMPTY_LIGHT_LAYOUT)
+            return
+
+        else:
+            if metrics is not None:
+                metrics.increment('unexpected_presses')
+            log.warning("Unexpected button pressed: %s", pressed_bin_tag,
+                        extra={'event': 'unexpected_press', 'tag': pressed_bin_tag})
+
+
+def _timer(metrics, name):
+    """Returns a timer recording into `metrics`, or a no-op context manager without them."""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.timer(name)
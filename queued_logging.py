@@ -0,0 +1,154 @@
+"""queued_logging.py
+
+Logging that keeps I/O off the caller's thread. The handlers utils attaches to
+loggers are QueuedHandlers: they stamp each record with a monotonic
+timestamp in microseconds and put it on a queue. One background thread, the
+LogWriter, does the formatting and the console, file and JSONL writes.
+Records still on the queue are written when the interpreter exits.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Attributes every LogRecord has; anything else was passed with `extra`
+STANDARD_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | \
+    frozenset(['message', 'asctime', 'monotonic_us'])
+
+
+class LogWriter(object):
+    """Background thread handing queued records to their target handlers."""
+
+    _STOP = object()
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='LogWriter')
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """Writes every queued record, then stops the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put((self._STOP, None))
+            thread.join(timeout)
+
+    def flush(self, timeout=5.0):
+        """Blocks until the records queued so far were written."""
+        if self._thread is None:
+            return
+        written = threading.Event()
+        self.queue.put((written, None))
+        written.wait(timeout)
+
+    def _run(self):
+        while True:
+            target, record = self.queue.get()
+            if target is self._STOP:
+                break
+            if isinstance(target, threading.Event):
+                target.set()
+                continue
+            try:
+                target.handle(record)
+            except Exception:
+                target.handleError(record)
+
+        for handler in _queued_targets:
+            try:
+                handler.flush()
+            except ValueError:
+                # The handler's stream was closed already, e.g. by a test runner at exit
+                pass
+
+
+_queued_targets = []
+
+_exception_formatter = logging.Formatter()
+
+writer = LogWriter()
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """Queues records for `target`, which the LogWriter thread then writes.
+
+    Args:
+        target (Handler): handler doing the actual formatting and writing
+    """
+
+    def __init__(self, target):
+        logging.handlers.QueueHandler.__init__(self, writer.queue)
+        self.target = target
+        self.setLevel(target.level)
+        _queued_targets.append(target)
+        writer.start()
+
+    def prepare(self, record):
+        # Records going to several handlers keep the first stamp
+        if not hasattr(record, 'monotonic_us'):
+            record.monotonic_us = time.monotonic_ns() // 1000
+
+        # Formatting happens on the writer thread, but the message is merged
+        # here, as QueueHandler does, so arguments changed after the call do
+        # not change what is written. The target's formatter is kept, so only
+        # the message and the traceback are frozen, not the whole line.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.queue.put((self.target, record))
+
+    def close(self):
+        self.target.close()
+        logging.handlers.QueueHandler.close(self)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line.
+
+    Besides the wall clock time, the monotonic time in microseconds, the logger,
+    level, thread and message, every field passed with `extra` is included,
+    e.g. `logger.info('...', extra={'event': 'press', 'tag': 'A11'})`.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'monotonic_us': getattr(record, 'monotonic_us', None),
+            'logger': record.name,
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def queued(handler):
+    """Returns a QueuedHandler writing through `handler` on the LogWriter thread."""
+    return QueuedHandler(handler)
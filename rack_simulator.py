@@ -0,0 +1,383 @@
+"""rack_simulator.py
+
+Stand-in for the pick-by-light rack, speaking the same xPL dialect over UDP.
+It accepts `control.basic` display frames, keeps the state of every display,
+sends heartbeats and answers with `HIGH` button packets from a picker model,
+so fml.py can be driven end-to-end without the physical rack.
+
+Run a simulated rack for a controller on this machine:
+    $ python rack_simulator.py --port 3866 --controller 127.0.0.1:3865 --heartbeat 5
+
+Or run a load test of fml.run_all_pick_tasks on loopback:
+    $ python rack_simulator.py --load-test 500
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import threading
+import time
+from socket import *
+import utils
+from models import SourceBin, ReceiveBin, PickingTask
+from constants import EMPTY_LIGHT_LAYOUT, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT, ALL_DISPLAYS, PICK_BY_LIGHT_PORT, \
+    SOURCE_BINS, RECEIVE_BINS, RACKS
+from frames import NUMBER_LAYOUTS
+from packets import build_heartbeat, build_button_packet
+
+# Setup logging
+logger = logging.getLogger(os.path.basename(__file__))
+logger = utils.configure_logger(logger, level=logging.INFO)
+
+DISPLAY_FRAME_PATTERN = re.compile(br'target=smgpoe-lamp\.([^\n]+)\n.*?current=(\d+)', re.DOTALL)
+
+PRESSED_SOURCE_BIN_LAYOUT = NUMBER_LAYOUTS[0]
+
+RECEIVE_BIN_READY_LAYOUTS = (NUMBER_LAYOUTS[0], RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
+
+
+class ScriptedPicker(object):
+    """Presses a fixed sequence of buttons, one per display change.
+
+    Args:
+        tags (list): display ids to press, in order
+    """
+
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.position = 0
+
+    @classmethod
+    def for_pick_tasks(cls, pick_tasks):
+        """Returns a picker doing the pick tasks without mistakes, starting with the first receive bin."""
+        tags = [pick_tasks[0].receive_bin.tag] if pick_tasks else []
+        for pick_task in pick_tasks:
+            tags.extend(bin.tag for bin in pick_task.source_bins)
+            tags.append(pick_task.receive_bin.tag)
+        return cls(tags)
+
+    def next_press(self, displays):
+        if self.position >= len(self.tags):
+            return None
+        tag = self.tags[self.position]
+        self.position += 1
+        return tag
+
+
+class RandomPicker(object):
+    """Picks like a subject would: every lit source bin, then the lit receive bin.
+
+    Source bins still showing a count are pressed in random order. Once none
+    are left and the receive bin total is down to zero, the receive bin is
+    pressed. The receive bin is also pressed when it shows the start symbol.
+
+    Args:
+        error_rate (float): chance of pressing a random display instead
+        seed (int): seed for the random number generator
+    """
+
+    def __init__(self, error_rate=0.0, seed=None):
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def next_press(self, displays):
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.random.choice(SOURCE_BINS + RECEIVE_BINS)
+
+        source_bins = [tag for tag, layout in displays.items()
+                       if tag[0] in RACKS and layout not in (EMPTY_LIGHT_LAYOUT, PRESSED_SOURCE_BIN_LAYOUT)]
+        if source_bins:
+            return self.random.choice(source_bins)
+
+        receive_bins = [tag for tag, layout in displays.items()
+                        if tag in RECEIVE_BINS and layout in RECEIVE_BIN_READY_LAYOUTS]
+        if receive_bins:
+            return receive_bins[0]
+
+        return None
+
+
+class RackSimulator(object):
+    """Simulated rack listening for display frames on a UDP socket.
+
+    Args:
+        address (tuple): address to receive display frames on; port 0 picks a free port
+        controller_address (tuple): where button packets and heartbeats are sent
+        tags (list): display ids on the simulated rack
+        heartbeat_interval (float): seconds between heartbeat rounds, None for none
+        picker (object): picker model with a `next_press(displays)` method, None
+            to only press buttons through `press()`
+        press_delay (float): seconds the picker waits before each press
+        answer_timeout (float): seconds the picker waits for the display it
+            pressed to change before pressing again
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), controller_address=('127.0.0.1', PICK_BY_LIGHT_PORT),
+                 tags=SOURCE_BINS + RECEIVE_BINS, heartbeat_interval=None, picker=None, press_delay=0.0,
+                 answer_timeout=0.05):
+        self.controller_address = controller_address
+        self.tags = list(tags)
+        self.heartbeat_interval = heartbeat_interval
+        self.picker = picker
+        self.press_delay = press_delay
+        self.answer_timeout = answer_timeout
+
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        self.sock.bind(address)
+        self.address = self.sock.getsockname()
+
+        self.displays = {tag: EMPTY_LIGHT_LAYOUT for tag in self.tags}
+        self.state_changed = threading.Condition()
+
+        self.frames_received = 0
+        self.heartbeats_sent = 0
+        self.presses_sent = 0
+        self.latencies = []
+        self._last_press_time = None
+
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        targets = [self._receive_loop]
+        if self.heartbeat_interval:
+            targets.append(self._heartbeat_loop)
+        if self.picker is not None:
+            targets.append(self._picker_loop)
+
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._running = False
+        with self.state_changed:
+            self.state_changed.notify_all()
+        # Unblock the receiving thread
+        self.sock.sendto(b'', self.address)
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def press(self, tag):
+        """Sends a button press for `tag` to the controller."""
+        self._last_press_time = time.monotonic()
+        self.sock.sendto(build_button_packet(tag), self.controller_address)
+        self.presses_sent += 1
+
+    def send_heartbeats(self):
+        for tag in self.tags:
+            self.sock.sendto(build_heartbeat(tag), self.controller_address)
+            self.heartbeats_sent += 1
+
+    def _receive_loop(self):
+        while self._running:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            match = DISPLAY_FRAME_PATTERN.search(data)
+            if match is None:
+                continue
+
+            now = time.monotonic()
+            tag = match.group(1).decode()
+            layout = int(match.group(2))
+
+            with self.state_changed:
+                if self._last_press_time is not None:
+                    # Time from a press to the first display frame answering it
+                    self.latencies.append(now - self._last_press_time)
+                    self._last_press_time = None
+
+                if tag == ALL_DISPLAYS:
+                    for display in self.displays:
+                        self.displays[display] = layout
+                else:
+                    self.displays[tag] = layout
+                self.frames_received += 1
+                self.state_changed.notify_all()
+
+    def _heartbeat_loop(self):
+        while self._running:
+            self.send_heartbeats()
+            time.sleep(self.heartbeat_interval)
+
+    def _picker_loop(self):
+        # Display the last press should change, and what it showed when pressed
+        awaited_tag, awaited_layout = None, None
+        while self._running:
+            with self.state_changed:
+                # Let the controller answer the previous press before looking at the displays again.
+                # Wrong presses get no answer, so give up waiting after a while.
+                if awaited_tag is not None and self.displays.get(awaited_tag) == awaited_layout:
+                    if self.state_changed.wait(timeout=self.answer_timeout):
+                        continue
+                displays = dict(self.displays)
+                tag = self.picker.next_press(displays)
+                if tag is None:
+                    self.state_changed.wait(timeout=self.answer_timeout)
+                    continue
+
+            awaited_tag, awaited_layout = tag, displays.get(tag)
+            if self.press_delay:
+                time.sleep(self.press_delay)
+            self.press(tag)
+
+
+def generate_pick_tasks(num_tasks, bins_per_task=4, seed=0):
+    """Generates random picking tasks, cycling through racks and receive bins.
+
+    Args:
+        num_tasks (int): number of tasks to generate
+        bins_per_task (int): source bins in each task
+        seed (int): seed for the random number generator
+
+    Returns:
+        pick_tasks (list): list of PickingTask
+    """
+    rng = random.Random(seed)
+    pick_tasks = []
+    for i in range(num_tasks):
+        rack = RACKS[(i // len(RECEIVE_BINS)) % len(RACKS)]
+        tags = rng.sample([tag for tag in SOURCE_BINS if tag[0] == rack], bins_per_task)
+        source_bins = [SourceBin(tag=tag, count=rng.randint(1, 9)) for tag in tags]
+        pick_tasks.append(PickingTask(
+            task_id=i % len(RECEIVE_BINS) + 1,
+            order_id=i // len(RECEIVE_BINS) + 1,
+            rack=rack,
+            source_bins=source_bins,
+            receive_bin=ReceiveBin(
+                tag=RECEIVE_BINS[i % len(RECEIVE_BINS)],
+                expected_count=sum(bin.count for bin in source_bins),
+            ),
+        ))
+    return pick_tasks
+
+
+def run_load_test(pick_tasks, heartbeat_interval=None, error_rate=0.0, send_rate=False, verify=False):
+    """Drives fml.run_all_pick_tasks against a simulated rack on loopback.
+
+    Args:
+        pick_tasks (list): PickingTasks to run
+        heartbeat_interval (float): seconds between simulated heartbeats, None for none
+        error_rate (float): chance of the picker pressing a wrong button
+        send_rate (float): pace frames through fml's scheduler at this many frames
+            per second (None for unpaced but queued), False to send directly
+        verify (bool): have the scheduler check sends against the simulator's displays
+
+    Returns:
+        results (dict): presses, frames, elapsed seconds, presses per second,
+            press-to-display latency percentiles in milliseconds as seen by the
+            simulator, and fml's own press-to-state-change and press-to-send ones
+    """
+    import fml
+
+    # Presses come much faster than a person could, so nothing can be a bounce
+    fml.debouncer.window = 0
+    fml_level = fml.logger.level
+    fml.logger.setLevel(logging.WARNING)
+
+    fml.metrics.reset()
+    fml.open_socket(local_address=('127.0.0.1', 0))
+    controller_address = fml.sockhub.getsockname()
+
+    simulator = RackSimulator(controller_address=controller_address, heartbeat_interval=heartbeat_interval,
+                              picker=RandomPicker(error_rate=error_rate, seed=0))
+    fml.rack_sink.address = simulator.address
+
+    if send_rate is not False:
+        fml.configure_scheduler(rate=send_rate,
+                                verify=(lambda display, layout: simulator.displays.get(display) == layout)
+                                if verify else None)
+
+    try:
+        with simulator:
+            started = time.monotonic()
+            fml.run_all_pick_tasks(pick_tasks, task_pause=0)
+            elapsed = time.monotonic() - started
+            scheduler = fml.rack_sink.scheduler
+            fml.close_sinks()
+    finally:
+        fml.close_sinks()
+        fml.sockhub.close()
+        fml.logger.setLevel(fml_level)
+
+    latencies = sorted(simulator.latencies) or [0.0]
+    results = {
+        'tasks': len(pick_tasks),
+        'presses': simulator.presses_sent,
+        'frames': simulator.frames_received,
+        'elapsed': elapsed,
+        'presses_per_second': simulator.presses_sent / elapsed,
+        'latency_p50_ms': latencies[len(latencies) // 2] * 1e3,
+        'latency_p99_ms': latencies[int(len(latencies) * 0.99)] * 1e3,
+        'latency_max_ms': latencies[-1] * 1e3,
+    }
+    for name in ['press_to_state_change', 'press_to_send']:
+        summary = fml.metrics.histograms[name].summary()
+        results['fml_%s_p50_ms' % name] = summary['p50_ms']
+        results['fml_%s_p99_ms' % name] = summary['p99_ms']
+    if scheduler is not None:
+        for key, value in scheduler.stats().items():
+            results['scheduler_' + key] = value
+    return results
+
+
+def parse_address(text):
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated pick-by-light rack.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to receive display frames on')
+    parser.add_argument('--port', type=int, default=PICK_BY_LIGHT_PORT + 1, help='port to receive display frames on')
+    parser.add_argument('--controller', type=parse_address, default=('127.0.0.1', PICK_BY_LIGHT_PORT),
+                        help='host:port of the controller receiving button presses')
+    parser.add_argument('--heartbeat', type=float, default=None, help='seconds between heartbeats')
+    parser.add_argument('--picker', choices=['none', 'random'], default='random')
+    parser.add_argument('--press-delay', type=float, default=0.5, help='seconds before each simulated press')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of pressing a wrong button')
+    parser.add_argument('--load-test', type=int, metavar='TASKS', help='run fml against the simulator and exit')
+    parser.add_argument('--send-rate', type=float, default=False,
+                        help='load test: pace frames through the scheduler at this many frames per second')
+    parser.add_argument('--verify', action='store_true', help='load test: verify sends against the simulator')
+    args = parser.parse_args()
+
+    if args.load_test:
+        results = run_load_test(generate_pick_tasks(args.load_test), heartbeat_interval=args.heartbeat,
+                                error_rate=args.error_rate, send_rate=args.send_rate, verify=args.verify)
+        for key, value in results.items():
+            print('%-20s %s' % (key, value))
+        return
+
+    picker = RandomPicker(error_rate=args.error_rate) if args.picker == 'random' else None
+    simulator = RackSimulator(address=(args.host, args.port), controller_address=args.controller,
+                              heartbeat_interval=args.heartbeat, picker=picker, press_delay=args.press_delay)
+    logger.info('Simulated rack listening on %s:%d, pressing buttons for %s:%d' %
+                (simulator.address + args.controller))
+    with simulator:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    logger.info('%d frames received, %d presses and %d heartbeats sent' %
+                (simulator.frames_received, simulator.presses_sent, simulator.heartbeats_sent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,593 @@
+"""replay.py
+
+Replays recorded pick sessions through the task logic, to reproduce incidents,
+measure throughput and check that a change did not alter what the system does.
+
+A session is read from a log written by fml.py or check_barcode.py (the text
+log or its .jsonl twin) or from a packet capture of the rack traffic (pcap, as
+written by tcpdump). Its button presses are fed to fml.runPickPath through
+fml.press(), and its barcode scans to check_barcode.compareBarcode, either as
+fast as possible or at the original pace scaled by --speed. The display
+commands and warnings of the replay are then diffed against those of the
+original run:
+    $ python replay.py logs/*.log
+    $ python replay.py --speed 1 logs/theo-pick-by-light_button-testing.log
+    $ python replay.py --task-file tasks.json capture.pcap
+
+Logs record every task they run, so the tasks are rebuilt from the log unless
+--task-file is given. Packet captures do not, and need --task-file. Display
+commands are only compared when the original log has them (logs from before
+the "Setting display" debug messages only record presses and warnings). The
+exit status is 1 if any session diverged.
+
+Logs of the older controller, with "Task (Order ID=.., Task ID=..)" task starts
+and "Unexpected state!" warnings, are reported as unreplayable: that
+controller ended a task on its last source bin, without the receive bin press
+the current one waits for, so every task would diverge.
+"""
+import calendar
+import collections
+import contextlib
+import difflib
+import json
+import logging
+import os
+import re
+import struct
+import time
+import check_barcode
+import fml
+import task_cache
+import utils
+from constants import EMPTY_LIGHT_LAYOUT
+from models import PickingTask, SourceBin, ReceiveBin
+from packets import build_button_packet
+from rack_simulator import DISPLAY_FRAME_PATTERN
+from shadow import DisplayShadow
+from sinks import RecordingSink, DisplayUpdate
+
+# Setup logging
+logger = logging.getLogger(os.path.basename(__file__))
+logger = utils.configure_logger(logger)
+
+LIGHT = 'light'
+BARCODE = 'barcode'
+TRACE = 'trace'
+
+# One record of an original log: seconds since the epoch, level name and message
+LogRecord = collections.namedtuple('LogRecord', ['time', 'level', 'message'])
+
+TASK_START_PATTERN = re.compile(r'Task ID=(\d+), Order ID=(\d+), \d+ bins \(([^)]*)\), Receive bin (\w+)')
+# Older logs: "Task (Order ID=17, Task ID=1): 3 bins -> C11", with the two IDs swapped
+OLD_TASK_START_PATTERN = re.compile(r'Task \(Order ID=(\d+), Task ID=(\d+)\): \d+ bins -> (\w+)')
+SETTING_DISPLAY_PATTERN = re.compile(r'Setting display (\w+) = (\d+)')
+DECREMENT_PATTERN = re.compile(r'(\w+) with \d+ items was pressed\. Decrementing total to (\d+)')
+# Warning of the older controller for any press it did not expect
+LEGACY_UNEXPECTED_PRESS = 'Unexpected state!'
+
+
+class RecordedTask(object):
+    """One task of a recorded session, with what the subject did and what the system answered.
+
+    Attributes:
+        task_id (int): task ID, from the log
+        order_id (int): order ID, from the log
+        receive_bin (str): receive bin of the task
+        source_bins (list): source bins of the task, None when the log does not list them
+        counts (dict): display -> number shown when the task started, when the log has them
+        inputs (list): (time, tag) of every press or scan
+        outputs (list): normalized display commands and messages of the original run
+    """
+
+    def __init__(self, task_id, order_id, receive_bin, source_bins=None):
+        self.task_id = task_id
+        self.order_id = order_id
+        self.receive_bin = receive_bin
+        self.source_bins = source_bins
+        self.counts = {}
+        self.inputs = []
+        self.outputs = []
+
+    def header(self):
+        return task_header(self.task_id, self.order_id)
+
+    def picking_task(self):
+        """Rebuilds the PickingTask. Without source bins in the log, the pressed bins are used, with one item each."""
+        source_bins = self.source_bins
+        if source_bins is None:
+            source_bins = sorted(set(tag for _, tag in self.inputs if tag != self.receive_bin))
+        return PickingTask(self.task_id, self.order_id, source_bins[0][0] if source_bins else None,
+                           [SourceBin(tag, self.counts.get(tag, 1)) for tag in source_bins],
+                           ReceiveBin(self.receive_bin, self.counts.get(self.receive_bin, len(source_bins))))
+
+
+class Session(object):
+    """A recorded session, ready to be replayed.
+
+    Attributes:
+        filename (str): file the session was read from
+        kind (str): LIGHT, BARCODE or TRACE
+        tasks (list): RecordedTasks, for LIGHT and BARCODE sessions
+        inputs (list): (time, packet) of every packet received by the controller, for TRACE sessions
+        outputs (list): normalized display commands sent by the controller, for TRACE sessions
+        has_displays (bool): whether the original display commands are known
+        legacy (bool): whether the log was written by the older controller, see the module docstring
+    """
+
+    def __init__(self, filename, kind=None):
+        self.filename = filename
+        self.kind = kind
+        self.tasks = []
+        self.inputs = []
+        self.outputs = []
+        self.has_displays = False
+        self.legacy = False
+
+    @property
+    def num_inputs(self):
+        if self.kind == TRACE:
+            return len(self.inputs)
+        return sum(len(task.inputs) for task in self.tasks)
+
+    @property
+    def duration(self):
+        """Seconds between the first and the last input of the original run."""
+        inputs = self.inputs if self.kind == TRACE else [entry for task in self.tasks for entry in task.inputs]
+        return inputs[-1][0] - inputs[0][0] if inputs else 0.0
+
+    def original_lines(self):
+        if self.kind == TRACE:
+            return list(self.outputs)
+        lines = []
+        for task in self.tasks:
+            lines.append(task.header())
+            lines.extend(line for line in task.outputs if self.has_displays or not is_display_line(line))
+        return lines
+
+
+def task_header(task_id, order_id):
+    return '== Task ID=%d, Order ID=%d' % (task_id, order_id)
+
+
+def display_line(display, number=None, layout=None):
+    if number is not None:
+        return '%s = %d' % (display, number)
+    if layout == EMPTY_LIGHT_LAYOUT:
+        return '%s = blank' % display
+    return '%s = layout %d' % (display, layout)
+
+
+def is_display_line(line):
+    return not line.startswith('== ') and ' = ' in line
+
+
+def parse_asctime(asctime):
+    """Returns seconds since the epoch for "2018-03-29 11:29:18,505", read as UTC."""
+    return calendar.timegm(time.strptime(asctime[:19], '%Y-%m-%d %H:%M:%S')) + int(asctime[20:23]) * 0.001
+
+
+def iter_log_records(filename):
+    """Yields the LogRecords of a text log or of a .jsonl log. Other lines, like prompts, are skipped."""
+    with open(filename) as f:
+        if filename.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield LogRecord(entry['time'], entry['level'], entry['message'].strip())
+            return
+
+        for line in f:
+            fields = line.rstrip('\n').split(' : ', 3)
+            if len(fields) != 4 or len(fields[0]) < 23 or fields[0][4] != '-':
+                continue
+            yield LogRecord(parse_asctime(fields[0]), fields[2].strip(), fields[3].strip())
+
+
+def read_log_session(filename):
+    """Reads a light or barcode session from a log.
+
+    Returns:
+        session (Session): the session, with kind None if it has no presses or scans
+    """
+    session = Session(filename)
+    task = None
+    for record in iter_log_records(filename):
+        message = record.message
+
+        if message.startswith('TASK START: '):
+            match = TASK_START_PATTERN.search(message)
+            if match:
+                task = RecordedTask(int(match.group(1)), int(match.group(2)), match.group(4), match.group(3).split())
+            else:
+                match = OLD_TASK_START_PATTERN.search(message)
+                if match is None:
+                    continue
+                session.legacy = True
+                task = RecordedTask(int(match.group(2)), int(match.group(1)), match.group(3))
+            session.tasks.append(task)
+            continue
+        if task is None:
+            continue
+
+        if message.startswith('Subject pressed '):
+            session.kind = LIGHT
+            task.inputs.append((record.time, message[16:].rstrip('.')))
+        elif message.startswith('Correct ') and ' barcode scanned: ' in message or \
+                message.startswith('Unexpected barcode: '):
+            session.kind = BARCODE
+            task.inputs.append((record.time, message.rsplit(': ', 1)[1]))
+            task.outputs.append('%s %s' % (record.level, message))
+        elif message.startswith('Setting display '):
+            match = SETTING_DISPLAY_PATTERN.match(message)
+            session.has_displays = True
+            task.counts[match.group(1)] = int(match.group(2))
+            task.outputs.append(display_line(match.group(1), number=int(match.group(2))))
+        elif message.startswith('Clearing display '):
+            task.outputs.append(display_line(message[17:], layout=EMPTY_LIGHT_LAYOUT))
+        elif ' items was pressed. Decrementing total to ' in message:
+            match = DECREMENT_PATTERN.match(message)
+            task.outputs.append(display_line(match.group(1), number=0))
+            task.outputs.append(display_line(task.receive_bin, number=int(match.group(2))))
+        elif record.level == 'WARNING':
+            if message == LEGACY_UNEXPECTED_PRESS:
+                session.legacy = True
+            task.outputs.append('WARNING %s' % message)
+    return session
+
+
+PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+              b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9)}
+# Link layer header length, or None when the IP header starts after an EtherType
+LINK_HEADERS = {0: 4, 1: None, 12: 0, 101: 0, 113: 16, 276: 20}
+
+
+def iter_pcap_udp_payloads(filename):
+    """Yields (time, payload) of every IPv4 UDP datagram in a pcap file.
+
+    Raises:
+        ValueError: if the file is not a pcap file or has an unsupported link type
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(24)
+        if header[:4] not in PCAP_MAGIC:
+            raise ValueError('%s is not a pcap file' % filename)
+        endian, resolution = PCAP_MAGIC[header[:4]]
+        link_type = struct.unpack(endian + 'I', header[20:24])[0] & 0xFFFF
+        if link_type not in LINK_HEADERS:
+            raise ValueError('Unsupported pcap link type %d in %s' % (link_type, filename))
+        record_header = struct.Struct(endian + 'IIII')
+
+        while True:
+            header = f.read(record_header.size)
+            if len(header) < record_header.size:
+                return
+            seconds, fraction, captured_length, _ = record_header.unpack(header)
+            packet = f.read(captured_length)
+
+            offset = LINK_HEADERS[link_type]
+            if offset is None:
+                offset, ether_type = 14, packet[12:14]
+                while ether_type == b'\x81\x00':  # 802.1Q VLAN tag
+                    offset, ether_type = offset + 4, packet[offset + 2:offset + 4]
+                if ether_type != b'\x08\x00':
+                    continue
+            ip = packet[offset:]
+            if len(ip) < 20 or ip[0] >> 4 != 4 or ip[9] != 17:
+                continue
+            udp = ip[(ip[0] & 0x0F) * 4:]
+            yield seconds + fraction * resolution, udp[8:struct.unpack('>H', udp[4:6])[0]]
+
+
+def read_trace_session(filename):
+    """Reads the rack traffic of a packet capture: frames sent to the rack and packets it sent back."""
+    session = Session(filename, TRACE)
+    session.has_displays = True
+    for timestamp, payload in iter_pcap_udp_payloads(filename):
+        if payload.startswith(b'xpl-cmnd'):
+            match = DISPLAY_FRAME_PATTERN.search(payload)
+            if match is not None:
+                session.outputs.append(display_line(match.group(1).decode(), layout=int(match.group(2))))
+        else:
+            session.inputs.append((timestamp, payload))
+    return session
+
+
+def read_session(filename):
+    with open(filename, 'rb') as f:
+        magic = f.read(4)
+    if magic in PCAP_MAGIC:
+        return read_trace_session(filename)
+    return read_log_session(filename)
+
+
+class ReplayStalled(Exception):
+    """Raised when the task logic waits for a press or scan the session does not have."""
+
+
+class ReplayClock(object):
+    """Hands out a session's inputs at their original pace scaled by `speed`, or at once if speed is 0.
+
+    Attributes:
+        now (float): original time of the input handed out last
+    """
+
+    def __init__(self, speed=0.0):
+        self.speed = speed
+        self.now = None
+        self._origin = None
+
+    def wait_until(self, timestamp):
+        if self._origin is None:
+            self._origin = (timestamp, time.monotonic())
+        elif self.speed:
+            delay = self._origin[1] + (timestamp - self._origin[0]) / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.now = timestamp
+
+
+class ReplaySocket(object):
+    """Stands in for fml.sockhub, returning queued packets from recvfrom().
+
+    Raises ReplayStalled once the queue is empty.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.packets = collections.deque()
+
+    def load(self, packets):
+        self.packets.clear()
+        self.packets.extend(packets)
+
+    def recvfrom(self, size):
+        if not self.packets:
+            raise ReplayStalled()
+        timestamp, data = self.packets.popleft()
+        self.clock.wait_until(timestamp)
+        return data, ('replay', 0)
+
+
+class ReplayHandler(logging.Handler):
+    """Appends every record to `records`."""
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@contextlib.contextmanager
+def capture_logger(target_logger, records):
+    """Sends `target_logger`'s records to `records` only, for the duration of the block."""
+    handlers = target_logger.handlers[:]
+    target_logger.handlers[:] = [ReplayHandler(records)]
+    try:
+        yield
+    finally:
+        target_logger.handlers[:] = handlers
+
+
+def replay_lines(outputs, has_displays):
+    """Normalizes what a replay produced, display updates and log records, into diffable lines."""
+    lines = []
+    for output in outputs:
+        if isinstance(output, str):
+            lines.append(output)
+        elif isinstance(output, DisplayUpdate):
+            if has_displays:
+                lines.append(display_line(output.display, output.number, output.layout))
+        elif output.levelno >= logging.WARNING:
+            lines.append('WARNING %s' % output.getMessage())
+    return lines
+
+
+@contextlib.contextmanager
+def replaying_fml(clock, outputs, debounce_window=None):
+    """Points fml at a ReplaySocket and a sink recording into `outputs`, and restores it afterwards.
+
+    Args:
+        clock (ReplayClock): clock of the replay
+        outputs (list): list the display updates and fml's log records are appended to
+        debounce_window (float): debounce window to use instead of fml's
+    """
+    saved = (fml.sockhub, fml.rack_sink, fml.sinks[:], fml.shadow, fml.packet_parser.clock,
+             fml.debouncer.window, fml.debouncer.last_seen.copy())
+    sink = RecordingSink()
+    sink.updates = outputs
+    fml.sockhub = ReplaySocket(clock)
+    fml.rack_sink = None
+    fml.sinks[:] = [sink]
+    fml.shadow = DisplayShadow()
+    # Debounce on the original times, however fast the replay goes
+    fml.packet_parser.clock = lambda: clock.now
+    fml.debouncer.last_seen.clear()
+    if debounce_window is not None:
+        fml.debouncer.window = debounce_window
+    try:
+        with capture_logger(fml.logger, outputs):
+            yield fml.sockhub
+    finally:
+        fml.sockhub, fml.rack_sink, fml.sinks[:], fml.shadow, fml.packet_parser.clock, fml.debouncer.window, \
+            last_seen = saved
+        fml.debouncer.last_seen.clear()
+        fml.debouncer.last_seen.update(last_seen)
+
+
+def replay_light(session, pick_tasks, clock, debounce_window=None):
+    """Runs every recorded task through fml.runPickPath with the presses recorded for it."""
+    outputs = []
+    # Logs only have the presses the debouncer kept
+    with replaying_fml(clock, outputs, debounce_window=0) as sock:
+        fml.reset(force=True)
+        del outputs[:]
+        for recorded, pick_task in zip(session.tasks, pick_tasks):
+            outputs.append(task_header(pick_task.task_id, pick_task.order_id))
+            sock.load((timestamp, build_button_packet(tag)) for timestamp, tag in recorded.inputs)
+            try:
+                fml.runPickPath(pick_task)
+            except ReplayStalled:
+                outputs.append('REPLAY task did not complete with the recorded presses')
+            if sock.packets:
+                outputs.append('REPLAY %d recorded presses left over' % len(sock.packets))
+
+            # Clear the displays for the next task, as run_all_pick_tasks does; the log does not show it
+            sent = len(outputs)
+            fml.reset()
+            del outputs[sent:]
+    return replay_lines(outputs, session.has_displays)
+
+
+def replay_trace(session, pick_tasks, clock, debounce_window=None):
+    """Runs the tasks through fml.run_all_pick_tasks with every packet the rack sent.
+
+    Presses are debounced on their capture times, with `debounce_window` or fml's window.
+    """
+    outputs = []
+    with replaying_fml(clock, outputs, debounce_window) as sock:
+        sock.load(session.inputs)
+        fml.reset(force=True)
+        try:
+            fml.run_all_pick_tasks(pick_tasks, task_pause=0)
+        except ReplayStalled:
+            outputs.append('REPLAY tasks did not complete with the captured packets')
+        if sock.packets:
+            outputs.append('REPLAY %d captured packets left over' % len(sock.packets))
+    return [display_line(output.display, layout=output.rack_value) if isinstance(output, DisplayUpdate) else output
+            for output in outputs if isinstance(output, (DisplayUpdate, str))]
+
+
+def replay_barcode(session, pick_tasks, clock, debounce_window=None):
+    """Runs the tasks through check_barcode.compareBarcode with every recorded scan."""
+    scans = collections.deque(entry for task in session.tasks for entry in task.inputs)
+
+    def get_barcode():
+        if not scans:
+            raise ReplayStalled()
+        timestamp, barcode = scans.popleft()
+        clock.wait_until(timestamp)
+        return barcode
+
+    records = []
+    with capture_logger(check_barcode.logger, records):
+        try:
+            check_barcode.compareBarcode(pick_tasks, get_barcode, on_error=None)
+        except ReplayStalled:
+            records.append('REPLAY tasks did not complete with the recorded scans')
+    if scans:
+        records.append('REPLAY %d recorded scans left over' % len(scans))
+
+    lines = []
+    for record in records:
+        if isinstance(record, str):
+            lines.append(record)
+            continue
+        message = record.getMessage()
+        if message.startswith('TASK START: '):
+            match = TASK_START_PATTERN.search(message)
+            lines.append(task_header(int(match.group(1)), int(match.group(2))))
+        elif ' barcode scanned: ' in message or message.lstrip().startswith('Unexpected barcode: '):
+            lines.append('%s %s' % (record.levelname, message.strip()))
+        elif record.levelno >= logging.WARNING:
+            lines.append('WARNING %s' % message)
+    return lines
+
+
+def session_tasks(session, task_file=None):
+    """Returns the PickingTasks to replay: from the task file if given, else rebuilt from the log.
+
+    Raises:
+        ValueError: if the session is a packet capture and no task file is given
+    """
+    if task_file is not None:
+        pick_tasks = task_cache.load_picking_tasks(task_file)
+        for recorded, pick_task in zip(session.tasks, pick_tasks):
+            if (recorded.task_id, recorded.order_id) != (pick_task.task_id, pick_task.order_id):
+                logger.warning('%s: recorded task %s is %s in %s', session.filename, recorded.header()[3:],
+                               task_header(pick_task.task_id, pick_task.order_id)[3:], task_file)
+                break
+        return pick_tasks
+    if session.kind == TRACE:
+        raise ValueError('%s is a packet capture, replaying it needs --task-file' % session.filename)
+    return [task.picking_task() for task in session.tasks]
+
+
+ReplayResult = collections.namedtuple('ReplayResult', ['session', 'num_tasks', 'seconds', 'diff'])
+
+
+def replay_session(session, task_file=None, speed=0.0, debounce_window=None):
+    """Replays one session and diffs it against the original run.
+
+    Args:
+        session (Session): session to replay
+        task_file (str): task file the session ran, instead of the tasks in the log
+        speed (float): 1 for the original pace, 10 for ten times faster, 0 for as fast as possible
+        debounce_window (float): debounce window for packet captures, instead of fml's
+
+    Returns:
+        result (ReplayResult): the session, number of tasks replayed, seconds the replay took and
+            the unified diff lines between the original and the replay, empty if they agree
+    """
+    pick_tasks = session_tasks(session, task_file)
+    replay = {LIGHT: replay_light, BARCODE: replay_barcode, TRACE: replay_trace}[session.kind]
+
+    start = time.perf_counter()
+    replayed = replay(session, pick_tasks, ReplayClock(speed), debounce_window)
+    seconds = time.perf_counter() - start
+
+    diff = list(difflib.unified_diff(session.original_lines(), replayed, 'original', 'replay', lineterm=''))
+    return ReplayResult(session, len(pick_tasks), seconds, diff)
+
+
+def main(filenames, task_file=None, speed=0.0, debounce_window=None, max_diff_lines=40):
+    diverged = 0
+    total_inputs = total_seconds = 0
+    for filename in filenames:
+        session = read_session(filename)
+        if session.kind is None:
+            print('%s: no presses or scans recorded, skipped' % filename)
+            continue
+        if session.legacy:
+            print('%s: unreplayable (legacy format: the older controller ended tasks without a receive bin press), '
+                  'skipped' % filename)
+            continue
+
+        result = replay_session(session, task_file=task_file, speed=speed, debounce_window=debounce_window)
+        total_inputs += session.num_inputs
+        total_seconds += result.seconds
+        status = 'DIVERGED' if result.diff else 'ok'
+        print('%s: %s session, %d tasks, %d inputs, %.1f s recorded, replayed in %.3f s%s: %s' % (
+            filename, session.kind, result.num_tasks, session.num_inputs, session.duration, result.seconds,
+            '' if session.has_displays or session.kind == BARCODE else ' (no display commands in the log)', status))
+
+        if result.diff:
+            diverged += 1
+            for line in result.diff[:max_diff_lines]:
+                print('    %s' % line)
+            if len(result.diff) > max_diff_lines:
+                print('    ... %d more diff lines' % (len(result.diff) - max_diff_lines))
+
+    if total_seconds:
+        print('%d inputs replayed in %.3f s, %.0f inputs/s; %d sessions diverged' %
+              (total_inputs, total_seconds, total_inputs / total_seconds, diverged))
+    return 1 if diverged else 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Replay recorded pick sessions and diff them against the original.')
+    parser.add_argument('sessions', nargs='+', help='logs (.log or .jsonl) or packet captures (.pcap)')
+    parser.add_argument('--task-file', help='task file the sessions ran (needed for packet captures)')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='1 replays at the original pace, 10 ten times faster; 0 (default) as fast as possible')
+    parser.add_argument('--debounce-window', type=float,
+                        help='debounce window in seconds for packet captures (default: fml\'s)')
+    parser.add_argument('--diff-lines', type=int, default=40, help='diff lines shown per diverging session')
+    args = parser.parse_args()
+
+    sys.exit(main(args.sessions, task_file=args.task_file, speed=args.speed, debounce_window=args.debounce_window,
+                  max_diff_lines=args.diff_lines))
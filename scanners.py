@@ -0,0 +1,283 @@
+"""scanners.py
+
+Runs many paper-picking stations from one process. Barcode scans are read
+concurrently from several sources: stdin, named pipes and local TCP or UDP
+sockets standing in for networked scanners. Every scan is routed to its
+station and checked by the station's BarcodeStation. Run with a JSON file
+describing the stations and their scanners:
+    $ python scanners.py scanners.json --log subject.log
+
+where scanners.json looks like
+    {
+        "stations": [
+            {"name": "left", "task_file": "tasks-left.json", "sources": [{"type": "fifo", "path": "/tmp/left"}]},
+            {"name": "right", "task_file": "tasks-right.json", "sources": [{"type": "tcp", "port": 9301}]}
+        ],
+        "sources": [{"type": "stdin"}, {"type": "udp", "port": 9300}]
+    }
+
+Source types are "stdin", "fifo" (with "path"), "tcp" and "udp" (with "port"
+and an optional "host", 127.0.0.1 by default). Each line or datagram line is
+one scan, with the scanner's prefix in front of the barcode. A source listed
+under a station only feeds that station. On the shared sources, a scan
+may name its station, as in "left ]C0A11", and is otherwise routed to the
+station whose tasks use the barcode.
+
+With --log, routing messages go to that log, and each station's task and
+scan messages to its own log next to it (subject-left.log for subject.log),
+each with a .jsonl twin, ready for log_parser and replay.
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import time
+import task_cache
+import utils
+from check_barcode import BarcodeStation, BARCODE_PREFIX_LENGTH, play_error_sound
+
+# Setup logging
+logger = logging.getLogger(os.path.basename(__file__))
+logger = utils.configure_logger(logger)
+
+DEFAULT_HOST = '127.0.0.1'
+
+ScanEvent = collections.namedtuple('ScanEvent', ['station', 'barcode', 'source', 'time'])
+
+
+def parse_scan_line(line, station=None, prefix_length=BARCODE_PREFIX_LENGTH):
+    """Returns a ScanEvent from one line read from a scanner, or None if it is blank.
+
+    Args:
+        line (str): the scanned line, optionally "station barcode"
+        station (str): station of the source the line was read from, if it has one
+        prefix_length (int): number of scanner prefix characters in front of the barcode
+    """
+    fields = line.split()
+    if not fields:
+        return None
+    if len(fields) > 1 and station is None:
+        station = fields[0]
+    return ScanEvent(station, fields[-1][prefix_length:], None, time.time())
+
+
+class TagIndex(object):
+    """Index from each barcode to the stations with a task expecting it.
+
+    Args:
+        stations (dict): station name -> list of PickingTasks
+    """
+
+    def __init__(self, stations):
+        self.station_names = {}  # tag -> list of station names
+        for name, pick_tasks in stations.items():
+            for pick_task in pick_tasks:
+                for tag in list(pick_task.source_bins_in_dict) + [pick_task.receive_bin.tag]:
+                    names = self.station_names.setdefault(tag, [])
+                    if name not in names:
+                        names.append(name)
+
+    def stations(self, tag):
+        """Returns the names of the stations with a task using `tag`."""
+        return self.station_names.get(tag, [])
+
+
+class ScanRouter(object):
+    """Routes each scan to the BarcodeStation it is meant for.
+
+    Args:
+        stations (dict): station name -> list of PickingTasks
+        on_error (callable): called after every scan that is unexpected or cannot be routed
+        log_filename (str): experiment log, next to which each station writes its own log
+
+    Attributes:
+        finished (Future): set once every station has completed its tasks
+    """
+
+    def __init__(self, stations, on_error=play_error_sound, log_filename=None):
+        self.on_error = on_error
+        self.index = TagIndex(stations)
+        self.stations = collections.OrderedDict()
+        for name, pick_tasks in stations.items():
+            station_logger = utils.configure_station_logger('check_barcode.py', name, log_filename)
+            self.stations[name] = BarcodeStation(name, pick_tasks, log=station_logger, on_error=on_error)
+        self.unrouted = 0
+        self.finished = None
+        self.remaining = 0
+
+    def start(self):
+        self.finished = asyncio.get_running_loop().create_future()
+        for station in self.stations.values():
+            station.start()
+        self.remaining = sum(not station.done for station in self.stations.values())
+        self._check_finished()
+
+    def _check_finished(self):
+        if self.remaining == 0 and not self.finished.done():
+            self.finished.set_result(None)
+
+    def _unrouted(self, message, *args):
+        self.unrouted += 1
+        logger.warning(message, *args)
+        if self.on_error is not None:
+            self.on_error()
+
+    def feed_line(self, line, source, station=None):
+        scan = parse_scan_line(line, station)
+        if scan is not None:
+            self.dispatch(scan._replace(source=source))
+
+    def dispatch(self, scan):
+        name = scan.station
+        names = self.index.stations(scan.barcode)
+        if name is None:
+            if len(names) != 1:
+                self._unrouted('Barcode %s from %s is used by %s station', scan.barcode, scan.source,
+                               'more than one' if names else 'no')
+                return
+            name = names[0]
+
+        station = self.stations.get(name)
+        if station is None:
+            self._unrouted('Barcode %s from %s is for unknown station %s', scan.barcode, scan.source, name)
+            return
+        if names and name not in names:
+            logger.warning('Barcode %s scanned at station %s belongs to station %s',
+                           scan.barcode, name, ', '.join(names))
+
+        if station.done:
+            return
+        station.scan(scan.barcode)
+        if station.done:
+            logger.info('Station %s completed %d tasks with %d unexpected scans',
+                        name, station.completed_tasks, station.unexpected_scans)
+            self.remaining -= 1
+            self._check_finished()
+
+
+class _LineProtocol(asyncio.Protocol):
+    """Feeds the lines of a stream to the router."""
+
+    def __init__(self, router, source, station=None):
+        self.router = router
+        self.source = source
+        self.station = station
+        self.buffer = b''
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            self.router.feed_line(line.decode('utf-8', 'replace'), self.source, self.station)
+
+    def eof_received(self):
+        if self.buffer:
+            self.router.feed_line(self.buffer.decode('utf-8', 'replace'), self.source, self.station)
+            self.buffer = b''
+
+    def connection_lost(self, exc):
+        self.eof_received()
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, router, source, station=None):
+        self.router = router
+        self.source = source
+        self.station = station
+
+    def datagram_received(self, data, address):
+        for line in data.decode('utf-8', 'replace').splitlines():
+            self.router.feed_line(line, '%s %s:%d' % (self.source, address[0], address[1]), self.station)
+
+
+async def open_source(router, config, station=None):
+    """Starts reading scans from one source.
+
+    Args:
+        router (ScanRouter): router the scans are fed to
+        config (dict): the source's entry in the configuration
+        station (str): station the source feeds, or None for a shared source
+
+    Returns:
+        close (callable): stops reading from the source
+    """
+    loop = asyncio.get_running_loop()
+    source_type = config['type']
+    host, port = config.get('host', DEFAULT_HOST), config.get('port')
+
+    if source_type == 'stdin':
+        transport, _ = await loop.connect_read_pipe(lambda: _LineProtocol(router, 'stdin', station), sys.stdin)
+        return transport.close
+
+    if source_type == 'fifo':
+        path = config['path']
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        # Opened for writing too, so the pipe stays open while no scanner has it open
+        pipe = os.fdopen(os.open(path, os.O_RDWR | os.O_NONBLOCK), 'rb', buffering=0)
+        transport, _ = await loop.connect_read_pipe(lambda: _LineProtocol(router, 'fifo %s' % path, station), pipe)
+        return transport.close
+
+    if source_type == 'tcp':
+        server = await loop.create_server(lambda: _LineProtocol(router, 'tcp %s:%d' % (host, port), station),
+                                          host, port)
+        return server.close
+
+    if source_type == 'udp':
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(router, 'udp %s:%d' % (host, port), station), local_addr=(host, port))
+        return transport.close
+
+    raise ValueError('Unknown scanner source type %s' % source_type)
+
+
+async def run_scanners(router, sources):
+    """Reads scans from every source until all stations completed their tasks.
+
+    Args:
+        router (ScanRouter): router with the stations
+        sources (list): (source config, station name or None) pairs
+    """
+    router.start()
+    closers = []
+    try:
+        for config, station in sources:
+            closers.append(await open_source(router, config, station))
+        logger.info('Reading scans for %d stations from %d sources', len(router.stations), len(closers))
+        await router.finished
+    finally:
+        for close in closers:
+            close()
+
+
+def main(config_filename, log_filename=None):
+    with open(config_filename) as f:
+        config = json.load(f)
+    if log_filename is not None:
+        utils.configure_file_logger(logger, log_filename, jsonl_filename=utils.jsonl_filename_for(log_filename))
+
+    stations = collections.OrderedDict()
+    sources = [(source, None) for source in config.get('sources', [])]
+    for station_config in config['stations']:
+        stations[station_config['name']] = task_cache.load_picking_tasks(station_config['task_file'])
+        sources.extend((source, station_config['name']) for source in station_config.get('sources', []))
+
+    asyncio.run(run_scanners(ScanRouter(stations, log_filename=log_filename), sources))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check barcode scans of several stations read from many scanners.')
+    parser.add_argument('config', help='JSON file describing the stations and their scanners')
+    parser.add_argument('--log', help='file to write the log to, next to a .jsonl file and one log per station')
+    args = parser.parse_args()
+
+    try:
+        main(args.config, args.log)
+    except KeyboardInterrupt:
+        print("Handling keyboard interrupt.")
+    finally:
+        print("\nExperiment Complete.")
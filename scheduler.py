@@ -0,0 +1,260 @@
+"""scheduler.py
+
+Paced sending of display frames. Bursts of broadcasts overrun the rack, so
+frames are queued and sent by a background thread at a bounded rate (token
+bucket). Press feedback goes through a priority lane ahead of bulk traffic
+such as initDisplays. A frame can optionally be checked and re-sent if the
+display did not take it, or, where the displays cannot be checked, simply be
+repeated a few times in case the network dropped it.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+import utils
+from constants import ALL_DISPLAYS
+
+# Setup logging
+logger = logging.getLogger(os.path.basename(__file__))
+logger = utils.configure_logger(logger)
+
+PendingFrame = collections.namedtuple('PendingFrame', ['display', 'layout', 'frame', 'address', 'queued_at', 'attempt',
+                                                       'pressed_at'])
+
+
+class SendScheduler(object):
+    """Rate-limited, prioritised sender for display frames.
+
+    Pending frames are keyed by display, so a newer frame for a display
+    replaces an older one that was not sent yet, and a priority frame also
+    drops the display's pending bulk frame. A frame for ALL_DISPLAYS supersedes
+    everything pending.
+
+    Args:
+        send (callable): `send(frame, address)`, e.g. a socket's sendto
+        rate (float): frames per second on average, None for no limit
+        burst (int): frames that may be sent back to back before pacing kicks in
+        verify (callable): optional `verify(display, layout) -> bool`, called
+            `verify_delay` seconds after a send to check the display took it
+        retries (int): times a frame failing verification is re-sent
+        verify_delay (float): seconds between a send and its verification or repeat
+        repeats (int): without `verify`, times every frame is sent again,
+            `verify_delay` seconds apart, unless a newer frame replaced it
+        latency_samples (int): number of recent send latencies kept for stats
+        metrics (Metrics): optional registry the send counts and latencies are also reported to,
+            as the scheduler_sent, scheduler_superseded, scheduler_retries and scheduler_repeats
+            counters and the scheduler_send_latency histogram. Frames submitted with `pressed_at`
+            are also recorded in press_to_send when they are first sent.
+    """
+
+    def __init__(self, send, rate=200.0, burst=10, verify=None, retries=2, verify_delay=0.05, repeats=0,
+                 latency_samples=1024, clock=time.monotonic, metrics=None):
+        self.send = send
+        self.metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.verify = verify
+        self.retries = retries
+        self.verify_delay = verify_delay
+        self.repeats = repeats
+        self.clock = clock
+
+        self.priority_lane = collections.OrderedDict()
+        self.bulk_lane = collections.OrderedDict()
+        self.checks = collections.deque()  # (due time, send number, PendingFrame) to verify or repeat
+        self.last_send_number = {}  # display -> number of the last send to it
+        self.condition = threading.Condition()
+
+        self.tokens = float(burst)
+        self.last_refill = clock()
+
+        self.sent = 0
+        self.superseded = 0
+        self.retried = 0
+        self.verify_failures = 0
+        self.repeated = 0
+        self.max_queue_depth = 0
+        self.latencies = collections.deque(maxlen=latency_samples)
+
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, drain=True, timeout=5.0):
+        """Stops the sending thread, by default after sending everything queued."""
+        if drain:
+            self.drain(timeout)
+        with self.condition:
+            self.priority_lane.clear()
+            self.bulk_lane.clear()
+            self._running = False
+            self.condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def drain(self, timeout=None):
+        """Blocks until every queued frame was sent. Returns False on timeout."""
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.condition:
+            while self.priority_lane or self.bulk_lane:
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def submit(self, display, layout, frame, address, priority=False, pressed_at=None):
+        """Queues a frame setting `display` to `layout`.
+
+        Args:
+            display (str): id of display the frame is for
+            layout (int): layout value the frame sets
+            frame (bytes): encoded frame
+            address (tuple): where to send the frame
+            priority (bool): send ahead of bulk frames
+            pressed_at (float): clock time of the button press the frame answers, if any
+        """
+        pending = PendingFrame(display, layout, frame, address, self.clock(), 0, pressed_at)
+        with self.condition:
+            self._enqueue(pending, priority)
+            self.condition.notify_all()
+
+    def _enqueue(self, pending, priority):
+        display = pending.display
+        superseded = self.superseded
+        if display == ALL_DISPLAYS:
+            self.superseded += len(self.priority_lane) + len(self.bulk_lane)
+            self.priority_lane.clear()
+            self.bulk_lane.clear()
+            self.bulk_lane[display] = pending
+        elif priority and ALL_DISPLAYS not in self.bulk_lane:
+            if self.bulk_lane.pop(display, None) is not None:
+                self.superseded += 1
+            self._replace(self.priority_lane, pending)
+        else:
+            # Keep the order relative to a pending ALL_DISPLAYS frame
+            if self.priority_lane.pop(display, None) is not None:
+                self.superseded += 1
+            self._replace(self.bulk_lane, pending)
+
+        if self.metrics is not None and self.superseded != superseded:
+            self.metrics.increment('scheduler_superseded', self.superseded - superseded)
+        self.max_queue_depth = max(self.max_queue_depth, len(self.priority_lane) + len(self.bulk_lane))
+
+    def _replace(self, lane, pending):
+        if lane.pop(pending.display, None) is not None:
+            self.superseded += 1
+        lane[pending.display] = pending
+
+    def _take_token(self):
+        """Returns 0 if a frame may be sent now, else the seconds until it may."""
+        if self.rate is None:
+            return 0
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self._requeue_due_checks()
+
+                if not (self.priority_lane or self.bulk_lane):
+                    if not self._running:
+                        return
+                    timeout = self.checks[0][0] - self.clock() if self.checks else None
+                    self.condition.wait(timeout)
+                    continue
+
+                wait = self._take_token()
+                if wait:
+                    self.condition.wait(wait)
+                    continue
+
+                lane = self.priority_lane if self.priority_lane else self.bulk_lane
+                display, pending = lane.popitem(last=False)
+
+            self.send(pending.frame, pending.address)
+
+            with self.condition:
+                self.sent += 1
+                self.last_send_number[pending.display] = self.sent
+                now = self.clock()
+                self.latencies.append(now - pending.queued_at)
+                if self.metrics is not None:
+                    self.metrics.increment('scheduler_sent')
+                    self.metrics.record('scheduler_send_latency', now - pending.queued_at)
+                    if pending.attempt == 0 and pending.pressed_at is not None:
+                        self.metrics.record('press_to_send', now - pending.pressed_at)
+                if self.verify is not None:
+                    if pending.attempt < self.retries and pending.display != ALL_DISPLAYS:
+                        self.checks.append((self.clock() + self.verify_delay, self.sent, pending))
+                elif pending.attempt < self.repeats:
+                    self.checks.append((self.clock() + self.verify_delay, self.sent, pending))
+                self.condition.notify_all()
+
+    def _requeue_due_checks(self):
+        now = self.clock()
+        while self.checks and self.checks[0][0] <= now:
+            due, send_number, pending = self.checks.popleft()
+            # Skip frames that were replaced in the meantime
+            if self._replaced(pending.display, send_number):
+                continue
+            if self.verify is None:
+                self.repeated += 1
+                if self.metrics is not None:
+                    self.metrics.increment('scheduler_repeats')
+                self._enqueue(pending._replace(queued_at=now, attempt=pending.attempt + 1), priority=False)
+            elif not self.verify(pending.display, pending.layout):
+                self.verify_failures += 1
+                self.retried += 1
+                if self.metrics is not None:
+                    self.metrics.increment('scheduler_retries')
+                logger.debug('Display %s did not take layout %d, re-sending', pending.display, pending.layout)
+                self._enqueue(pending._replace(queued_at=now, attempt=pending.attempt + 1), priority=True)
+
+    def _replaced(self, display, send_number):
+        """Returns True if a frame queued or sent after send number `send_number` changes `display`."""
+        if display == ALL_DISPLAYS:
+            # Sending it again would undo whatever was queued or sent since
+            return self.sent != send_number or bool(self.priority_lane or self.bulk_lane)
+        return self.last_send_number[display] != send_number or \
+            self.last_send_number.get(ALL_DISPLAYS, 0) > send_number or \
+            display in self.priority_lane or display in self.bulk_lane or ALL_DISPLAYS in self.bulk_lane
+
+    def stats(self):
+        """Returns queue depth, send counts and send latency (queued to sent) in milliseconds."""
+        with self.condition:
+            latencies = sorted(self.latencies)
+            stats = {
+                'queue_depth': len(self.priority_lane) + len(self.bulk_lane),
+                'priority_queue_depth': len(self.priority_lane),
+                'bulk_queue_depth': len(self.bulk_lane),
+                'max_queue_depth': self.max_queue_depth,
+                'sent': self.sent,
+                'superseded': self.superseded,
+                'retried': self.retried,
+                'verify_failures': self.verify_failures,
+                'repeated': self.repeated,
+            }
+        if latencies:
+            stats['latency_mean_ms'] = sum(latencies) / len(latencies) * 1e3
+            stats['latency_p50_ms'] = latencies[len(latencies) // 2] * 1e3
+            stats['latency_p99_ms'] = latencies[int(len(latencies) * 0.99)] * 1e3
+            stats['latency_max_ms'] = latencies[-1] * 1e3
+        return stats
+
+    def __str__(self):
+        return ', '.join('%s=%s' % (key, round(value, 3) if isinstance(value, float) else value)
+                         for key, value in sorted(self.stats().items()))
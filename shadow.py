@@ -0,0 +1,54 @@
+"""shadow.py
+
+In-process record of what every display on the rack is currently showing, so
+the controller can skip frames that would not change anything and clear only
+the displays that are actually lit.
+"""
+from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS
+
+
+class DisplayShadow(object):
+    """Layout value last sent to each display.
+
+    Displays that were never written are unknown. Until a write to
+    ALL_DISPLAYS has gone out the shadow is not `synced`, because displays it
+    has never heard of may still be lit from a previous run.
+    """
+
+    def __init__(self):
+        self.layouts = {}
+        self.synced = False
+        self.skipped = 0
+
+    def needs_update(self, display, layout):
+        """Returns True if sending `layout` to `display` would change it."""
+        if display == ALL_DISPLAYS:
+            return not self.synced or any(value != layout for value in self.layouts.values())
+        if self.layouts.get(display) == layout:
+            self.skipped += 1
+            return False
+        return True
+
+    def update(self, display, layout):
+        """Records that `layout` was sent to `display`."""
+        if display == ALL_DISPLAYS:
+            for known_display in self.layouts:
+                self.layouts[known_display] = layout
+            self.synced = True
+        else:
+            self.layouts[display] = layout
+
+    def invalidate(self, display):
+        """Forgets what `display` shows, after a send to it may have failed part way."""
+        if display == ALL_DISPLAYS:
+            self.layouts.clear()
+            self.synced = False
+        else:
+            self.layouts.pop(display, None)
+
+    def lit_displays(self):
+        """Returns the displays known to show something."""
+        return [display for display, layout in self.layouts.items() if layout != EMPTY_LIGHT_LAYOUT]
+
+    def items(self):
+        return self.layouts.items()
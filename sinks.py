@@ -0,0 +1,276 @@
+"""sinks.py
+
+Destinations for display updates. fml.ChangeDisplay fans every update out to
+the configured sinks, so a run only pays for what it enables: the UDP rack,
+the Tk visualizer, nothing at all, or a recording for tests and replays.
+Nothing here imports Tk; the visualizer is passed in by whoever created it.
+
+The blocking controller in fml.py and the asyncio one in async_engine.py both
+send through `send_update` and `UpdateBatch`, each with its own sinks and
+DisplayShadow, so they skip, fan out, track and count updates the same way.
+"""
+import collections
+import time
+from constants import EMPTY_LIGHT_LAYOUT, BLANK_DISPLAY
+from frames import FRAMES, NUMBER_LAYOUTS
+
+DisplayUpdate = collections.namedtuple('DisplayUpdate', ['display', 'number', 'layout', 'rack_value', 'frame'])
+
+
+class DisplaySink(object):
+    """Base class for display sinks.
+
+    `send` receives one DisplayUpdate; `send_batch` receives a list of them
+    from a DisplayBatch and may send them more efficiently than one by one.
+    Both return the number of bytes put on the network, if any.
+    """
+
+    def send(self, update, priority=True):
+        raise NotImplementedError
+
+    def send_batch(self, updates, priority=False):
+        return sum(self.send(update, priority) for update in updates)
+
+    def close(self):
+        pass
+
+
+class UdpRackSink(DisplaySink):
+    """Sends frames to the rack over UDP, through a SendScheduler if one is set.
+
+    While `pressed_at` is set, every frame sent is timed from that press into
+    the press_to_send histogram of `metrics`. Through a scheduler, the time is
+    taken when the scheduler actually sends the frame, so it includes the time
+    the frame was queued (scheduler_send_latency).
+
+    Args:
+        sock (socket): socket to send from
+        address (tuple): address of the rack
+        scheduler (SendScheduler): optional scheduler pacing the frames
+        metrics (Metrics): optional registry press_to_send is recorded to
+    """
+
+    def __init__(self, sock, address, scheduler=None, metrics=None):
+        self.sock = sock
+        self.address = address
+        self.scheduler = scheduler
+        self.metrics = metrics
+        # time.monotonic() of the press the frames being sent answer, set by the controller
+        self.pressed_at = None
+
+    def send(self, update, priority=True):
+        if self.scheduler is not None:
+            self.scheduler.submit(update.display, update.rack_value, update.frame, self.address, priority=priority,
+                                  pressed_at=self.pressed_at)
+            return len(update.frame)
+        # An asyncio transport's sendto returns None, so count the frame itself
+        self.sock.sendto(update.frame, self.address)
+        self._record_press_to_send(1)
+        return len(update.frame)
+
+    def send_batch(self, updates, priority=False):
+        if self.scheduler is not None:
+            return DisplaySink.send_batch(self, updates, priority)
+        sendto = self.sock.sendto
+        address = self.address
+        for update in updates:
+            sendto(update.frame, address)
+        self._record_press_to_send(len(updates))
+        return sum(len(update.frame) for update in updates)
+
+    def _record_press_to_send(self, frames):
+        if self.metrics is not None and self.pressed_at is not None:
+            latency = time.monotonic() - self.pressed_at
+            for _ in range(frames):
+                self.metrics.record('press_to_send', latency)
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
+
+class VisualizerSink(DisplaySink):
+    """Mirrors the rack on a LightRackVisualizer.
+
+    Args:
+        visualizer (LightRackVisualizer): visualizer to update
+    """
+
+    def __init__(self, visualizer):
+        self.visualizer = visualizer
+
+    def send(self, update, priority=True):
+        self.visualizer.change_display(update.display, visualizer_value(update.number, update.layout))
+        return 0
+
+
+class NullSink(DisplaySink):
+    """Discards every update."""
+
+    def send(self, update, priority=True):
+        return 0
+
+    def send_batch(self, updates, priority=False):
+        return 0
+
+
+class RecordingSink(DisplaySink):
+    """Keeps every update it receives, in order, in `updates`."""
+
+    def __init__(self):
+        self.updates = []
+
+    def send(self, update, priority=True):
+        self.updates.append(update)
+        return 0
+
+    def send_batch(self, updates, priority=False):
+        self.updates.extend(updates)
+        return 0
+
+    def displays(self):
+        """Returns what each display shows after the recorded updates, as rack layout values."""
+        shown = {}
+        for update in self.updates:
+            shown[update.display] = update.rack_value
+        return shown
+
+    def clear(self):
+        del self.updates[:]
+
+
+def build_update(display, number=None, layout=None):
+    """Builds the update showing either `number` or `layout` on `display`.
+
+    Returns:
+        update (DisplayUpdate): the update, with its rack layout value and frame
+    """
+    assert (number is not None or layout is not None) and not (number is not None and layout is not None)
+
+    if layout is not None:
+        return DisplayUpdate(display, number, layout, layout, FRAMES.layout(display, layout))
+    return DisplayUpdate(display, number, layout, NUMBER_LAYOUTS[number % 100], FRAMES.number(display, number))
+
+
+def send_update(sinks, shadow, update, priority=True, force=False, metrics=None):
+    """Sends an update to every sink, unless the display already shows it.
+
+    The shadow records the new value only once every sink took it. If a sink
+    fails, the display's value is unknown and the next update is always sent.
+
+    Args:
+        sinks (list): DisplaySinks to send to
+        shadow (DisplayShadow): what every display is showing
+        update (DisplayUpdate): update to send
+        priority (bool): let the frame jump ahead of queued bulk updates
+        force (bool): send even if the display already shows the value
+        metrics (Metrics): optional registry counting display_updates and bytes_sent
+
+    Returns:
+        response (int): number of bytes sent, 0 if the update was skipped
+    """
+    if not force and not shadow.needs_update(update.display, update.rack_value):
+        return 0
+
+    try:
+        response = sum(sink.send(update, priority) for sink in sinks)
+    except Exception:
+        shadow.invalidate(update.display)
+        raise
+    shadow.update(update.display, update.rack_value)
+    if metrics is not None:
+        metrics.increment('display_updates')
+        metrics.increment('bytes_sent', response)
+    return response
+
+
+def send_updates(sinks, shadow, updates, priority=False, force=False, metrics=None):
+    """Sends several updates to every sink back to back, see `send_update`.
+
+    Updates for displays already showing their value are dropped first. If a
+    sink fails, part of the batch may have gone out, so none of its displays'
+    values are trusted afterwards.
+
+    Returns:
+        sent (int): total number of bytes sent
+    """
+    updates = [update for update in updates if force or shadow.needs_update(update.display, update.rack_value)]
+    try:
+        sent = sum(sink.send_batch(updates, priority) for sink in sinks)
+    except Exception:
+        for update in updates:
+            shadow.invalidate(update.display)
+        raise
+    for update in updates:
+        shadow.update(update.display, update.rack_value)
+    if metrics is not None:
+        metrics.increment('display_updates', len(updates))
+        metrics.increment('bytes_sent', sent)
+    return sent
+
+
+class UpdateBatch(object):
+    """Collects display updates and sends them together when flushed.
+
+    Usable as a context manager, in which case the batch is flushed on exit:
+
+        with UpdateBatch(sinks, shadow) as batch:
+            batch.set('A11', number=3)
+            batch.set('C11', layout=RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
+
+    Args:
+        sinks (list): DisplaySinks to send to
+        shadow (DisplayShadow): what every display is showing
+        force (bool): send displays already showing their value
+        priority (bool): let the frames jump ahead of queued bulk updates
+        metrics (Metrics): optional registry counting display_updates and bytes_sent
+    """
+
+    def __init__(self, sinks, shadow, force=False, priority=False, metrics=None):
+        self.sinks = sinks
+        self.shadow = shadow
+        self.force = force
+        self.priority = priority
+        self.metrics = metrics
+        self.updates = collections.OrderedDict()  # display -> (number, layout)
+
+    def set(self, display, number=None, layout=None):
+        assert (number is not None or layout is not None) and not (number is not None and layout is not None)
+
+        # Re-inserting moves the display to the end so the last write wins
+        self.updates.pop(display, None)
+        self.updates[display] = (number, layout)
+
+    def build(self, display, number, layout):
+        """Builds the update for one display; a hook for subclasses."""
+        return build_update(display, number, layout)
+
+    def flush(self):
+        updates = [self.build(display, number, layout) for display, (number, layout) in self.updates.items()]
+        self.updates.clear()
+        return send_updates(self.sinks, self.shadow, updates, self.priority, self.force, self.metrics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+def visualizer_value(number, layout):
+    """Converts a display update to the value shown by the visualizer.
+
+    Args:
+        number (int): number shown on the display, or None
+        layout (int): layout shown on the display, or None
+
+    Returns:
+        value (int): number or layout to show, BLANK_DISPLAY for an empty display
+    """
+    if layout is None:
+        return number
+    if layout == EMPTY_LIGHT_LAYOUT:
+        return BLANK_DISPLAY
+    return layout
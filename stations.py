@@ -0,0 +1,208 @@
+"""stations.py
+
+Runs several picking stations from one process. Each station has its own
+subset of the rack's source bins, its own receive bins and its own task file,
+and runs its task queue concurrently with the others over one shared rack
+socket. Every station sends through the same paced rack sink, so together they
+never overrun the rack. Incoming presses are routed to the station owning the
+pressed display.
+Run with a JSON file describing the stations:
+    $ python stations.py stations.json --log subject.log
+
+where stations.json looks like
+    [
+        {"name": "left", "task_file": "tasks-left.json", "racks": ["A"], "receive_bins": ["C11"]},
+        {"name": "right", "task_file": "tasks-right.json", "racks": ["B"], "receive_bins": ["C12", "C13"]}
+    ]
+
+A station may list "source_bins" explicitly instead of "racks".
+
+With --log, dispatching messages go to that log, and each station's task and
+press messages to its own log and JSONL twin next to it (subject-left.log and
+subject-left.jsonl for subject.log).
+"""
+import asyncio
+import json
+import logging
+import os
+import task_cache
+import utils
+from async_engine import AsyncPickController, RackProtocol, create_scheduler
+from constants import SOURCE_BINS, PICK_BY_LIGHT_RACK_ADDRESS, PICK_BY_LIGHT_PORT, BUTTON_DEBOUNCE_WINDOW
+from debounce import Debouncer
+from sinks import UdpRackSink
+
+# Setup logging
+logger = logging.getLogger(os.path.basename(__file__))
+logger = utils.configure_logger(logger)
+
+
+class Station(object):
+    """A picking station: the displays it owns and the tasks it runs.
+
+    Args:
+        name (str): name of the station, used in its log messages
+        pick_tasks (list): PickingTasks to run, in order
+        source_bins (list): source bin displays owned by the station
+        receive_bins (list): receive bin displays owned by the station
+
+    Raises:
+        ValueError: if a task uses a display the station does not own
+    """
+
+    def __init__(self, name, pick_tasks, source_bins, receive_bins):
+        self.name = name
+        self.pick_tasks = pick_tasks
+        self.source_bins = list(source_bins)
+        self.receive_bins = list(receive_bins)
+
+        for pick_task in pick_tasks:
+            foreign = set(pick_task.for_init_displays) - set(self.displays)
+            if foreign:
+                raise ValueError('Station %s does not own displays %s used by task "%s"' %
+                                 (name, ' '.join(sorted(foreign)), pick_task))
+
+    @property
+    def displays(self):
+        return self.source_bins + self.receive_bins
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates a station from one entry of a stations JSON file."""
+        source_bins = config.get('source_bins')
+        if source_bins is None:
+            source_bins = [tag for tag in SOURCE_BINS if tag[0] in config['racks']]
+
+        pick_tasks = task_cache.load_picking_tasks(config['task_file'])
+        return cls(config['name'], pick_tasks, source_bins, config['receive_bins'])
+
+
+class StationDispatcher(object):
+    """Routes each button press to the controller of the station owning the display.
+
+    Every station's controller keeps its own DisplayShadow, but they all send
+    through `rack_sink`, which `run` points at the transport and paces with
+    one SendScheduler.
+
+    Args:
+        stations (list): stations to dispatch to
+        log_filename (str): experiment log, next to which each station writes its own log
+        rack_address (tuple): address the display frames are sent to
+        send_rate (float): frames per second sent to the rack by all stations
+            together, None for no limit
+        controller_kwargs: passed on to every station's `AsyncPickController`,
+            including its `metrics`, which the shared sink and scheduler also report to
+
+    Raises:
+        ValueError: if two stations own the same display
+    """
+
+    def __init__(self, stations, log_filename=None, rack_address=PICK_BY_LIGHT_RACK_ADDRESS, send_rate=200.0,
+                 **controller_kwargs):
+        self.stations = stations
+        self.send_rate = send_rate
+        self.metrics = controller_kwargs.get('metrics')
+        self.rack_sink = UdpRackSink(None, rack_address, metrics=self.metrics)
+        self.controllers = {}
+        self.routes = {}
+        self.unrouted = 0
+
+        for station in stations:
+            station_logger = utils.configure_station_logger(os.path.basename(__file__), station.name, log_filename)
+            controller = AsyncPickController(displays=station.displays, log=station_logger, rack_sink=self.rack_sink,
+                                             **controller_kwargs)
+            self.controllers[station.name] = controller
+
+            for display in station.displays:
+                if display in self.routes:
+                    raise ValueError('Display %s belongs to more than one station' % display)
+                self.routes[display] = controller
+
+    def dispatch(self, display):
+        controller = self.routes.get(display)
+        if controller is None:
+            self.unrouted += 1
+            logger.warning('Button pressed on display %s which no station owns', display)
+            return
+        controller.feed_press(display)
+
+    async def run(self, transport):
+        """Runs every station's tasks concurrently, sending frames over `transport`."""
+        self.rack_sink.sock = transport
+        self.rack_sink.scheduler = create_scheduler(transport, self.send_rate, metrics=self.metrics)
+        for controller in self.controllers.values():
+            controller.transport = transport
+            controller.reset()
+
+        try:
+            results = await asyncio.gather(
+                *[self.controllers[station.name].run_all_pick_tasks(station.pick_tasks) for station in self.stations],
+                return_exceptions=True)
+        finally:
+            # Sends whatever the stations still have queued, then lets the loop write it
+            self.rack_sink.close()
+            await asyncio.sleep(0)
+
+        for station, result in zip(self.stations, results):
+            if isinstance(result, BaseException):
+                logger.error('Station %s failed: %r', station.name, result)
+            else:
+                logger.info('Station %s completed %d tasks', station.name, len(station.pick_tasks))
+        return results
+
+
+async def run_stations(stations, local_address=('', PICK_BY_LIGHT_PORT), rack_address=PICK_BY_LIGHT_RACK_ADDRESS,
+                       debounce_window=BUTTON_DEBOUNCE_WINDOW, log_filename=None, **controller_kwargs):
+    """Runs all stations over one rack socket until every task queue is done.
+
+    Args:
+        stations (list): stations to run
+        local_address (tuple): address to receive button presses on
+        rack_address (tuple): address the display frames are sent to
+        debounce_window (float): seconds during which repeated presses are dropped
+        log_filename (str): experiment log, next to which each station writes its own log
+        controller_kwargs: passed on to every station's `AsyncPickController`
+
+    Returns:
+        results (list): None for each station that completed, or the exception it failed with
+    """
+    dispatcher = StationDispatcher(stations, log_filename=log_filename, rack_address=rack_address,
+                                   **controller_kwargs)
+
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: RackProtocol(dispatcher.dispatch, debouncer=Debouncer(window=debounce_window),
+                             metrics=dispatcher.metrics),
+        local_addr=local_address,
+        allow_broadcast=True,
+    )
+    try:
+        return await dispatcher.run(transport)
+    finally:
+        transport.close()
+
+
+def main(config_filename, log_filename=None):
+    with open(config_filename) as f:
+        config = json.load(f)
+    if log_filename is not None:
+        utils.configure_file_logger(logger, log_filename, jsonl_filename=utils.jsonl_filename_for(log_filename))
+
+    stations = [Station.from_config(station_config) for station_config in config]
+    asyncio.run(run_stations(stations, log_filename=log_filename))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run several picking stations over one rack.')
+    parser.add_argument('config', help='JSON file describing the stations')
+    parser.add_argument('--log', help='file to write the log to, next to one log per station')
+    args = parser.parse_args()
+
+    try:
+        main(args.config, args.log)
+    except KeyboardInterrupt:
+        print("Handling keyboard interrupt.")
+    finally:
+        print("\nExperiment Complete.")
@@ -0,0 +1,331 @@
+"""task_cache.py
+
+Compiled cache of task files. The first time a task file is used it is
+compiled into a compact binary file of flat integer arrays, named after a hash
+of the JSON's contents. Every later run loads the arrays directly instead of
+parsing JSON, and a changed task file simply gets a new cache entry.
+
+The hash of each task file is kept in a small index next to the cache entries,
+with the file's size and modification time. As long as those are unchanged,
+the file is not read again to find its cache entry.
+
+Only the fields the experiment uses are kept: the version, and per task its
+taskId and orders, per order its orderId, receivingBinTag and sourceBins
+(binTag and numItems).
+"""
+import array
+import hashlib
+import json
+import os
+import struct
+import sys
+from constants import RACKS, TASK_FILE_VERSION
+from models import SourceBin, ReceiveBin, PickingTask
+from task_stream import TaskFileStream, picking_tasks_for_task
+
+CACHE_DIR = '.task_cache'
+HASH_INDEX_FILENAME = 'hashes.json'
+
+MAGIC = b'PBLTASKS'
+FORMAT_VERSION = 1
+
+# Magic, format version, byte order, then the lengths of the string table and the three arrays
+HEADER = struct.Struct('<8sHc5xQQQQ')
+
+TASK_FIELDS = 3  # taskId, first order, number of orders
+ORDER_FIELDS = 4  # orderId, receive bin string index, first source bin, number of source bins
+BIN_FIELDS = 2  # binTag string index, numItems
+
+
+def file_hash(filename):
+    """Returns the SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_hash_index(index_filename):
+    try:
+        with open(index_filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_hash_index(index_filename, index):
+    directory = os.path.dirname(index_filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary_filename = '%s.%d.tmp' % (index_filename, os.getpid())
+    with open(temporary_filename, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(temporary_filename, index_filename)
+
+
+def task_file_hash(filename, cache_dir=CACHE_DIR):
+    """Returns the SHA-1 hex digest of a task file, from the hash index if the
+    file's size and modification time did not change since it was hashed."""
+    stat = os.stat(filename)
+    index_filename = os.path.join(cache_dir, HASH_INDEX_FILENAME)
+    index = _read_hash_index(index_filename)
+    key = os.path.abspath(filename)
+
+    entry = index.get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return entry['hash']
+
+    digest = file_hash(filename)
+    index[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest}
+    _write_hash_index(index_filename, index)
+    return digest
+
+
+def cache_path(filename, digest, cache_dir=CACHE_DIR):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, '%s-%s.bin' % (name, digest[:16]))
+
+
+class CompiledTasks(object):
+    """Task file contents as flat integer arrays plus a string table.
+
+    Args:
+        version (str): version field of the task file
+        strings (list): every bin tag, indexed by the arrays
+        tasks (array): TASK_FIELDS integers per task
+        orders (array): ORDER_FIELDS integers per order
+        bins (array): BIN_FIELDS integers per source bin
+    """
+
+    def __init__(self, version=None, strings=None, tasks=None, orders=None, bins=None):
+        self.version = version
+        self.strings = strings if strings is not None else []
+        self.tasks = tasks if tasks is not None else array.array('q')
+        self.orders = orders if orders is not None else array.array('q')
+        self.bins = bins if bins is not None else array.array('q')
+        self._string_index = {string: i for i, string in enumerate(self.strings)}
+
+    def _intern(self, string):
+        index = self._string_index.get(string)
+        if index is None:
+            index = self._string_index[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def add_task(self, task):
+        """Appends one raw task dict from a task file."""
+        orders = task['orders']
+        self.tasks.extend((task['taskId'], len(self.orders) // ORDER_FIELDS, len(orders)))
+        for order in orders:
+            source_bins = order['sourceBins']
+            self.orders.extend((order['orderId'], self._intern(order['receivingBinTag']),
+                                len(self.bins) // BIN_FIELDS, len(source_bins)))
+            for source_bin in source_bins:
+                self.bins.extend((self._intern(source_bin['binTag']), source_bin['numItems']))
+
+    def __len__(self):
+        return len(self.tasks) // TASK_FIELDS
+
+    def iter_raw_tasks(self):
+        """Yields every task as a dict shaped like the task file's."""
+        strings, orders, bins = self.strings, self.orders, self.bins
+        tasks = self.tasks
+        for t in range(0, len(tasks), TASK_FIELDS):
+            task_id, first_order, num_orders = tasks[t:t + TASK_FIELDS]
+            raw_orders = []
+            for o in range(first_order * ORDER_FIELDS, (first_order + num_orders) * ORDER_FIELDS, ORDER_FIELDS):
+                order_id, receive_bin, first_bin, num_bins = orders[o:o + ORDER_FIELDS]
+                raw_orders.append({
+                    'orderId': order_id,
+                    'receivingBinTag': strings[receive_bin],
+                    'sourceBins': [{'binTag': strings[bins[b]], 'numItems': bins[b + 1]}
+                                   for b in range(first_bin * BIN_FIELDS, (first_bin + num_bins) * BIN_FIELDS,
+                                                  BIN_FIELDS)],
+                })
+            yield {'taskId': task_id, 'orders': raw_orders}
+
+    def to_document(self):
+        """Returns the task file contents as a dict, like json.load would."""
+        return {'version': self.version, 'tasks': list(self.iter_raw_tasks())}
+
+    def iter_picking_tasks(self):
+        """Yields the PickingTasks, in the order parseExperimentDictionary returns them."""
+        strings, orders, bins = self.strings, self.orders, self.bins
+        racks = sorted(RACKS)
+        tag_racks = [string[0] for string in strings]
+        source_bin_cache = {}
+
+        tasks = self.tasks
+        for t in range(0, len(tasks), TASK_FIELDS):
+            task_id, first_order, num_orders = tasks[t:t + TASK_FIELDS]
+            tasks_by_rack = {rack: [] for rack in racks}
+
+            for o in range(first_order * ORDER_FIELDS, (first_order + num_orders) * ORDER_FIELDS, ORDER_FIELDS):
+                order_id, receive_bin, first_bin, num_bins = orders[o:o + ORDER_FIELDS]
+                source_bins_by_rack = {rack: [] for rack in racks}
+                totals_by_rack = dict.fromkeys(racks, 0)
+
+                for b in range(first_bin * BIN_FIELDS, (first_bin + num_bins) * BIN_FIELDS, BIN_FIELDS):
+                    tag, num_items = bins[b], bins[b + 1]
+                    rack = tag_racks[tag]
+                    if rack in source_bins_by_rack:
+                        # Source bins are immutable, so equal ones are shared
+                        source_bin = source_bin_cache.get((tag, num_items))
+                        if source_bin is None:
+                            source_bin = source_bin_cache[tag, num_items] = SourceBin(tag=strings[tag],
+                                                                                     count=num_items)
+                        source_bins_by_rack[rack].append(source_bin)
+                        totals_by_rack[rack] += num_items
+
+                for rack in racks:
+                    tasks_by_rack[rack].append(PickingTask(
+                        task_id=task_id,
+                        order_id=order_id,
+                        rack=rack,
+                        source_bins=source_bins_by_rack[rack],
+                        receive_bin=ReceiveBin(tag=strings[receive_bin], expected_count=totals_by_rack[rack]),
+                    ))
+
+            for rack in racks:
+                for pick_task in tasks_by_rack[rack]:
+                    yield pick_task
+
+    def write(self, filename):
+        """Writes the compiled tasks to `filename`, atomically."""
+        strings = json.dumps([self.version] + self.strings).encode('utf-8')
+        arrays = [self.tasks.tobytes(), self.orders.tobytes(), self.bins.tobytes()]
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, sys.byteorder[0].encode('ascii'),
+                             len(strings), *[len(data) for data in arrays])
+
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(temporary_filename, 'wb') as f:
+            f.write(header)
+            f.write(strings)
+            for data in arrays:
+                f.write(data)
+        os.replace(temporary_filename, filename)
+
+    @classmethod
+    def read(cls, filename):
+        """Reads compiled tasks written by `write`.
+
+        Raises:
+            ValueError: if the file is not a compatible compiled task file
+        """
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        magic, format_version, byteorder, strings_length, *array_lengths = HEADER.unpack_from(data)
+        if magic != MAGIC or format_version != FORMAT_VERSION or byteorder != sys.byteorder[0].encode('ascii'):
+            raise ValueError('%s is not a compatible compiled task file' % filename)
+
+        offset = HEADER.size
+        strings = json.loads(data[offset:offset + strings_length].decode('utf-8'))
+        offset += strings_length
+
+        arrays = []
+        for length in array_lengths:
+            values = array.array('q')
+            values.frombytes(data[offset:offset + length])
+            arrays.append(values)
+            offset += length
+
+        return cls(strings[0], strings[1:], *arrays)
+
+
+def _remove_stale_entries(filename, keep, cache_dir):
+    prefix = os.path.splitext(os.path.basename(filename))[0] + '-'
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if entry.startswith(prefix) and entry.endswith('.bin') and path != keep and len(entry) == len(prefix) + 20:
+            os.remove(path)
+
+
+def _read_cached(path):
+    """Returns the CompiledTasks cached at `path`, None if missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return CompiledTasks.read(path)
+    except (ValueError, struct.error):
+        return None
+
+
+def _check_version(compiled, expected_version):
+    if expected_version is not None and compiled.version != expected_version:
+        raise ValueError('Task file version %s does not match expected version %s' %
+                         (compiled.version, expected_version))
+
+
+def compile_task_file(filename, cache_dir=CACHE_DIR, expected_version=TASK_FILE_VERSION):
+    """Compiles a task file into the cache, if not cached already.
+
+    Args:
+        filename (str): task file to compile
+        cache_dir (str): directory holding the cache
+        expected_version (str): version the file must have, None to accept any
+
+    Returns:
+        compiled (CompiledTasks): the compiled tasks
+
+    Raises:
+        ValueError: if the file's version is not `expected_version`
+    """
+    path = cache_path(filename, task_file_hash(filename, cache_dir), cache_dir)
+    compiled = _read_cached(path)
+    if compiled is not None:
+        _check_version(compiled, expected_version)
+        return compiled
+
+    compiled = CompiledTasks()
+    with open(filename) as f:
+        stream = TaskFileStream(f, expected_version=expected_version)
+        for task in stream:
+            compiled.add_task(task)
+    compiled.version = stream.version
+
+    compiled.write(path)
+    _remove_stale_entries(filename, path, cache_dir)
+    return compiled
+
+
+def load_task_document(filename, cache_dir=CACHE_DIR, expected_version=TASK_FILE_VERSION):
+    """Returns a task file's contents as a dict, through the cache."""
+    return compile_task_file(filename, cache_dir, expected_version).to_document()
+
+
+def iter_picking_tasks(filename, cache_dir=CACHE_DIR, expected_version=TASK_FILE_VERSION):
+    """Yields a task file's PickingTasks, through the cache.
+
+    On a cache miss the JSON is streamed: tasks are yielded as they are read
+    and the cache entry is written once the whole file has been read. Files of
+    another version than `expected_version` are rejected, unless it is None.
+    """
+    path = cache_path(filename, task_file_hash(filename, cache_dir), cache_dir)
+    compiled = _read_cached(path)
+    if compiled is not None:
+        _check_version(compiled, expected_version)
+        for pick_task in compiled.iter_picking_tasks():
+            yield pick_task
+        return
+
+    compiled = CompiledTasks()
+    with open(filename) as f:
+        stream = TaskFileStream(f, expected_version=expected_version)
+        for task in stream:
+            compiled.add_task(task)
+            for pick_task in picking_tasks_for_task(task):
+                yield pick_task
+    compiled.version = stream.version
+
+    compiled.write(path)
+    _remove_stale_entries(filename, path, cache_dir)
+
+
+def load_picking_tasks(filename, cache_dir=CACHE_DIR, expected_version=TASK_FILE_VERSION):
+    """Returns a task file's PickingTasks as a list, through the cache."""
+    return list(iter_picking_tasks(filename, cache_dir, expected_version))
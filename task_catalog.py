@@ -0,0 +1,164 @@
+"""task_catalog.py
+
+Persistent index of the task files under RFID-Study-Task-Generation/output.
+For every task file it records the study method, the task type (training or
+testing), the version, the number of tasks and orders and the content hash.
+The index is kept next to the compiled task cache and only files whose size or
+modification time changed are read again, so looking up a task file costs a
+directory scan and a small JSON load.
+
+Query from the command line with, for example:
+    $ python task_catalog.py --method pick-by-light_button --type testing
+"""
+import collections
+import json
+import os
+import task_cache
+
+STUDY_FOLDERS_PATH = os.path.join('.', 'RFID-Study-Task-Generation', 'output')
+CATALOG_FILENAME = os.path.join(task_cache.CACHE_DIR, 'catalog.json')
+CATALOG_VERSION = 1
+
+TaskFileEntry = collections.namedtuple('TaskFileEntry', [
+    'path', 'method', 'task_type', 'version', 'num_tasks', 'num_orders', 'hash', 'size', 'mtime'])
+
+
+def task_type_from_filename(method, file_name):
+    """Returns the task type of a task file named tasks-<method>-<type>.json."""
+    stem = os.path.splitext(file_name)[0]
+    prefix = 'tasks-%s-' % method
+    if stem.startswith(prefix):
+        return stem[len(prefix):]
+    return 'training' if 'training' in stem else 'testing'
+
+
+class TaskCatalog(object):
+    """Index of the available task files, numbered in a stable order.
+
+    Entries are sorted by method, type and path, so the same set of files is
+    always numbered the same way.
+
+    Args:
+        root (str): folder holding one folder of task files per study method
+        filename (str): where the index is stored
+    """
+
+    def __init__(self, root=STUDY_FOLDERS_PATH, filename=CATALOG_FILENAME):
+        self.root = root
+        self.filename = filename
+        self.entries = []
+
+    @classmethod
+    def open(cls, root=STUDY_FOLDERS_PATH, filename=CATALOG_FILENAME):
+        """Returns the catalog, brought up to date with the task files on disk."""
+        catalog = cls(root, filename)
+        catalog.load()
+        if catalog.refresh():
+            catalog.save()
+        return catalog
+
+    def load(self):
+        """Reads the stored index, if there is a usable one."""
+        try:
+            with open(self.filename) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if stored.get('catalogVersion') == CATALOG_VERSION and stored.get('root') == self.root:
+            self.entries = [TaskFileEntry(**entry) for entry in stored['entries']]
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(temporary_filename, 'w') as f:
+            json.dump({
+                'catalogVersion': CATALOG_VERSION,
+                'root': self.root,
+                'entries': [entry._asdict() for entry in self.entries],
+            }, f, indent=1)
+        os.replace(temporary_filename, self.filename)
+
+    def refresh(self):
+        """Re-indexes new and changed task files and drops removed ones.
+
+        Returns:
+            changed (bool): whether any entry was added, updated or removed
+        """
+        known = {entry.path: entry for entry in self.entries}
+        entries = []
+        changed = False
+
+        for method_dir in os.scandir(self.root):
+            if not method_dir.is_dir():
+                continue
+            for task_file in os.scandir(method_dir.path):
+                if not task_file.name.endswith('.json') or not task_file.is_file():
+                    continue
+                stat = task_file.stat()
+                entry = known.pop(task_file.path, None)
+                if entry is None or entry.size != stat.st_size or entry.mtime != stat.st_mtime:
+                    entry = self._index(task_file.path, method_dir.name, task_file.name, stat)
+                    changed = True
+                entries.append(entry)
+
+        entries.sort(key=lambda entry: (entry.method, entry.task_type, entry.path))
+        self.entries = entries
+        return changed or bool(known)
+
+    def _index(self, path, method, file_name, stat):
+        # Compiling also warms the task cache for the first run. Files of every
+        # version are indexed, so they can be told apart with find()
+        compiled = task_cache.compile_task_file(path, expected_version=None)
+        return TaskFileEntry(
+            path=path,
+            method=method,
+            task_type=task_type_from_filename(method, file_name),
+            version=compiled.version,
+            num_tasks=len(compiled),
+            num_orders=len(compiled.orders) // task_cache.ORDER_FIELDS,
+            hash=task_cache.task_file_hash(path),
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+        )
+
+    def find(self, method=None, task_type=None, version=None):
+        """Returns the entries matching every given field, in catalog order."""
+        return [entry for entry in self.entries
+                if (method is None or entry.method == method) and
+                (task_type is None or entry.task_type == task_type) and
+                (version is None or entry.version == version)]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def format_entry(number, entry):
+    return '%-3d %-40s v%-5s %4d tasks %5d orders  %s' % (
+        number, os.path.basename(entry.path), entry.version, entry.num_tasks, entry.num_orders, entry.hash[:12])
+
+
+def add_task_file_arguments(parser):
+    """Adds the options selecting a task file without prompting to an argparse parser."""
+    parser.add_argument('--method', help='study method of the task file, e.g. pick-by-light_button')
+    parser.add_argument('--type', dest='task_type', help='task type of the task file, e.g. training or testing')
+    parser.add_argument('--task-file', help='path of the task file, instead of looking it up')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List the indexed task files.')
+    parser.add_argument('--method', help='only list task files of this study method')
+    parser.add_argument('--type', dest='task_type', help='only list task files of this task type')
+    parser.add_argument('--version', help='only list task files of this version')
+    parser.add_argument('--paths', action='store_true', help='print only the paths, one per line')
+    args = parser.parse_args()
+
+    catalog = TaskCatalog.open()
+    for i, entry in enumerate(catalog.find(args.method, args.task_type, args.version)):
+        print(entry.path if args.paths else format_entry(i + 1, entry))
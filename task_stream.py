@@ -0,0 +1,196 @@
+"""task_stream.py
+
+Incremental reader for task files. Instead of loading the whole JSON document,
+the top-level object is walked a chunk at a time and every entry of its
+`tasks` array is decoded on its own, so tasks can be used while the rest of
+the file is still unread and memory is bounded by the largest task.
+"""
+import json
+from constants import RACKS, TASK_FILE_VERSION
+from models import SourceBin, ReceiveBin, PickingTask
+
+WHITESPACE = ' \t\n\r'
+
+
+class TaskFileStream(object):
+    """Iterates over the raw task dicts of a task file, in file order.
+
+    `version` is set as soon as the `version` field has been read. If the
+    field comes after the tasks, it is checked once the tasks are exhausted.
+
+    Args:
+        fileobj (file): task file opened in text mode
+        expected_version (str): version the file must have, None to accept any
+        chunk_size (int): number of characters read at a time
+
+    Raises:
+        ValueError: on malformed JSON, a missing `version` field or a version
+            other than `expected_version`
+    """
+
+    def __init__(self, fileobj, expected_version=None, chunk_size=1 << 16):
+        self.fileobj = fileobj
+        self.expected_version = expected_version
+        self.chunk_size = chunk_size
+        self.version = None
+
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = self._decode_value()
+                self._expect(':')
+
+                if key == 'tasks':
+                    for task in self._iter_array():
+                        yield task
+                else:
+                    value = self._decode_value()
+                    if key == 'version':
+                        self._check_version(value)
+
+                separator = self._next_char()
+                if separator == '}':
+                    break
+                if separator != ',':
+                    raise ValueError('Expected "," or "}" in task file, found %r' % separator)
+
+        if self.version is None:
+            raise ValueError('Task file has no version field')
+
+    def _check_version(self, version):
+        if self.expected_version is not None and version != self.expected_version:
+            raise ValueError('Task file version %s does not match expected version %s' %
+                             (version, self.expected_version))
+        self.version = version
+
+    def _iter_array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            separator = self._next_char()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError('Expected "," or "]" in task file, found %r' % separator)
+
+    def _fill(self, at_least=0):
+        """Reads more of the file, dropping what was already consumed."""
+        if self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        chunk = self.fileobj.read(max(self.chunk_size, at_least))
+        if not chunk:
+            self._eof = True
+        self._buffer += chunk
+        return bool(chunk)
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of task file')
+
+    def _next_char(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, expected):
+        char = self._next_char()
+        if char != expected:
+            raise ValueError('Expected %r in task file, found %r' % (expected, char))
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+                # Incomplete value: read at least as much again and retry
+                self._fill(at_least=len(self._buffer))
+                continue
+
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and not self._eof:
+                self._fill(at_least=len(self._buffer))
+                continue
+
+            self._pos = end
+            return value
+
+
+def picking_tasks_for_task(task):
+    """Splits one task of a task file into PickingTasks, one per order and rack.
+
+    Source bins are grouped by rack in a single pass over each order. Tasks
+    are ordered by rack first and order second, as parseExperimentDictionary
+    has always returned them.
+
+    Args:
+        task (dict): one entry of the task file's `tasks` array
+
+    Returns:
+        pick_tasks (list): list of PickingTask
+    """
+    task_id = task['taskId']
+    racks = sorted(RACKS)
+    tasks_by_rack = {rack: [] for rack in racks}
+
+    for order in task['orders']:
+        source_bins_by_rack = {rack: [] for rack in racks}
+        totals_by_rack = dict.fromkeys(racks, 0)
+
+        for source_bin in order['sourceBins']:
+            tag = source_bin['binTag']
+            rack_source_bins = source_bins_by_rack.get(tag[0])
+            if rack_source_bins is not None:
+                num_items = source_bin['numItems']
+                rack_source_bins.append(SourceBin(tag=tag, count=num_items))
+                totals_by_rack[tag[0]] += num_items
+
+        for rack in racks:
+            tasks_by_rack[rack].append(PickingTask(
+                task_id=task_id,
+                order_id=order['orderId'],
+                rack=rack,
+                source_bins=source_bins_by_rack[rack],
+                receive_bin=ReceiveBin(
+                    tag=order['receivingBinTag'],
+                    expected_count=totals_by_rack[rack],
+                )
+            ))
+
+    return [pick_task for rack in racks for pick_task in tasks_by_rack[rack]]
+
+
+def iter_picking_tasks(fileobj, expected_version=TASK_FILE_VERSION):
+    """Yields the PickingTasks of an open task file, reading it incrementally.
+
+    Files of any version other than `expected_version` are rejected, unless it is None.
+    """
+    for task in TaskFileStream(fileobj, expected_version=expected_version):
+        for pick_task in picking_tasks_for_task(task):
+            yield pick_task
+
+
+def iter_picking_tasks_from_file(filename, expected_version=TASK_FILE_VERSION):
+    """Yields the PickingTasks of the task file `filename`, reading it incrementally."""
+    with open(filename) as fileh:
+        for pick_task in iter_picking_tasks(fileh, expected_version=expected_version):
+            yield pick_task
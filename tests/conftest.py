@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# The modules live at the top of the repository, which is not a package, and
+# the log analysis tools in logs/
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'logs'))
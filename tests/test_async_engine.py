@@ -0,0 +1,155 @@
+import asyncio
+import pytest
+from async_engine import AsyncPickController, create_controller
+from constants import ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT
+from frames import FRAMES
+from metrics import Metrics
+from models import SourceBin, ReceiveBin, PickingTask
+from rack_simulator import RackSimulator, ScriptedPicker, generate_pick_tasks
+from sinks import RecordingSink
+
+PICK_TASK = PickingTask(task_id=1, order_id=1, rack='A', source_bins=[SourceBin('A11', 2), SourceBin('A12', 1)],
+                        receive_bin=ReceiveBin('C11', 3))
+
+RESET_FRAME = FRAMES.layout(ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT)
+
+
+class RecordingTransport(object):
+    def __init__(self):
+        self.frames = []
+
+    def sendto(self, frame, address):
+        self.frames.append(frame)
+
+
+def make_controller(**kwargs):
+    transport = RecordingTransport()
+    return AsyncPickController(transport=transport, **kwargs), transport
+
+
+def test_runs_pick_task():
+    async def run():
+        controller, transport = make_controller()
+        for tag in ['C11', 'A12', 'B11', 'A11', 'C11']:
+            controller.feed_press(tag)
+        await controller.run_all_pick_tasks([PICK_TASK])
+        return transport.frames
+
+    assert asyncio.run(run()) == [
+        FRAMES.layout('C11', RECEIVE_BIN_INITIAL_LIGHT_LAYOUT),
+        FRAMES.number('A11', 2), FRAMES.number('A12', 1), FRAMES.number('C11', 3),
+        FRAMES.number('A12', 0), FRAMES.number('C11', 2),
+        FRAMES.number('A11', 0), FRAMES.number('C11', 0),
+        FRAMES.layout('A12', EMPTY_LIGHT_LAYOUT), FRAMES.layout('A11', EMPTY_LIGHT_LAYOUT),
+        FRAMES.layout('C11', EMPTY_LIGHT_LAYOUT),
+        RESET_FRAME,
+    ]
+
+
+def test_records_metrics():
+    class StateChangeSink(RecordingSink):
+        """Notes how many state changes were timed when each update is sent."""
+
+        def __init__(self, metrics):
+            RecordingSink.__init__(self)
+            self.metrics = metrics
+            self.state_changes = []
+
+        def send(self, update, priority=True):
+            histogram = self.metrics.histograms.get('press_to_state_change')
+            self.state_changes.append((update.display, update.number, histogram.count if histogram else 0))
+            return RecordingSink.send(self, update, priority)
+
+    async def run():
+        metrics = Metrics()
+        controller, transport = make_controller(metrics=metrics)
+        sink = StateChangeSink(metrics)
+        controller.sinks.append(sink)
+        for tag in ['C11', 'A12', 'B11', 'A11', 'C11']:
+            controller.feed_press(tag)
+        await controller.run_all_pick_tasks([PICK_TASK])
+        return metrics, transport.frames, sink.state_changes
+
+    metrics, frames, state_changes = asyncio.run(run())
+    assert metrics.counters['tasks'] == 1 and metrics.counters['unexpected_presses'] == 1
+    assert metrics.counters['display_updates'] == len(frames)
+    assert metrics.counters['bytes_sent'] == sum(len(frame) for frame in frames)
+    assert metrics.histograms['task_duration'].count == metrics.histograms['init_displays'].count == 1
+    # The press is taken into account before any display shows it
+    assert ('A12', 0, 1) in state_changes and ('A11', 0, 2) in state_changes
+    # Every frame but the start symbol answers a press
+    assert metrics.histograms['press_to_send'].count == len(frames) - 1
+
+
+def test_press_waits_for_timeout():
+    async def run():
+        controller, _ = make_controller(press_timeout=60)
+        controller.feed_press('A11')
+        assert await controller.press(timeout=0.01) == 'A11'
+        with pytest.raises(asyncio.TimeoutError):
+            await controller.press(timeout=0.01)
+
+    asyncio.run(run())
+
+
+def test_press_timeout_resets_displays():
+    async def run():
+        controller, transport = make_controller(press_timeout=0.01)
+        controller.feed_press('C11')
+        with pytest.raises(asyncio.TimeoutError):
+            await controller.run_all_pick_tasks([PICK_TASK])
+        return transport.frames
+
+    frames = asyncio.run(run())
+    assert FRAMES.number('C11', 3) in frames
+    assert frames[-1] == RESET_FRAME
+
+
+def test_cancellation_resets_displays():
+    async def run():
+        controller, transport = make_controller()
+        task = asyncio.ensure_future(controller.run_all_pick_tasks([PICK_TASK]))
+        controller.feed_press('C11')
+        controller.feed_press('A11')
+        while FRAMES.number('C11', 1) not in transport.frames:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return transport.frames
+
+    frames = asyncio.run(run())
+    assert frames[-2:] == [FRAMES.number('C11', 1), RESET_FRAME]
+
+
+def test_runs_pick_tasks_against_rack_simulator():
+    pick_tasks = generate_pick_tasks(2)
+    simulator = RackSimulator(picker=ScriptedPicker.for_pick_tasks(pick_tasks))
+
+    async def run():
+        controller = await create_controller(local_address=('127.0.0.1', 0), rack_address=simulator.address,
+                                             debounce_window=0, press_timeout=5)
+        simulator.controller_address = controller.transport.get_extra_info('sockname')
+        try:
+            with simulator:
+                await controller.run_all_pick_tasks(pick_tasks)
+                # Let the simulator take the last reset
+                while set(simulator.displays.values()) != {EMPTY_LIGHT_LAYOUT}:
+                    await asyncio.sleep(0.001)
+        finally:
+            controller.transport.close()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert simulator.presses_sent == 1 + sum(len(pick_task.source_bins) + 1 for pick_task in pick_tasks)
+
+
+def test_change_display_goes_through_shadow():
+    controller, transport = make_controller(displays=['A11', 'A12'])
+    controller.change_display('A11', number=3)
+    controller.change_display('A11', number=3)
+    assert transport.frames == [FRAMES.number('A11', 3)]
+
+    # A station's reset clears its lit displays and those it knows nothing about
+    controller.change_display('A12', layout=EMPTY_LIGHT_LAYOUT)
+    controller.reset()
+    assert transport.frames[2:] == [FRAMES.layout('A11', EMPTY_LIGHT_LAYOUT)]
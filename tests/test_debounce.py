@@ -0,0 +1,41 @@
+from debounce import Debouncer
+
+
+def test_repeats_within_window_are_suppressed():
+    debouncer = Debouncer(window=0.3)
+    assert debouncer.accept('A11', 0.0)
+    assert not debouncer.accept('A11', 0.1)
+    assert debouncer.accept('A12', 0.15)
+    assert debouncer.accept('A11', 0.5)
+    assert debouncer.accepted == 3 and debouncer.suppressed == {'A11': 1}
+
+
+def test_window_restarts_on_every_report():
+    debouncer = Debouncer(window=0.3)
+    assert debouncer.accept('A11', 0.0)
+    # A burst longer than the window still counts as one press
+    for timestamp in (0.2, 0.4, 0.6):
+        assert not debouncer.accept('A11', timestamp)
+    assert debouncer.accept('A11', 1.0)
+
+
+def test_per_display_windows_and_disabled():
+    debouncer = Debouncer(window=0.3, windows={'C11': 1.0})
+    assert debouncer.accept('C11', 0.0)
+    assert not debouncer.accept('C11', 0.5)
+    assert debouncer.accept('A11', 0.0) and debouncer.accept('A11', 0.5)
+
+    disabled = Debouncer(window=0)
+    assert disabled.accept('A11', 0.0) and disabled.accept('A11', 0.0)
+
+
+def test_clock_and_reset():
+    now = [10.0]
+    debouncer = Debouncer(window=0.3, clock=lambda: now[0])
+    assert debouncer.accept('A11')
+    assert not debouncer.accept('A11')
+    assert str(debouncer) == '1 presses accepted, 1 suppressed (A11=1)'
+
+    debouncer.reset()
+    assert debouncer.accept('A11')
+    assert debouncer.accepted == 1 and not debouncer.suppressed
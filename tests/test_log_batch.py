@@ -0,0 +1,47 @@
+import os
+import shutil
+import log_batch
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SLICE = os.path.join(FIXTURES_DIR, 'theo-pick-by-light_button-training-slice.log')
+
+
+def analyze(folder):
+    return log_batch.analyze_logs(log_batch.discover_logs(str(folder)), str(folder / log_batch.CACHE_DIRNAME),
+                                  workers=1)
+
+
+def test_event_cache_hits_and_misses(tmp_path):
+    log = tmp_path / 'theo-pick-by-light_button-training.log'
+    shutil.copy(SLICE, str(log))
+    (tmp_path / 'notes.log').write_text('not an experiment log\n')
+
+    metrics, parsed = analyze(tmp_path)
+    assert parsed == 1
+    log_file, = metrics
+    assert (log_file.subject, log_file.method, log_file.task_type) == ('theo', 'pick-by-light_button', 'training')
+    assert metrics[log_file].order_duration.count == 3
+
+    # Unchanged: read from the cache
+    metrics, parsed = analyze(tmp_path)
+    assert parsed == 0 and metrics[log_file].order_duration.count == 3
+
+    # Touched but the same contents: the hash still matches, and the new mtime is recorded
+    stat = os.stat(str(log))
+    os.utime(str(log), (stat.st_atime, stat.st_mtime + 10))
+    assert analyze(tmp_path)[1] == 0
+    cache = log_batch.EventCache(str(tmp_path / log_batch.CACHE_DIRNAME))
+    assert cache.index[log.name]['mtime'] == stat.st_mtime + 10
+
+    # Changed size: parsed again, so the order started by the new line is counted
+    with open(SLICE) as f:
+        first_line = f.readline()
+    with open(str(log), 'a') as f:
+        f.write(first_line)
+    metrics, parsed = analyze(tmp_path)
+    assert parsed == 1 and metrics[log_file].order_duration.count == 4
+
+    # A cache file that went missing is a miss as well
+    cache = log_batch.EventCache(str(tmp_path / log_batch.CACHE_DIRNAME))
+    os.remove(cache.cache_path(cache.index[log.name]['hash']))
+    assert analyze(tmp_path)[1] == 1
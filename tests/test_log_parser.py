@@ -0,0 +1,58 @@
+import io
+import os
+import pytest
+import log_parser
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'logs')
+
+# The first three orders of a committed log, written by the pick-by-light.py of
+# the time with the task and order IDs swapped
+SLICE = os.path.join(FIXTURES_DIR, 'theo-pick-by-light_button-training-slice.log')
+
+
+def test_parse_line():
+    parser = log_parser.LogEventParser()
+    timestamp, kind, task_id, order_id, tag = parser.parse_line(
+        '2026-01-05 10:00:00,000 : fml.py         : INFO     : TASK START: Task ID=1, Order ID=4, 2 bins (A11 A12), '
+        'Receive bin C11\n')
+    assert (kind, task_id, order_id, parser.tags[tag]) == (log_parser.TASK_START, 1, 4, 'C11')
+
+    # Older logs have the IDs swapped
+    event = parser.parse_line('2018-03-29 11:10:46,482 : pick-by-light.py : INFO     : '
+                              'TASK START: Task (Order ID=8, Task ID=1): 4 bins -> C11\n')
+    assert event[2:4] == (8, 1)
+    assert event[0] - timestamp < 0
+
+    assert parser.parse_line('What file do you want to write to? test.log\n') is None
+
+
+def test_metrics_of_log_slice():
+    orders, tasks = [], []
+    metrics = log_parser.analyze_file(SLICE, on_order=orders.append, on_task=tasks.append)
+
+    assert [(order.task_id, order.order_id, order.receive_bin, order.picks, order.errors) for order in orders] == [
+        (8, 1, 'C11', 4, 1), (8, 2, 'C12', 4, 1), (8, 3, 'C13', 3, 1)]
+    assert [round(order.duration, 3) for order in orders] == [33.74, 11.059, 9.625]
+
+    task, = tasks
+    assert (task.task_id, task.orders, task.picks, task.errors) == (8, 3, 11, 3)
+    assert task.duration == pytest.approx(61.591)
+
+    summary = metrics.summary()
+    assert summary['events'] == {'task_start': 3, 'task_end': 0, 'press': 14, 'unexpected_press': 3, 'scan': 0,
+                                 'unexpected_scan': 0, 'warning': 0}
+    assert summary['pick_duration_s']['count'] == 11
+
+
+def test_chunking_does_not_change_metrics():
+    filename = os.path.join(LOGS_DIR, 'theo-pick-by-light_button-testing.log')
+    assert log_parser.analyze_file(filename, chunk_size=7).summary() == log_parser.analyze_file(filename).summary()
+
+
+def test_unparsable_lines_are_skipped():
+    parser = log_parser.LogEventParser()
+    with open(SLICE) as f:
+        text = 'What file do you want to write to? theo.log\n' + f.read()
+    chunk = log_parser.concatenate_chunks(parser.iter_chunks(io.StringIO(text)))
+    assert len(chunk.kind) == 20 and parser.skipped_lines == 1
@@ -0,0 +1,54 @@
+import random
+from metrics import LatencyHistogram, Metrics, SUB_BUCKET_BITS
+
+# Highest relative error of a reported value, as documented in metrics.py
+MAX_RELATIVE_ERROR = 1.0 / 2 ** (SUB_BUCKET_BITS - 1)
+
+
+def test_error_bound_is_below_one_percent():
+    assert MAX_RELATIVE_ERROR < 0.01
+
+
+def test_bucket_values_stay_within_the_error_bound():
+    histogram = LatencyHistogram()
+    worst = 0.0
+    for value in list(range(1, 1 << 16)) + random.Random(0).sample(range(1 << 16, histogram.max_value), 20000):
+        reported = histogram._value(histogram._index(value))
+        assert reported >= value
+        worst = max(worst, (reported - value) / value)
+    assert worst <= MAX_RELATIVE_ERROR
+
+
+def test_percentiles_within_the_error_bound():
+    rng = random.Random(1)
+    values = [rng.lognormvariate(-6, 1.5) for _ in range(10000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for percent in (50, 90, 99, 99.9):
+        exact = int(values[int(round(len(values) * percent / 100.0)) - 1] * 1e6) / 1e6
+        assert exact <= histogram.percentile(percent) <= exact * (1 + MAX_RELATIVE_ERROR) + 1e-6
+
+
+def test_merge_and_summary():
+    first, second = LatencyHistogram(), LatencyHistogram()
+    first.record(0.001)
+    second.record(0.003)
+    first.merge(second)
+    summary = first.summary()
+    assert summary['count'] == 2
+    assert summary['min_ms'] == 1.0 and summary['max_ms'] == 3.0
+    assert summary['mean_ms'] == 2.0
+
+
+def test_metrics_counters_and_prometheus_text():
+    metrics = Metrics()
+    metrics.increment('presses')
+    metrics.increment('presses', 2)
+    with metrics.timer('press_to_send'):
+        pass
+    assert metrics.snapshot()['counters'] == {'presses': 3}
+    text = metrics.prometheus_text()
+    assert 'pick_by_light_presses_total 3' in text
+    assert 'pick_by_light_press_to_send_seconds_count 1' in text
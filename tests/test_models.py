@@ -0,0 +1,46 @@
+import copy
+import pickle
+import pytest
+from models import PickingTask, PickProgress, SourceBin, ReceiveBin
+
+
+def make_task():
+    return PickingTask(1, 2, 'A', [SourceBin('A11', 3), SourceBin('A12', 4)], ReceiveBin('C11', 7))
+
+
+def assert_same_task(task, other):
+    assert other is not task
+    assert (other.task_id, other.order_id, other.rack) == (task.task_id, task.order_id, task.rack)
+    assert other.source_bins == task.source_bins
+    assert other.receive_bin == task.receive_bin
+    assert dict(other.for_init_displays) == {'A11': 3, 'A12': 4, 'C11': 7}
+
+
+def test_picking_task_is_immutable():
+    task = make_task()
+    with pytest.raises(AttributeError):
+        task.task_id = 3
+
+
+def test_picking_task_pickle_round_trip():
+    task = make_task()
+    # Cached views must not get in the way of pickling
+    task.source_bins_in_dict
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        assert_same_task(task, pickle.loads(pickle.dumps(task, protocol)))
+
+
+def test_picking_task_copy_and_deepcopy():
+    task = make_task()
+    task.for_init_displays
+    assert_same_task(task, copy.deepcopy(task))
+    assert_same_task(task, copy.copy(task))
+
+
+def test_pick_progress():
+    progress = PickProgress(make_task())
+    assert progress.remaining_total == 7
+    assert progress.press_source_bin('A12') == 4
+    assert progress.remaining_total == 3 and not progress.completed
+    progress.press_source_bin('A11')
+    assert progress.completed and progress.pressed == ['A12', 'A11']
@@ -0,0 +1,23 @@
+from packets import PacketParser, BUTTON_HIGH, HEARTBEAT, OTHER, build_heartbeat, build_button_packet
+
+
+def test_classifies_packets():
+    parser = PacketParser(clock=lambda: 12.5)
+    assert parser.parse(build_button_packet('B31')) == ('B31', BUTTON_HIGH, 12.5)
+    assert parser.parse(build_button_packet('B31', 'LOW'))[:2] == (None, OTHER)
+    assert parser.parse(build_heartbeat('C12'))[:2] == ('C12', HEARTBEAT)
+    assert parser.parse(b'')[:2] == (None, OTHER)
+    # No source header, so the tag is found by searching the packet
+    assert parser.parse(b'xpl-trig\n{\nbutton A42 HIGH\n}\n')[:2] == ('A42', BUTTON_HIGH)
+
+
+def test_cache_keeps_most_recently_seen_packets():
+    parser = PacketParser(cache_size=2)
+    a11, a12, a13 = (build_button_packet(tag) for tag in ['A11', 'A12', 'A13'])
+    parser.parse(a11)
+    parser.parse(a12)
+    parser.parse(a11)
+    parser.parse(a13)
+    assert list(parser._cache) == [a11, a13]
+    assert parser.parse(a12).tag == 'A12'
+    assert list(parser._cache) == [a13, a12]
@@ -0,0 +1,68 @@
+import copy
+import json
+import os
+import pytest
+import paper_generator
+
+TASK_DOCUMENT = {'version': '1.2', 'tasks': [
+    {'taskId': 7, 'orders': [
+        {'orderId': 1, 'receivingBinTag': 'C11', 'sourceBins': [{'binTag': 'A11', 'numItems': 2},
+                                                                 {'binTag': 'B12', 'numItems': 1}]},
+    ]},
+    {'taskId': 8, 'orders': [
+        {'orderId': 2, 'receivingBinTag': 'C12', 'sourceBins': [{'binTag': 'A23', 'numItems': 4}]},
+    ]},
+]}
+
+
+@pytest.fixture
+def study(tmp_path, monkeypatch):
+    """Writes a task file where paper_generator looks for it, under a temporary working directory."""
+    monkeypatch.chdir(tmp_path)
+    path = paper_generator.task_file_path('paper', 'testing')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        json.dump(TASK_DOCUMENT, f)
+    return path
+
+
+def test_pick_list_lines():
+    assert paper_generator.pick_list_lines(TASK_DOCUMENT['tasks'][0]) == [
+        'A', ' ' * 20 + '-' * 25, ' ' * 20 + '1', ' ' * 30 + '11 x 2', None,
+        'B', ' ' * 20 + '-' * 25, ' ' * 20 + '1', ' ' * 30 + '12 x 1', None,
+    ]
+
+
+def test_generate_writes_one_pdf_per_task(study):
+    assert paper_generator.generate(['paper'], ['testing'], workers=1, verbose=False) == (2, 0)
+    for task_order_number in (1, 2):
+        with open(paper_generator.output_path('paper', 'testing', task_order_number), 'rb') as f:
+            assert f.read(5) == b'%PDF-'
+
+
+def test_manifest_skips_unchanged_tasks(study):
+    def generate(**kwargs):
+        return paper_generator.generate(['paper'], ['testing'], workers=1, verbose=False, **kwargs)
+
+    assert generate(combined=True) == (3, 0)
+    manifest = paper_generator.read_manifest()
+    assert paper_generator.combined_output_path('paper', 'testing') in manifest
+
+    # Nothing changed
+    assert generate(combined=True) == (0, 3)
+
+    # Only the changed task and the combined PDF holding it are rendered again
+    document = copy.deepcopy(TASK_DOCUMENT)
+    document['tasks'][1]['orders'][0]['sourceBins'][0]['numItems'] = 5
+    with open(study, 'w') as f:
+        json.dump(document, f)
+    stat = os.stat(study)
+    os.utime(study, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    assert generate(combined=True) == (2, 1)
+    changed = paper_generator.output_path('paper', 'testing', 2)
+    assert paper_generator.read_manifest()[changed] != manifest[changed]
+
+    # A deleted PDF is rendered again, and --force renders everything
+    os.remove(paper_generator.output_path('paper', 'testing', 1))
+    assert generate() == (1, 1)
+    assert generate(force=True) == (2, 0)
@@ -0,0 +1,47 @@
+import json
+import logging
+import queued_logging
+import utils
+
+
+def make_logger(tmp_path, name):
+    logger = logging.getLogger('test_queued_logging:%s' % name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    log_filename = str(tmp_path / ('%s.log' % name))
+    utils.configure_file_logger(logger, log_filename, jsonl_filename=utils.jsonl_filename_for(log_filename))
+    return logger, log_filename
+
+
+def read_logs(log_filename):
+    queued_logging.writer.flush()
+    with open(log_filename) as f:
+        log = f.read()
+    with open(utils.jsonl_filename_for(log_filename)) as f:
+        entries = [json.loads(line) for line in f]
+    return log, entries
+
+
+def test_message_is_frozen_when_logged(tmp_path):
+    logger, log_filename = make_logger(tmp_path, 'frozen')
+    displays = ['A11']
+    logger.info('Displays %s', displays, extra={'event': 'displays'})
+    displays.append('A12')
+
+    log, entries = read_logs(log_filename)
+    assert "Displays ['A11']\n" in log
+    assert entries[0]['message'] == "Displays ['A11']"
+    assert entries[0]['event'] == 'displays'
+    assert isinstance(entries[0]['monotonic_us'], int)
+
+
+def test_exception_is_written_by_every_handler(tmp_path):
+    logger, log_filename = make_logger(tmp_path, 'exception')
+    try:
+        raise KeyError('A11')
+    except KeyError:
+        logger.exception('Press failed')
+
+    log, entries = read_logs(log_filename)
+    assert 'Press failed' in log and "KeyError: 'A11'" in log
+    assert "KeyError: 'A11'" in entries[0]['exception']
@@ -0,0 +1,60 @@
+import logging
+import pytest
+import fml
+from constants import EMPTY_LIGHT_LAYOUT
+from shadow import DisplayShadow
+from rack_simulator import RackSimulator, ScriptedPicker, generate_pick_tasks
+
+NUM_TASKS = 5
+BINS_PER_TASK = 4
+
+
+class MessageRecorder(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    # Presses come much faster than a person could, so nothing can be a bounce
+    monkeypatch.setattr(fml.debouncer, 'window', 0)
+    monkeypatch.setattr(fml, 'sockhub', None)
+    monkeypatch.setattr(fml, 'rack_sink', None)
+    monkeypatch.setattr(fml, 'sinks', [])
+    monkeypatch.setattr(fml, 'shadow', DisplayShadow())
+    recorder = MessageRecorder()
+    fml.logger.addHandler(recorder)
+    fml.open_socket(local_address=('127.0.0.1', 0))
+    yield recorder
+    fml.close_sinks()
+    fml.sockhub.close()
+    fml.logger.removeHandler(recorder)
+
+
+def wait_for_frames(simulator, frames):
+    with simulator.state_changed:
+        simulator.state_changed.wait_for(lambda: simulator.frames_received >= frames, timeout=2)
+    return simulator.frames_received
+
+
+def test_scripted_picker_completes_tasks(controller):
+    pick_tasks = generate_pick_tasks(NUM_TASKS, bins_per_task=BINS_PER_TASK)
+    picker = ScriptedPicker.for_pick_tasks(pick_tasks)
+    simulator = RackSimulator(controller_address=fml.sockhub.getsockname(), picker=picker)
+    fml.rack_sink.address = simulator.address
+
+    # The start symbol, then per task: every display set, two updates per source
+    # bin pressed and the pressed displays cleared. Only the first reset is sent,
+    # the later ones find no display lit.
+    expected_frames = 1 + NUM_TASKS * ((BINS_PER_TASK + 1) + 2 * BINS_PER_TASK + (BINS_PER_TASK + 1)) + 1
+    with simulator:
+        fml.run_all_pick_tasks(pick_tasks, task_pause=0)
+        assert wait_for_frames(simulator, expected_frames) == expected_frames
+
+    assert len([message for message in controller.messages if message.startswith('TASK END')]) == NUM_TASKS
+    assert simulator.presses_sent == len(picker.tags) == NUM_TASKS * (BINS_PER_TASK + 1) + 1
+    assert set(simulator.displays.values()) == {EMPTY_LIGHT_LAYOUT}
@@ -0,0 +1,68 @@
+import os
+import replay
+
+LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'logs')
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# A session of fml.py against the RackSimulator, with a picker pressing wrong buttons now and then
+FIXTURE_LOG = os.path.join(FIXTURES_DIR, 'replay-pick-by-light_button-testing.log')
+FIXTURE_JSONL = os.path.join(FIXTURES_DIR, 'replay-pick-by-light_button-testing.jsonl')
+FIXTURE_TASK_FILE = os.path.join(FIXTURES_DIR, 'replay-pick-by-light_button-tasks.json')
+
+SESSION_LOG = '''\
+2026-01-05 10:00:00,000 : fml.py         : INFO     : TASK START: Task ID=1, Order ID=4, 2 bins (A11 A12), Receive bin C11
+2026-01-05 10:00:00,001 : fml.py         : DEBUG    : Setting display A11 = 2
+2026-01-05 10:00:00,001 : fml.py         : DEBUG    : Setting display A12 = 3
+2026-01-05 10:00:00,001 : fml.py         : DEBUG    : Setting display C11 = 5
+2026-01-05 10:00:01,000 : fml.py         : DEBUG    : Subject pressed A12.
+2026-01-05 10:00:01,001 : fml.py         : DEBUG    : A12 with 3 items was pressed. Decrementing total to 2
+2026-01-05 10:00:02,000 : fml.py         : DEBUG    : Subject pressed B11.
+2026-01-05 10:00:02,000 : fml.py         : WARNING  : Unexpected button pressed: B11
+2026-01-05 10:00:03,000 : fml.py         : DEBUG    : Subject pressed A11.
+2026-01-05 10:00:03,001 : fml.py         : DEBUG    : A11 with 2 items was pressed. Decrementing total to 0
+2026-01-05 10:00:04,000 : fml.py         : DEBUG    : Subject pressed C11.
+2026-01-05 10:00:04,001 : fml.py         : DEBUG    : Clearing display A12
+2026-01-05 10:00:04,001 : fml.py         : DEBUG    : Clearing display A11
+2026-01-05 10:00:04,001 : fml.py         : DEBUG    : Clearing display C11
+2026-01-05 10:00:04,002 : fml.py         : INFO     : TASK END: Task ID=1, Order ID=4, 2 bins (A11 A12), Receive bin C11
+'''
+
+
+def test_committed_light_logs_are_legacy():
+    for name in ['theo-pick-by-light_button-testing.log', 'charu-pick-by-light_button-training.log']:
+        session = replay.read_session(os.path.join(LOGS_DIR, name))
+        assert session.kind == replay.LIGHT
+        assert session.legacy
+
+
+def test_replay_of_current_log_matches(tmp_path):
+    filename = str(tmp_path / 'subject-pick-by-light_button-testing.log')
+    with open(filename, 'w') as f:
+        f.write(SESSION_LOG)
+    session = replay.read_session(filename)
+    assert not session.legacy and session.has_displays
+    assert session.num_inputs == 4
+
+    result = replay.replay_session(session)
+    assert result.diff == []
+
+
+def test_replay_reports_divergence(tmp_path):
+    filename = str(tmp_path / 'subject-pick-by-light_button-testing.log')
+    with open(filename, 'w') as f:
+        f.write(SESSION_LOG.replace('Decrementing total to 2', 'Decrementing total to 1'))
+    result = replay.replay_session(replay.read_session(filename))
+    assert '-C11 = 1' in result.diff and '+C11 = 2' in result.diff
+
+
+def test_replay_of_recorded_session_matches():
+    sessions = [replay.read_session(filename) for filename in [FIXTURE_LOG, FIXTURE_JSONL]]
+    for session in sessions:
+        assert not session.legacy and session.has_displays
+        assert len(session.tasks) == 6 and session.num_inputs == 22
+
+        assert replay.replay_session(session).diff == []
+        assert replay.replay_session(session, task_file=FIXTURE_TASK_FILE).diff == []
+
+    # Both formats of the log record the same session
+    assert sessions[0].original_lines() == sessions[1].original_lines()
@@ -0,0 +1,41 @@
+import json
+import queued_logging
+import scanners
+from models import PickingTask, ReceiveBin, SourceBin
+
+
+def make_stations():
+    return {
+        'left': [PickingTask(1, 4, 'A', [SourceBin('A11', 2), SourceBin('A12', 1)], ReceiveBin('C11', 3))],
+        'right': [PickingTask(2, 5, 'A', [SourceBin('A21', 1)], ReceiveBin('C11', 1))],
+    }
+
+
+def test_tag_index_lists_each_station_once():
+    stations = make_stations()
+    stations['left'].append(PickingTask(3, 6, 'A', [SourceBin('A11', 1)], ReceiveBin('C12', 1)))
+    index = scanners.TagIndex(stations)
+    assert index.stations('A11') == ['left']
+    assert sorted(index.stations('C11')) == ['left', 'right']
+    assert index.stations('B99') == []
+
+
+def test_router_writes_one_log_per_station(tmp_path):
+    log_filename = str(tmp_path / 'subject.log')
+    router = scanners.ScanRouter(make_stations(), on_error=None, log_filename=log_filename)
+    router.stations['left'].start()
+    for line in ['left ]C01A12', 'left ]C01A11', 'left ]C01B11', 'left ]C01C11']:
+        router.feed_line(line, 'test')
+    queued_logging.writer.flush()
+
+    with open(str(tmp_path / 'subject-left.log')) as f:
+        log = f.read()
+    assert 'check_barcode.py:left' in log and 'TASK END: Task ID=1' in log
+    with open(str(tmp_path / 'subject-left.jsonl')) as f:
+        events = [json.loads(line).get('event') for line in f]
+    assert events.count('scan') == 3 and events.count('unexpected_scan') == 1
+    assert not (tmp_path / 'subject-right.log').read_text()
+
+    # Building another router does not add the handlers again
+    scanners.ScanRouter(make_stations(), on_error=None, log_filename=log_filename)
+    assert len(router.stations['left'].log.handlers) == 3
@@ -0,0 +1,112 @@
+import time
+from constants import ALL_DISPLAYS
+from metrics import Metrics
+from scheduler import SendScheduler
+
+ADDRESS = ('127.0.0.1', 3865)
+
+
+class Recorder(object):
+    def __init__(self):
+        self.frames = []
+
+    def __call__(self, frame, address):
+        self.frames.append(frame)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_newer_frame_supersedes_pending_one():
+    metrics = Metrics()
+    scheduler = SendScheduler(Recorder(), rate=None, metrics=metrics)
+    scheduler.submit('A11', 1, b'A11=1', ADDRESS)
+    scheduler.submit('A11', 2, b'A11=2', ADDRESS)
+    assert [pending.frame for pending in scheduler.bulk_lane.values()] == [b'A11=2']
+    assert scheduler.superseded == 1
+    assert metrics.counters['scheduler_superseded'] == 1
+
+
+def test_priority_frame_drops_pending_bulk_frame():
+    scheduler = SendScheduler(Recorder(), rate=None)
+    scheduler.submit('A11', 1, b'bulk', ADDRESS)
+    scheduler.submit('A12', 1, b'other', ADDRESS)
+    scheduler.submit('A11', 2, b'priority', ADDRESS, priority=True)
+    assert list(scheduler.priority_lane) == ['A11']
+    assert list(scheduler.bulk_lane) == ['A12']
+
+
+def test_all_displays_frame_supersedes_everything():
+    scheduler = SendScheduler(Recorder(), rate=None)
+    scheduler.submit('A11', 1, b'a', ADDRESS, priority=True)
+    scheduler.submit('A12', 1, b'b', ADDRESS)
+    scheduler.submit(ALL_DISPLAYS, 0, b'all', ADDRESS)
+    assert list(scheduler.bulk_lane) == [ALL_DISPLAYS] and not scheduler.priority_lane
+    assert scheduler.superseded == 2
+
+
+def test_sends_priority_first_and_reports_metrics():
+    send = Recorder()
+    metrics = Metrics()
+    scheduler = SendScheduler(send, rate=None, metrics=metrics)
+    scheduler.submit('A11', 1, b'bulk', ADDRESS)
+    scheduler.submit('A12', 1, b'priority', ADDRESS, priority=True, pressed_at=time.monotonic())
+    scheduler.start()
+    assert scheduler.drain(timeout=5)
+    scheduler.stop()
+
+    assert send.frames == [b'priority', b'bulk']
+    assert scheduler.stats()['sent'] == 2
+    assert metrics.counters['scheduler_sent'] == 2
+    assert metrics.histograms['scheduler_send_latency'].count == 2
+    # Only the frame answering a press is timed from it, when it is actually sent
+    assert metrics.histograms['press_to_send'].count == 1
+
+
+def test_failed_verification_is_retried():
+    send = Recorder()
+    metrics = Metrics()
+    scheduler = SendScheduler(send, rate=None, verify=lambda display, layout: False, retries=2, verify_delay=0,
+                              metrics=metrics)
+    scheduler.submit('A11', 1, b'frame', ADDRESS, pressed_at=time.monotonic())
+    scheduler.start()
+    assert wait_until(lambda: scheduler.retried == 2 and scheduler.drain(timeout=1))
+    scheduler.stop()
+
+    assert send.frames == [b'frame'] * 3
+    assert scheduler.verify_failures == 2
+    assert metrics.counters['scheduler_retries'] == 2
+    # Re-sends are not timed from the press again
+    assert metrics.histograms['press_to_send'].count == 1
+
+
+def test_repeats_are_not_verification_failures():
+    send = Recorder()
+    metrics = Metrics()
+    scheduler = SendScheduler(send, rate=None, repeats=2, verify_delay=0, metrics=metrics)
+    scheduler.submit('A11', 1, b'frame', ADDRESS)
+    scheduler.start()
+    assert wait_until(lambda: scheduler.repeated == 2 and scheduler.drain(timeout=1))
+    scheduler.stop()
+
+    assert send.frames == [b'frame'] * 3
+    stats = scheduler.stats()
+    assert stats['repeated'] == 2 and stats['retried'] == 0 and stats['verify_failures'] == 0
+    assert metrics.counters['scheduler_repeats'] == 2 and 'scheduler_retries' not in metrics.counters
+
+
+def test_newer_frame_cancels_repeats():
+    send = Recorder()
+    scheduler = SendScheduler(send, rate=None, repeats=1, verify_delay=0.05)
+    scheduler.start()
+    scheduler.submit('A11', 1, b'old', ADDRESS)
+    assert wait_until(lambda: send.frames)
+    scheduler.submit('A11', 2, b'new', ADDRESS)
+    assert wait_until(lambda: scheduler.repeated == 1 and scheduler.drain(timeout=1))
+    scheduler.stop()
+
+    assert send.frames == [b'old', b'new', b'new']
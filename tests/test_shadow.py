@@ -0,0 +1,96 @@
+import pytest
+import fml
+from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT
+from frames import FRAMES, NUMBER_LAYOUTS
+from shadow import DisplayShadow
+from sinks import DisplaySink, RecordingSink
+
+
+class FailingSink(DisplaySink):
+    def send(self, update, priority=True):
+        raise OSError('rack unreachable')
+
+
+@pytest.fixture
+def rack(monkeypatch):
+    """Gives fml a fresh shadow and a sink recording the updates sent."""
+    sink = RecordingSink()
+    monkeypatch.setattr(fml, 'shadow', DisplayShadow())
+    monkeypatch.setattr(fml, 'sinks', [sink])
+    return sink
+
+
+def frames(sink):
+    return [update.frame for update in sink.updates]
+
+
+def test_shadow_skips_unchanged_displays():
+    shadow = DisplayShadow()
+    assert shadow.needs_update('A11', 5)
+    shadow.update('A11', 5)
+    assert not shadow.needs_update('A11', 5)
+    assert shadow.skipped == 1
+    assert shadow.needs_update('A11', 6)
+
+
+def test_shadow_syncs_on_all_displays():
+    shadow = DisplayShadow()
+    shadow.update('A11', 5)
+    assert shadow.needs_update(ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT)
+    shadow.update(ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT)
+    assert shadow.synced and not shadow.needs_update(ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT)
+    assert shadow.lit_displays() == []
+
+    shadow.invalidate(ALL_DISPLAYS)
+    assert not shadow.synced and shadow.needs_update('A11', EMPTY_LIGHT_LAYOUT)
+
+
+def test_batch_commits_to_shadow_after_sending(rack):
+    with fml.DisplayBatch() as batch:
+        batch.set('A11', number=3)
+        batch.set('C11', layout=RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
+        assert fml.shadow.layouts == {}
+    assert frames(rack) == [FRAMES.number('A11', 3), FRAMES.layout('C11', RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)]
+    assert dict(fml.shadow.items()) == {'A11': NUMBER_LAYOUTS[3], 'C11': RECEIVE_BIN_INITIAL_LIGHT_LAYOUT}
+
+    # Unchanged displays are skipped on the next batch
+    with fml.DisplayBatch() as batch:
+        batch.set('A11', number=3)
+        batch.set('A12', number=4)
+    assert frames(rack)[2:] == [FRAMES.number('A12', 4)]
+
+
+def test_reset_clears_only_lit_displays(rack):
+    fml.reset()
+    assert frames(rack) == [FRAMES.layout(ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT)]
+    fml.ChangeDisplay('A11', number=3)
+    fml.reset()
+    assert frames(rack)[2:] == [FRAMES.layout('A11', EMPTY_LIGHT_LAYOUT)]
+    fml.reset(force=True)
+    assert frames(rack)[3:] == [FRAMES.layout(ALL_DISPLAYS, EMPTY_LIGHT_LAYOUT)]
+
+
+def test_failed_batch_leaves_displays_unknown(rack, monkeypatch):
+    fml.ChangeDisplay('A11', number=3)
+    monkeypatch.setattr(fml, 'sinks', [FailingSink()])
+
+    batch = fml.DisplayBatch()
+    batch.set('A11', number=5)
+    batch.set('A12', number=4)
+    with pytest.raises(OSError):
+        batch.flush()
+    # Part of the batch may have gone out, so neither value is trusted
+    assert dict(fml.shadow.items()) == {}
+
+    # So setting the old value again is sent rather than skipped
+    monkeypatch.setattr(fml, 'sinks', [rack])
+    fml.ChangeDisplay('A11', number=3)
+    assert frames(rack) == [FRAMES.number('A11', 3)] * 2
+
+
+def test_failed_change_display_leaves_display_unknown(rack, monkeypatch):
+    fml.ChangeDisplay('A11', number=3)
+    monkeypatch.setattr(fml, 'sinks', [FailingSink()])
+    with pytest.raises(OSError):
+        fml.ChangeDisplay('A11', number=5)
+    assert 'A11' not in fml.shadow.layouts
@@ -0,0 +1,87 @@
+import time
+from constants import EMPTY_LIGHT_LAYOUT, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT, BLANK_DISPLAY
+from frames import FRAMES, NUMBER_LAYOUTS
+from metrics import Metrics
+from scheduler import SendScheduler
+from shadow import DisplayShadow
+from sinks import RecordingSink, UdpRackSink, UpdateBatch, build_update, send_update, visualizer_value
+
+ADDRESS = ('127.0.0.1', 3865)
+
+
+class RecordingSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, frame, address):
+        self.sent.append((frame, address))
+        return len(frame)
+
+
+def test_build_update():
+    update = build_update('A11', number=103)
+    assert update.rack_value == NUMBER_LAYOUTS[3] and update.frame == FRAMES.number('A11', 103)
+    update = build_update('C11', layout=RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
+    assert update.rack_value == RECEIVE_BIN_INITIAL_LIGHT_LAYOUT
+    assert update.frame == FRAMES.layout('C11', RECEIVE_BIN_INITIAL_LIGHT_LAYOUT)
+
+
+def test_udp_rack_sink_sends_directly():
+    sock = RecordingSocket()
+    sink = UdpRackSink(sock, ADDRESS)
+    updates = [build_update('A11', number=1), build_update('A12', number=2)]
+
+    assert sink.send(updates[0]) == len(updates[0].frame)
+    assert sink.send_batch(updates) == sum(len(update.frame) for update in updates)
+    assert sock.sent == [(updates[0].frame, ADDRESS), (updates[0].frame, ADDRESS), (updates[1].frame, ADDRESS)]
+
+
+def test_udp_rack_sink_times_frames_answering_a_press():
+    metrics = Metrics()
+    sink = UdpRackSink(RecordingSocket(), ADDRESS, metrics=metrics)
+    sink.send(build_update('A11', number=1))
+    assert 'press_to_send' not in metrics.histograms
+
+    sink.pressed_at = time.monotonic()
+    sink.send(build_update('A11', number=0))
+    sink.send_batch([build_update('A12', number=2), build_update('C11', number=1)])
+    assert metrics.histograms['press_to_send'].count == 3
+
+
+def test_udp_rack_sink_queues_on_scheduler():
+    sock = RecordingSocket()
+    scheduler = SendScheduler(sock.sendto, rate=None)
+    sink = UdpRackSink(sock, ADDRESS, scheduler)
+
+    sink.send(build_update('A11', number=1))
+    sink.send_batch([build_update('A11', number=2), build_update('A12', number=3)])
+    assert sock.sent == []
+    assert list(scheduler.priority_lane) == [] and list(scheduler.bulk_lane) == ['A11', 'A12']
+
+    # Closing sends what is queued and stops the scheduler
+    scheduler.start()
+    sink.close()
+    assert sink.scheduler is None
+    assert [frame for frame, address in sock.sent] == [FRAMES.number('A11', 2), FRAMES.number('A12', 3)]
+
+
+def test_recording_sink_tracks_displays():
+    sink = RecordingSink()
+    shadow = DisplayShadow()
+    with UpdateBatch([sink], shadow) as batch:
+        batch.set('A11', number=1)
+        batch.set('A12', number=2)
+    send_update([sink], shadow, build_update('A11', layout=EMPTY_LIGHT_LAYOUT))
+    # Unchanged, so not sent
+    send_update([sink], shadow, build_update('A12', number=2))
+
+    assert [update.display for update in sink.updates] == ['A11', 'A12', 'A11']
+    assert sink.displays() == {'A11': EMPTY_LIGHT_LAYOUT, 'A12': NUMBER_LAYOUTS[2]}
+    sink.clear()
+    assert sink.updates == []
+
+
+def test_visualizer_value():
+    assert visualizer_value(7, None) == 7
+    assert visualizer_value(None, EMPTY_LIGHT_LAYOUT) is BLANK_DISPLAY
+    assert visualizer_value(None, RECEIVE_BIN_INITIAL_LIGHT_LAYOUT) == RECEIVE_BIN_INITIAL_LIGHT_LAYOUT
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import async_engine
+import stations
+import task_cache
+from constants import EMPTY_LIGHT_LAYOUT
+from frames import FRAMES
+from metrics import Metrics
+from models import SourceBin, ReceiveBin, PickingTask
+
+TASK_DOCUMENT = {
+    'version': '1.2',
+    'tasks': [{'taskId': 1, 'orders': [
+        {'orderId': 4, 'receivingBinTag': 'C11', 'sourceBins': [{'binTag': 'A11', 'numItems': 2},
+                                                                 {'binTag': 'A12', 'numItems': 1}]},
+    ]}],
+}
+
+
+def make_station(tmp_path, name='left', receive_bins=('C11',)):
+    task_file = tmp_path / ('tasks-%s.json' % name)
+    task_file.write_text(json.dumps(TASK_DOCUMENT))
+    return stations.Station.from_config({'name': name, 'task_file': str(task_file), 'racks': ['A', 'B'],
+                                         'receive_bins': list(receive_bins)})
+
+
+def test_from_config_loads_through_task_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    station = make_station(tmp_path)
+    assert [pick_task.rack for pick_task in station.pick_tasks] == ['A', 'B']
+    assert station.pick_tasks[0].source_bins_in_dict == {'A11': 2, 'A12': 1}
+    assert list((tmp_path / task_cache.CACHE_DIR).iterdir())
+
+
+def test_dispatchers_share_station_log_handlers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_filename = str(tmp_path / 'subject.log')
+    station = make_station(tmp_path, 'dispatched')
+    first = stations.StationDispatcher([station], log_filename=log_filename)
+    second = stations.StationDispatcher([station], log_filename=log_filename)
+
+    log = first.controllers['dispatched'].log
+    assert log is second.controllers['dispatched'].log
+    # Console, station log and its JSONL twin
+    assert len(log.handlers) == 3
+    assert (tmp_path / 'subject-dispatched.log').exists()
+    assert (tmp_path / 'subject-dispatched.jsonl').exists()
+
+
+class RecordingTransport(object):
+    def __init__(self):
+        self.frames = []
+
+    def sendto(self, frame, address):
+        self.frames.append(frame)
+
+
+def test_stations_share_one_paced_rack_sink(monkeypatch):
+    schedulers = []
+
+    def create_scheduler(transport, rate, metrics=None):
+        schedulers.append(async_engine.create_scheduler(transport, rate, metrics=metrics))
+        return schedulers[-1]
+
+    monkeypatch.setattr(stations, 'create_scheduler', create_scheduler)
+    left = stations.Station('left', [PickingTask(1, 1, 'A', [SourceBin('A11', 1)], ReceiveBin('C11', 1))],
+                            ['A11'], ['C11'])
+    right = stations.Station('right', [PickingTask(2, 2, 'B', [SourceBin('B11', 2)], ReceiveBin('C12', 2))],
+                             ['B11'], ['C12'])
+    metrics = Metrics()
+    dispatcher = stations.StationDispatcher([left, right], send_rate=None, metrics=metrics)
+    controllers = dispatcher.controllers.values()
+    assert all(controller.rack_sink is dispatcher.rack_sink for controller in controllers)
+    assert len({id(controller.shadow) for controller in controllers}) == 2
+
+    for tag in ['C11', 'C12', 'A11', 'B11', 'C11', 'C12']:
+        dispatcher.dispatch(tag)
+    transport = RecordingTransport()
+    assert asyncio.run(dispatcher.run(transport)) == [None, None]
+
+    # Every frame of both stations went through the one scheduler
+    assert len(schedulers) == 1 and schedulers[0].sent == len(transport.frames)
+    assert metrics.counters['scheduler_sent'] == len(transport.frames)
+    assert metrics.counters['tasks'] == 2
+    assert metrics.histograms['press_to_state_change'].count == 2
+    # Frames still queued may be superseded, but each display's last one goes out
+    for display in ['A11', 'C11', 'B11', 'C12']:
+        assert FRAMES.layout(display, EMPTY_LIGHT_LAYOUT) in transport.frames
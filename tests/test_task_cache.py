@@ -0,0 +1,63 @@
+import json
+import os
+import pytest
+import task_cache
+
+TASK_DOCUMENT = {
+    'version': '1.2',
+    'tasks': [{'taskId': 1, 'orders': [
+        {'orderId': 4, 'receivingBinTag': 'C11', 'sourceBins': [{'binTag': 'A11', 'numItems': 2},
+                                                                 {'binTag': 'B12', 'numItems': 1}]},
+    ]}],
+}
+
+
+def count_hashes(monkeypatch):
+    calls = []
+    file_hash = task_cache.file_hash
+    monkeypatch.setattr(task_cache, 'file_hash', lambda filename: calls.append(filename) or file_hash(filename))
+    return calls
+
+
+def test_cache_hit_skips_hashing_unchanged_file(tmp_path, monkeypatch):
+    task_file = tmp_path / 'tasks.json'
+    task_file.write_text(json.dumps(TASK_DOCUMENT))
+    cache_dir = str(tmp_path / 'cache')
+    calls = count_hashes(monkeypatch)
+
+    first = task_cache.load_picking_tasks(str(task_file), cache_dir)
+    assert len(calls) == 1
+    second = task_cache.load_picking_tasks(str(task_file), cache_dir)
+    assert len(calls) == 1
+    assert [str(pick_task) for pick_task in first] == [str(pick_task) for pick_task in second]
+
+
+def test_changed_file_is_hashed_again(tmp_path, monkeypatch):
+    task_file = tmp_path / 'tasks.json'
+    task_file.write_text(json.dumps(TASK_DOCUMENT))
+    cache_dir = str(tmp_path / 'cache')
+    calls = count_hashes(monkeypatch)
+    task_cache.load_picking_tasks(str(task_file), cache_dir)
+
+    task_file.write_text(json.dumps(TASK_DOCUMENT).replace('"numItems": 2', '"numItems": 3'))
+    stat = os.stat(str(task_file))
+    os.utime(str(task_file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    pick_tasks = task_cache.load_picking_tasks(str(task_file), cache_dir)
+    assert len(calls) == 2
+    assert pick_tasks[0].source_bins_in_dict == {'A11': 3}
+    # The entry of the old contents was replaced
+    assert len([entry for entry in os.listdir(cache_dir) if entry.endswith('.bin')]) == 1
+
+
+def test_rejects_other_versions_even_when_cached(tmp_path):
+    task_file = tmp_path / 'tasks.json'
+    task_file.write_text(json.dumps(dict(TASK_DOCUMENT, version='1.0')))
+    cache_dir = str(tmp_path / 'cache')
+
+    with pytest.raises(ValueError):
+        task_cache.load_picking_tasks(str(task_file), cache_dir)
+    assert task_cache.load_picking_tasks(str(task_file), cache_dir, expected_version=None)
+    # Now compiled, but still the wrong version
+    with pytest.raises(ValueError):
+        task_cache.load_task_document(str(task_file), cache_dir)
@@ -0,0 +1,75 @@
+import json
+import os
+import pytest
+from task_catalog import TaskCatalog, task_type_from_filename
+
+
+def task_document(num_tasks, version='1.2'):
+    return {'version': version, 'tasks': [{'taskId': task_id, 'orders': [
+        {'orderId': 1, 'receivingBinTag': 'C11', 'sourceBins': [{'binTag': 'A11', 'numItems': 2}]},
+        {'orderId': 2, 'receivingBinTag': 'C12', 'sourceBins': [{'binTag': 'B12', 'numItems': 1}]},
+    ]} for task_id in range(1, num_tasks + 1)]}
+
+
+def write_task_file(root, method, task_type, num_tasks, version='1.2'):
+    folder = root / method
+    folder.mkdir(exist_ok=True)
+    path = folder / ('tasks-%s-%s.json' % (method, task_type))
+    path.write_text(json.dumps(task_document(num_tasks, version)))
+    return path
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    # The catalog and the compiled task cache live under the working directory
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / 'output'
+    root.mkdir()
+    write_task_file(root, 'paper', 'training', 2)
+    write_task_file(root, 'paper', 'testing', 5)
+    write_task_file(root, 'pick-by-light_button', 'testing', 3, version='1.0')
+    return root
+
+
+def open_catalog(root):
+    return TaskCatalog.open(str(root), str(root.parent / 'catalog.json'))
+
+
+def test_find(root):
+    catalog = open_catalog(root)
+    assert [(entry.method, entry.task_type) for entry in catalog] == [
+        ('paper', 'testing'), ('paper', 'training'), ('pick-by-light_button', 'testing')]
+
+    testing, = catalog.find(method='paper', task_type='testing')
+    assert (testing.num_tasks, testing.num_orders, testing.version) == (5, 10, '1.2')
+    assert [entry.method for entry in catalog.find(task_type='testing')] == ['paper', 'pick-by-light_button']
+    assert [entry.method for entry in catalog.find(version='1.0')] == ['pick-by-light_button']
+    assert catalog.find(method='missing') == []
+
+
+def test_refresh_only_reindexes_changed_files(root, monkeypatch):
+    catalog = open_catalog(root)
+    indexed = []
+    index = TaskCatalog._index
+    monkeypatch.setattr(TaskCatalog, '_index', lambda self, path, *args: indexed.append(path) or
+                        index(self, path, *args))
+
+    # Loaded from the saved index, nothing to re-read
+    reopened = open_catalog(root)
+    assert not reopened.refresh() and indexed == []
+    assert reopened.entries == catalog.entries
+
+    changed = write_task_file(root, 'paper', 'testing', 7)
+    stat = os.stat(str(changed))
+    os.utime(str(changed), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    os.remove(str(root / 'paper' / 'tasks-paper-training.json'))
+
+    assert reopened.refresh()
+    assert indexed == [str(changed)]
+    assert [(entry.task_type, entry.num_tasks) for entry in reopened.find(method='paper')] == [('testing', 7)]
+
+
+def test_task_type_from_filename():
+    assert task_type_from_filename('paper', 'tasks-paper-training.json') == 'training'
+    assert task_type_from_filename('paper', 'old-training-tasks.json') == 'training'
+    assert task_type_from_filename('paper', 'old-tasks.json') == 'testing'
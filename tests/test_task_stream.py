@@ -0,0 +1,128 @@
+import io
+import json
+import random
+import pytest
+import task_cache
+import task_stream
+import utils
+from constants import RACKS, SOURCE_BINS, RECEIVE_BINS
+from models import SourceBin, PickingTask, ReceiveBin
+
+
+def parse_experiment_dictionary_before(experimentData):
+    """parseExperimentDictionary as it was before task_stream."""
+    tasks = experimentData['tasks']
+    taskIndex, orderIndex = 0, 0
+    tasksReturn = []
+    while taskIndex < len(tasks):
+        orders = tasks[taskIndex]['orders']
+        taskId = tasks[taskIndex]['taskId']
+
+        orderIndex = 0
+
+        tasks_in_order = []
+        while orderIndex < len(orders):
+
+            orderId = orders[orderIndex]['orderId']
+            receiveBin = orders[orderIndex]['receivingBinTag']
+
+            for rack in RACKS:
+                source_bins = []
+
+                cartTotal = 0
+                for source_bin in orders[orderIndex]['sourceBins']:
+                    if source_bin['binTag'][0] == rack:
+                        numItems = source_bin['numItems']
+                        source_bins.append(SourceBin(
+                            tag=source_bin['binTag'],
+                            count=numItems
+                        ))
+                        cartTotal += numItems
+
+                tasks_in_order.append(PickingTask(
+                    task_id=taskId,
+                    order_id=orderId,
+                    rack=rack,
+                    source_bins=source_bins,
+                    receive_bin=ReceiveBin(
+                        tag=receiveBin,
+                        expected_count=cartTotal,
+                    )
+                ))
+
+            orderIndex += 1
+
+        tasks_ordered_by_rack = sorted(tasks_in_order, key=lambda rack_orders: rack_orders.rack)
+
+        tasksReturn.extend(tasks_ordered_by_rack)
+
+        taskIndex += 1
+    return tasksReturn
+
+
+def make_task_document(num_tasks, seed):
+    """Returns task file contents shaped like the study's, with a random number of orders and bins."""
+    rng = random.Random(seed)
+    return {
+        'version': '1.2',
+        'tasks': [{
+            'taskId': task_id,
+            'orders': [{
+                'orderId': order_id,
+                'receivingBinTag': rng.choice(RECEIVE_BINS),
+                'sourceBins': [{'binTag': tag, 'numItems': rng.randint(1, 12)}
+                               for tag in rng.sample(SOURCE_BINS, rng.randint(0, 6))],
+            } for order_id in range(1, rng.randint(1, 5))],
+        } for task_id in range(1, num_tasks + 1)],
+    }
+
+
+# Training and testing sized files, and a task without orders
+TASK_DOCUMENTS = [make_task_document(4, seed=1), make_task_document(40, seed=2),
+                  {'tasks': [{'taskId': 1, 'orders': []}], 'version': '1.2'}]
+
+
+def as_tuples(pick_tasks):
+    return [(pick_task.task_id, pick_task.order_id, pick_task.rack, pick_task.source_bins, pick_task.receive_bin)
+            for pick_task in pick_tasks]
+
+
+def test_parse_experiment_dictionary_matches_old_parser():
+    for document in TASK_DOCUMENTS:
+        assert as_tuples(utils.parseExperimentDictionary(document)) == \
+            as_tuples(parse_experiment_dictionary_before(document))
+
+
+def test_task_stream_matches_old_parser():
+    for document in TASK_DOCUMENTS:
+        text = json.dumps(document, indent=2)
+        expected = as_tuples(parse_experiment_dictionary_before(document))
+        assert as_tuples(task_stream.iter_picking_tasks(io.StringIO(text))) == expected
+
+        # Small chunks, so values straddle chunk boundaries
+        stream = task_stream.TaskFileStream(io.StringIO(text), chunk_size=7)
+        assert as_tuples(pick_task for task in stream for pick_task in task_stream.picking_tasks_for_task(task)) == \
+            expected
+
+
+def test_task_stream_rejects_other_versions():
+    document = dict(TASK_DOCUMENTS[0], version='1.0')
+    with pytest.raises(ValueError):
+        list(task_stream.iter_picking_tasks(io.StringIO(json.dumps(document))))
+    # Unless any version is accepted
+    assert list(task_stream.iter_picking_tasks(io.StringIO(json.dumps(document)), expected_version=None))
+
+    # The version is also checked when it comes after the tasks
+    text = '{"tasks": %s, "version": "1.0"}' % json.dumps(TASK_DOCUMENTS[0]['tasks'])
+    with pytest.raises(ValueError):
+        list(task_stream.iter_picking_tasks(io.StringIO(text)))
+
+
+def test_task_cache_matches_old_parser(tmp_path):
+    for i, document in enumerate(TASK_DOCUMENTS):
+        task_file = tmp_path / ('tasks-%d.json' % i)
+        task_file.write_text(json.dumps(document))
+        expected = as_tuples(parse_experiment_dictionary_before(document))
+        # Compiled on the first load, read from the cache on the second
+        for _ in range(2):
+            assert as_tuples(task_cache.load_picking_tasks(str(task_file), str(tmp_path / 'cache'))) == expected
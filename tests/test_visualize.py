@@ -0,0 +1,119 @@
+import pytest
+import visualize
+from constants import ALL_DISPLAYS
+from visualize import LightRackVisualizer, LAYOUT, BLANK_DISPLAY
+
+
+class FakeRoot(object):
+    def __init__(self):
+        self.timers = []
+
+    def title(self, title):
+        pass
+
+    def after(self, ms, function):
+        self.timers.append((ms, function))
+
+
+class FakeCanvas(object):
+    """Records canvas calls instead of drawing them."""
+
+    def __init__(self, master=None, **options):
+        self.master = FakeRoot()
+        self.items = {}
+        self.calls = []
+
+    def pack(self):
+        pass
+
+    def update(self):
+        self.calls.append(('update', ))
+
+    def _create(self, kind, options):
+        item = len(self.items) + 1
+        self.items[item] = dict(options, kind=kind)
+        return item
+
+    def create_rectangle(self, *coords, **options):
+        return self._create('rectangle', options)
+
+    def create_text(self, *coords, **options):
+        return self._create('text', options)
+
+    def itemconfigure(self, item, **options):
+        self.calls.append(('itemconfigure', item))
+        self.items[item].update(options)
+
+    def delete(self, *items):
+        self.calls.append(('delete', ) + items)
+
+
+@pytest.fixture
+def visualizer(monkeypatch):
+    monkeypatch.setattr(visualize.tk, 'Tk', FakeRoot)
+    monkeypatch.setattr(visualize.tk, 'Canvas', FakeCanvas)
+    return LightRackVisualizer()
+
+
+def configured_items(canvas):
+    return {call[1] for call in canvas.calls if call[0] == 'itemconfigure'}
+
+
+def test_index_matches_layout(visualizer):
+    for bin_tag, (r, c) in visualizer.bin_locations.items():
+        assert LAYOUT[r][c] == bin_tag
+    assert sorted(visualizer.bin_locations) == sorted(visualize.BINS)
+    assert visualizer._get_bin_location('Z99') is None
+
+
+def test_change_display_only_touches_changed_bin(visualizer):
+    canvas = visualizer.canvas
+    visualizer.change_display('A11', 3)
+    assert canvas.calls == []
+    assert visualizer.flush() == {'A11'}
+    assert configured_items(canvas) == set(visualizer.bin_items['A11'])
+    rectangle, text = visualizer.bin_items['A11']
+    assert canvas.items[rectangle]['state'] == visualize.tk.NORMAL
+    assert canvas.items[text]['text'] == '03'
+
+    canvas.calls = []
+    visualizer.change_display('A11', BLANK_DISPLAY)
+    visualizer.flush()
+    assert configured_items(canvas) == set(visualizer.bin_items['A11'])
+    assert canvas.items[rectangle]['state'] == visualize.tk.HIDDEN
+    assert canvas.items[text]['text'] == 'A11'
+
+
+def test_all_displays_clears_lit_bins_without_redrawing(visualizer):
+    canvas = visualizer.canvas
+    visualizer.change_display('A11', 3)
+    visualizer.change_display('C12', 1)
+    visualizer.flush()
+    item_count = len(canvas.items)
+
+    canvas.calls = []
+    visualizer.change_display(ALL_DISPLAYS, BLANK_DISPLAY)
+    visualizer.flush()
+    assert configured_items(canvas) == set(visualizer.bin_items['A11'] + visualizer.bin_items['C12'])
+    assert not [call for call in canvas.calls if call[0] == 'delete']
+    assert len(canvas.items) == item_count
+    assert visualizer.active_bins == {}
+
+
+def test_burst_costs_one_repaint_per_frame(visualizer):
+    canvas = visualizer.canvas
+    for value in range(10):
+        visualizer.change_display('A11', value)
+
+    # A frame tick applies the whole burst and schedules the next tick
+    visualizer._on_frame()
+    calls = [call[1] for call in canvas.calls if call[0] == 'itemconfigure']
+    assert sorted(calls) == sorted(visualizer.bin_items['A11'])
+    assert canvas.items[visualizer.bin_items['A11'][1]]['text'] == '09'
+    assert visualizer.frames_rendered == 1 and visualizer.updates_applied == 10
+    assert visualizer.tk_main.timers[-1] == (visualizer.frame_interval_ms, visualizer._on_frame)
+
+    # Nothing queued, nothing redrawn
+    canvas.calls = []
+    assert visualizer.flush() == set()
+    assert canvas.calls == [] and visualizer.frames_rendered == 1
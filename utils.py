@@ -1,38 +1,54 @@
 import json
 import os
 import logging
-from models import SourceBin, PickingTask, ReceiveBin
-from constants import RACKS
+import queued_logging
+from task_stream import picking_tasks_for_task
+import task_cache
+from task_catalog import TaskCatalog, format_entry
 
 
-def get_pick_paths_from_user_choice():
-    """ Allows a user to select pick paths and then parses the selected JSON file. """
-    selected_filename = choose_pick_path_file()
-    data = readJsonFile(selected_filename)
-    pickpaths = parseExperimentDictionary(data)
-    return pickpaths
+def get_pick_paths_from_user_choice(stream=False, method=None, task_type=None, task_file=None):
+    """ Allows a user to select pick paths and then parses the selected JSON file.
 
+    The tasks are loaded through the compiled task cache, see task_cache. With
+    `stream`, returns a generator instead, which on a cache miss reads the file
+    as the tasks are consumed.
 
-def choose_pick_path_file():
-    """ Interacts with the console so the user can select a pick path to run. """
-    study_folders_path = os.path.join('.', 'RFID-Study-Task-Generation', 'output')
+    Without prompting, `task_file` selects a file by path, and `method` and
+    `task_type` select it from the task catalog.
+    """
+    if task_file is not None:
+        selected_filename = task_file
+    else:
+        selected_filename = choose_pick_path_file(method, task_type)
+    if stream:
+        return task_cache.iter_picking_tasks(selected_filename)
+    return task_cache.load_picking_tasks(selected_filename)
 
-    file_number_to_file = {}
-    i = 1
-    print('Choose from the files below:')
 
-    # Iterate through all folders and pick path files
-    for folder_name in os.listdir(study_folders_path):
-        folder_path = os.path.join(study_folders_path, folder_name)
-        for file_name in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file_name)
-            # Display the option
-            print('%-3d %s' % (i, file_name))
+def choose_pick_path_file(method=None, task_type=None):
+    """ Interacts with the console so the user can select a pick path to run.
+
+    If `method` or `task_type` is given, the single task file of the catalog
+    matching them is returned without prompting.
+    """
+    catalog = TaskCatalog.open()
+
+    if method is not None or task_type is not None:
+        entries = catalog.find(method, task_type)
+        if len(entries) != 1:
+            raise SystemExit('%d task files match method %s and type %s%s' % (
+                len(entries), method, task_type,
+                ''.join('\n  %s' % entry.path for entry in entries)))
+        return entries[0].path
 
-            # Register the file path for the printed file name
-            file_number_to_file[i] = file_path
+    file_number_to_file = {}
+    print('Choose from the files below:')
 
-            i += 1
+    # Numbered in the catalog's stable order
+    for i, entry in enumerate(catalog):
+        print(format_entry(i + 1, entry))
+        file_number_to_file[i + 1] = entry.path
 
     print()  # newline
 
@@ -57,19 +73,69 @@ def choose_pick_path_file():
 loggerFormatter = logging.Formatter('%(asctime)-20s : %(name)-14s : %(levelname)-8s : %(message)s')
 
 def configure_logger(logger, level=logging.DEBUG):
-    """ Configures the given logger to print messages at the given level. """
+    """ Configures the given logger to print messages at the given level.
+
+    Messages are printed by a background thread, see queued_logging.
+    """
     logger.setLevel(level)
     loggerHandler = logging.StreamHandler()
     loggerHandler.setLevel(level)
     loggerHandler.setFormatter(loggerFormatter)
-    logger.addHandler(loggerHandler)
+    logger.addHandler(queued_logging.queued(loggerHandler))
     return logger
 
-def configure_file_logger(logger, log_filename, level=logging.DEBUG):
+def configure_file_logger(logger, log_filename, level=logging.DEBUG, jsonl_filename=None):
+    """ Also writes the given logger's messages to a file, by a background thread.
+
+    With `jsonl_filename`, every record is also written there as a line of JSON.
+    """
     fileHandler = logging.FileHandler(log_filename)
     fileHandler.setFormatter(loggerFormatter)
     fileHandler.setLevel(level)
-    logger.addHandler(fileHandler)
+    logger.addHandler(queued_logging.queued(fileHandler))
+    if jsonl_filename is not None:
+        configure_jsonl_logger(logger, jsonl_filename, level)
+    return logger
+
+def configure_jsonl_logger(logger, jsonl_filename, level=logging.DEBUG):
+    """ Writes the given logger's records to a file as JSON lines, by a background thread. """
+    jsonlHandler = logging.FileHandler(jsonl_filename)
+    jsonlHandler.setFormatter(queued_logging.JsonLinesFormatter())
+    jsonlHandler.setLevel(level)
+    logger.addHandler(queued_logging.queued(jsonlHandler))
+    return logger
+
+def jsonl_filename_for(log_filename):
+    """ Returns the JSONL log written next to a log file, e.g. subject.jsonl for subject.log. """
+    return os.path.splitext(log_filename)[0] + '.jsonl'
+
+def station_log_filename(log_filename, station):
+    """ Returns the log of one station next to an experiment log, e.g. subject-left.log for subject.log. """
+    root, extension = os.path.splitext(log_filename)
+    return '%s-%s%s' % (root, station, extension or '.log')
+
+# Station logger name -> log file names it already writes to
+_station_log_filenames = {}
+
+def configure_station_logger(module_name, station, log_filename=None, level=logging.DEBUG):
+    """ Returns the logger of one station, named `<module_name>:<station>`, which prints its messages.
+
+    With `log_filename`, the station's messages are also written to its own log
+    and JSONL twin next to it, see station_log_filename. Handlers are only
+    added once, however many times the logger is configured.
+    """
+    name = '%s:%s' % (module_name, station)
+    logger = logging.getLogger(name)
+    log_filenames = _station_log_filenames.get(name)
+    if log_filenames is None:
+        log_filenames = _station_log_filenames[name] = set()
+        configure_logger(logger, level)
+        logger.propagate = False
+    if log_filename is not None:
+        station_filename = station_log_filename(log_filename, station)
+        if station_filename not in log_filenames:
+            log_filenames.add(station_filename)
+            configure_file_logger(logger, station_filename, level, jsonl_filename_for(station_filename))
     return logger
 
 
@@ -95,52 +161,9 @@ def parseExperimentDictionary(experimentData):
     Args:
         experimentData (dict): dictionary of structured experiment data
     """
-    tasks = experimentData['tasks']
-    taskIndex, orderIndex = 0, 0
     tasksReturn = []
-    while taskIndex < len(tasks):
-        orders = tasks[taskIndex]['orders']
-        taskId = tasks[taskIndex]['taskId']
-
-        orderIndex = 0
-
-        tasks_in_order = []
-        while orderIndex < len(orders):
-
-            orderId = orders[orderIndex]['orderId']
-            receiveBin = orders[orderIndex]['receivingBinTag']
-
-            for rack in RACKS:
-                source_bins = []
-
-                cartTotal = 0
-                for source_bin in orders[orderIndex]['sourceBins']:
-                    if source_bin['binTag'][0] == rack:
-                        numItems = source_bin['numItems']
-                        source_bins.append(SourceBin(
-                            tag=source_bin['binTag'],
-                            count=numItems
-                        ))
-                        cartTotal += numItems
-
-                tasks_in_order.append(PickingTask(
-                    task_id=taskId,
-                    order_id=orderId,
-                    rack=rack,
-                    source_bins=source_bins,
-                    receive_bin=ReceiveBin(
-                        tag=receiveBin,
-                        expected_count=cartTotal,
-                    )
-                ))
-
-            orderIndex += 1
-
-        tasks_ordered_by_rack = sorted(tasks_in_order, key=lambda rack_orders: rack_orders.rack)
-
-        tasksReturn.extend(tasks_ordered_by_rack)
-
-        taskIndex += 1
+    for task in experimentData['tasks']:
+        tasksReturn.extend(picking_tasks_for_task(task))
     return tasksReturn
 
 #
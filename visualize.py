@@ -3,13 +3,16 @@ import os
 import utils
 import time
 import random
-from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS
+import threading
+from constants import EMPTY_LIGHT_LAYOUT, ALL_DISPLAYS, BLANK_DISPLAY
 
 try:
     import Tkinter as tk
+    import Queue as queue
 except ImportError:
     # For Python 3.6+
     import tkinter as tk
+    import queue
 
 
 logger = logging.getLogger(os.path.basename(__file__))
@@ -32,41 +35,111 @@ CANVAS_CELL_HEIGHT = 40
 CANVAS_NUM_ROWS = 6
 CANVAS_NUM_COLS = 13
 
-BLANK_DISPLAY = None
 
+def index_layout(layout):
+    """Returns a dict mapping every bin tag in `layout` to its (row, column)."""
+    return {cell: (r, c) for r, row in enumerate(layout) for c, cell in enumerate(row) if cell is not None}
 
-class LightRackVisualizer(object):
-    def __init__(self):
 
-        self.tk_main = tk.Tk()
-        self.canvas = tk.Canvas(
-            master=self.tk_main,
-            width=CANVAS_CELL_WIDTH * CANVAS_NUM_COLS,
-            height=CANVAS_CELL_HEIGHT * CANVAS_NUM_ROWS)
-        self.canvas.pack()
-        self.canvas.master.title("Rack Visualization!")
+BIN_LOCATIONS = index_layout(LAYOUT)
+
+
+class LightRackVisualizer(object):
+    """Tk window mirroring what the rack's displays show.
+
+    The canvas is drawn once: every bin owns a cell outline, a highlight
+    rectangle and a text label, and an update only reconfigures the items of
+    the bins that changed.
+
+    `change_display` may be called from any thread and never touches Tk: it
+    queues the update, and a Tk timer drains the queue at most `max_fps`
+    times a second, so a burst of updates costs one repaint.
+
+    Args:
+        layout (list): rows of bin tags (None for empty cells) to draw
+        max_fps (float): maximum number of times per second the canvas is updated
+        canvas (Canvas): canvas to draw on, e.g. inside another window; by
+            default a window with a canvas of its own is created
+    """
+
+    def __init__(self, layout=LAYOUT, max_fps=30, canvas=None):
+        self.layout = layout
+        self.bin_locations = index_layout(layout)
+        num_rows = len(layout)
+        num_cols = max(len(row) for row in layout)
+
+        if canvas is None:
+            self.tk_main = tk.Tk()
+            self.canvas = tk.Canvas(
+                master=self.tk_main,
+                width=CANVAS_CELL_WIDTH * num_cols,
+                height=CANVAS_CELL_HEIGHT * num_rows)
+            self.canvas.pack()
+            self.canvas.master.title("Rack Visualization!")
+        else:
+            self.tk_main = getattr(canvas, 'master', None)
+            self.canvas = canvas
 
         self.active_bins = {}
 
+        self.updates = queue.Queue()
+        self.frame_interval_ms = max(1, int(1000 / max_fps))
+        self.frames_rendered = 0
+        self.updates_applied = 0
+
+        # Canvas item ids of each bin's highlight rectangle and text label
+        self.bin_items = {}
+        self._create_items()
+
     def run(self, alongside_function):
-        self.tk_main.after(1000, alongside_function)
+        """Runs `alongside_function` on its own thread while Tk runs on this one."""
+        thread = threading.Thread(target=alongside_function)
+        thread.daemon = True
+
+        self.tk_main.after(1000, thread.start)
+        self.tk_main.after(self.frame_interval_ms, self._on_frame)
         self.tk_main.mainloop()
 
     def change_display(self, bin_tag, value):
-        if bin_tag is ALL_DISPLAYS:
-            self.active_bins = {}
-        elif value is BLANK_DISPLAY:
-            self.active_bins.pop(bin_tag)
-        else:
-            self.active_bins[bin_tag] = value
+        self.updates.put((bin_tag, value))
+
+    def flush(self):
+        """Applies every queued update and redraws the bins that changed.
+
+        Returns:
+            changed_bins (set): tags of the bins whose items were reconfigured
+        """
+        changed_bins = set()
+        while True:
+            try:
+                bin_tag, value = self.updates.get_nowait()
+            except queue.Empty:
+                break
+
+            if bin_tag is ALL_DISPLAYS:
+                changed_bins.update(self.active_bins)
+                self.active_bins = {}
+            else:
+                changed_bins.add(bin_tag)
+                if value is BLANK_DISPLAY:
+                    self.active_bins.pop(bin_tag, None)
+                else:
+                    self.active_bins[bin_tag] = value
+            self.updates_applied += 1
+
+        for changed_bin in changed_bins:
+            self._render_bin(changed_bin)
 
-        self._render()
+        if changed_bins:
+            self.frames_rendered += 1
+        return changed_bins
+
+    def _on_frame(self):
+        self.flush()
+        self.tk_main.after(self.frame_interval_ms, self._on_frame)
 
     def _get_bin_location(self, bin_tag):
-        for r in range(CANVAS_NUM_ROWS):
-            for c in range(CANVAS_NUM_COLS):
-                if LAYOUT[r][c] == bin_tag:
-                    return r, c
+        return self.bin_locations.get(bin_tag)
 
     def _get_bin_color(self, bin_tag):
         if bin_tag[0] == 'C':
@@ -81,91 +154,45 @@ class LightRackVisualizer(object):
             return 'blue'
         raise ValueError('Unknown bin tag: %s' % bin_tag)
 
-    def _render(self):
-        self.canvas.delete('all')
-
-        # Render Rack A and B vertical lines
-        for c in range(1, 9):
-            self.canvas.create_line(
-                c * CANVAS_CELL_WIDTH,
-                1 * CANVAS_CELL_HEIGHT,
-                c * CANVAS_CELL_WIDTH,
-                5 * CANVAS_CELL_HEIGHT,
-                fill='black',
-            )
-
-        # Render Rack A and B horizontal lines
-        for r in range(1, 6):
-            # Rack A
-            self.canvas.create_line(
-                1 * CANVAS_CELL_WIDTH,
-                r * CANVAS_CELL_HEIGHT,
-                4 * CANVAS_CELL_WIDTH,
-                r * CANVAS_CELL_HEIGHT
-            )
+    def _create_items(self):
+        """Creates the canvas items for every bin; called once."""
+        for bin_tag, (r, c) in self.bin_locations.items():
+            x0, y0 = c * CANVAS_CELL_WIDTH, r * CANVAS_CELL_HEIGHT
+            x1, y1 = x0 + CANVAS_CELL_WIDTH, y0 + CANVAS_CELL_HEIGHT
 
-            # Rack B
-            self.canvas.create_line(
-                5 * CANVAS_CELL_WIDTH,
-                r * CANVAS_CELL_HEIGHT,
-                8 * CANVAS_CELL_WIDTH,
-                r * CANVAS_CELL_HEIGHT
-            )
+            # Cell outline (static grid)
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline='black')
 
-        # Render receive bins vertical lines
-        for c in range(9, 13):
-            self.canvas.create_line(
-                c * CANVAS_CELL_WIDTH,
-                2 * CANVAS_CELL_HEIGHT,
-                c * CANVAS_CELL_WIDTH,
-                3 * CANVAS_CELL_HEIGHT,
-                fill='black',
+            rectangle = self.canvas.create_rectangle(
+                x0, y0, x1, y1,
+                fill=self._get_bin_color(bin_tag),
+                state=tk.HIDDEN,
             )
-
-        # Render receive bins horizontal lines
-        for r in range(2, 4):
-            self.canvas.create_line(
-                9 * CANVAS_CELL_WIDTH,
-                r * CANVAS_CELL_HEIGHT,
-                12 * CANVAS_CELL_WIDTH,
-                r * CANVAS_CELL_HEIGHT
+            text = self.canvas.create_text(
+                (c + 0.5) * CANVAS_CELL_WIDTH,
+                (r + 0.5) * CANVAS_CELL_HEIGHT,
+                text=bin_tag,
+                anchor=tk.CENTER,
             )
+            self.bin_items[bin_tag] = (rectangle, text)
 
-        # Draw selected bins
-        for bin_tag in self.active_bins:
-            bin_r, bin_c = self._get_bin_location(bin_tag)
-            bin_color = self._get_bin_color(bin_tag)
-
-            self.canvas.create_rectangle(
-                bin_c * CANVAS_CELL_WIDTH,
-                bin_r * CANVAS_CELL_HEIGHT,
-                (bin_c + 1) * CANVAS_CELL_WIDTH,
-                (bin_r + 1) * CANVAS_CELL_HEIGHT,
-                fill=bin_color,
-            )
+    def _render_bin(self, bin_tag):
+        items = self.bin_items.get(bin_tag)
+        if items is None:
+            return
+        rectangle, text = items
 
-        # Add text labels
-        for r in range(CANVAS_NUM_ROWS):
-            for c in range(CANVAS_NUM_COLS):
-                bin_tag = LAYOUT[r][c]
-
-                if bin_tag is None:
-                    continue
-
-                if bin_tag in self.active_bins:
-                    bin_count = self.active_bins[bin_tag]
-                    text = '%02d' % (bin_count, )
-                else:
-                    text = bin_tag
-
-                self.canvas.create_text(
-                    (c + 0.5) * CANVAS_CELL_WIDTH,
-                    (r + 0.5) * CANVAS_CELL_HEIGHT,
-                    text=text,
-                    anchor=tk.CENTER,
-                )
+        if bin_tag in self.active_bins:
+            self.canvas.itemconfigure(rectangle, state=tk.NORMAL)
+            self.canvas.itemconfigure(text, text='%02d' % (self.active_bins[bin_tag], ))
+        else:
+            self.canvas.itemconfigure(rectangle, state=tk.HIDDEN)
+            self.canvas.itemconfigure(text, text=bin_tag)
 
-        self.canvas.update()
+    def _render(self):
+        """Brings every bin's items up to date with `active_bins`."""
+        for bin_tag in self.bin_items:
+            self._render_bin(bin_tag)
 
 
 if __name__ == '__main__':
@@ -190,6 +217,6 @@ if __name__ == '__main__':
 
             visualizer.change_display(random_bin, next_display)
 
-            # time.sleep(1)
+            time.sleep(0.001)
 
     visualizer.run(run_visualizer)